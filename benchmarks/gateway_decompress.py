@@ -0,0 +1,191 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+"""Benchmarks decompressing and parsing gateway traffic the way :class:`Shard` receives it.
+
+Run with ``python -m benchmarks.gateway_decompress``. Pass ``--record path`` to save the generated sample, or
+``--sample path`` to replay a recorded one. A sample is a file of length prefixed websocket frames as sent by discord.
+"""
+
+from __future__ import annotations
+
+import zlib
+from argparse import ArgumentParser
+from asyncio import get_running_loop, run
+from random import Random
+from struct import pack, unpack_from
+from time import perf_counter
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+
+from nextcord.core.gateway.exceptions import PartialDataException
+from nextcord.core.gateway.shard import Shard
+from nextcord.utils import json
+
+if TYPE_CHECKING:
+    from typing import Any, Optional
+
+
+def _member(rng: Random, index: int) -> dict[str, Any]:
+    return {
+        "user": {
+            "id": str(10**17 + index),
+            "username": f"user{index}",
+            "discriminator": f"{rng.randrange(10000):04}",
+            "avatar": "a" * 32 if rng.random() < 0.7 else None,
+        },
+        "roles": [str(10**17 + rng.randrange(200)) for _ in range(rng.randrange(5))],
+        "joined_at": "2021-08-28T12:00:00.000000+00:00",
+        "deaf": False,
+        "mute": False,
+    }
+
+
+def generate_events(messages: int = 20_000, seed: int = 0) -> list[dict[str, Any]]:
+    """Generate gateway payloads like a large bot receives
+
+    Most events are small messages and presences, some are guild creates and member chunks which are big.
+    """
+    rng = Random(seed)
+    events: list[dict[str, Any]] = []
+    for seq in range(messages):
+        kind = rng.random()
+        if kind < 0.6:
+            event, data = "MESSAGE_CREATE", {
+                "id": str(10**17 + seq),
+                "channel_id": str(10**17 + rng.randrange(1000)),
+                "guild_id": str(10**17 + rng.randrange(100)),
+                "author": _member(rng, rng.randrange(100_000))["user"],
+                "content": "hello world " * rng.randrange(1, 40),
+                "embeds": [],
+                "attachments": [],
+                "timestamp": "2021-08-28T12:00:00.000000+00:00",
+            }
+        elif kind < 0.97:
+            event, data = "PRESENCE_UPDATE", {
+                "user": {"id": str(10**17 + rng.randrange(100_000))},
+                "guild_id": str(10**17 + rng.randrange(100)),
+                "status": rng.choice(("online", "idle", "dnd", "offline")),
+                "activities": [],
+            }
+        else:
+            event, data = "GUILD_MEMBERS_CHUNK", {
+                "guild_id": str(10**17 + rng.randrange(100)),
+                "members": [_member(rng, i) for i in range(rng.randrange(100, 1000))],
+                "chunk_index": 0,
+                "chunk_count": 1,
+            }
+        events.append({"op": 0, "s": seq, "t": event, "d": data})
+    return events
+
+
+def generate_sample(messages: int = 20_000, seed: int = 0) -> list[bytes]:
+    """Generate gateway traffic like a large bot receives, compressed as a zlib-stream
+
+    Big messages are sometimes split over multiple frames.
+    """
+    rng = Random(seed)
+    compressor = zlib.compressobj()
+    frames: list[bytes] = []
+    for event in generate_events(messages, seed):
+        payload = json.dumps(event)
+        if isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        compressed = compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if len(compressed) > 4 * 1024 and rng.random() < 0.5:
+            # Split big messages over multiple frames
+            parts = rng.randrange(2, 5)
+            size = len(compressed) // parts + 1
+            frames.extend(compressed[i : i + size] for i in range(0, len(compressed), size))
+        else:
+            frames.append(compressed)
+    return frames
+
+
+def save_sample(path: str, frames: list[bytes]) -> None:
+    with open(path, "wb") as f:
+        for frame in frames:
+            f.write(pack("<I", len(frame)))
+            f.write(frame)
+
+
+def load_sample(path: str) -> list[bytes]:
+    with open(path, "rb") as f:
+        data = f.read()
+    frames = []
+    offset = 0
+    while offset < len(data):
+        (size,) = unpack_from("<I", data, offset)
+        offset += 4
+        frames.append(data[offset : offset + size])
+        offset += size
+    return frames
+
+
+async def measure(frames: list[bytes], repeat: int) -> dict[str, float]:
+    state = SimpleNamespace(loop=get_running_loop())
+    best = float("inf")
+    messages = 0
+    for _ in range(repeat):
+        shard = Shard(state, 0)  # type: ignore
+        messages = 0
+        started = perf_counter()
+        for frame in frames:
+            # The same as Shard._receive_loop without dispatching
+            try:
+                raw_data = shard._decompress(frame)
+            except PartialDataException:
+                continue
+            json.loads(raw_data)
+            messages += 1
+        best = min(best, perf_counter() - started)
+    compressed = sum(len(frame) for frame in frames)
+    return {
+        "messages": messages,
+        "frames": len(frames),
+        "seconds": best,
+        "messages_per_second": messages / best,
+        "compressed_mb_per_second": compressed / best / 1024 / 1024,
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark decompressing and parsing gateway traffic")
+    parser.add_argument("--sample", default=None, help="Replay a recorded sample instead of generating one")
+    parser.add_argument("--record", default=None, help="Save the generated sample to this path")
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    frames: Optional[list[bytes]] = load_sample(args.sample) if args.sample else None
+    if frames is None:
+        frames = generate_sample(args.messages)
+        if args.record:
+            save_sample(args.record, frames)
+
+    result = run(measure(frames, args.repeat))
+    print(
+        f"{result['messages']} messages in {result['frames']} frames: {result['seconds'] * 1000:.0f} ms, "
+        f"{result['messages_per_second']:.0f} msg/s, {result['compressed_mb_per_second']:.1f} MiB/s compressed"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+"""Compares the gateway encodings and compressions :class:`Shard` supports on the same traffic.
+
+Run with ``python -m benchmarks.gateway_encoding``. For every combination it reports the bytes received per event and
+the CPU time spent decompressing and decoding each event. ``zstd-stream`` is skipped when it is not available.
+"""
+
+from __future__ import annotations
+
+import zlib
+from argparse import ArgumentParser
+from asyncio import get_running_loop, run
+from json import dumps
+from time import process_time
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+
+from nextcord.core.gateway import etf
+from nextcord.core.gateway.shard import HAS_ZSTD, Shard
+from nextcord.utils import json
+
+from .gateway_decompress import generate_events
+
+if TYPE_CHECKING:
+    from typing import Any, Callable, Optional
+
+try:
+    # Python 3.14+
+    from compression.zstd import ZstdCompressor
+
+    def _zstd_compressor() -> Callable[[bytes], bytes]:
+        compressor = ZstdCompressor()
+        return lambda data: compressor.compress(data, ZstdCompressor.FLUSH_BLOCK)
+
+except ModuleNotFoundError:
+    try:
+        import zstandard
+
+        def _zstd_compressor() -> Callable[[bytes], bytes]:
+            compressor = zstandard.ZstdCompressor().compressobj()
+            return lambda data: compressor.compress(data) + compressor.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    except ModuleNotFoundError:
+        pass
+
+
+def _zlib_compressor() -> Callable[[bytes], bytes]:
+    compressor = zlib.compressobj()
+    return lambda data: compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def _as_sent_over_etf(data: Any) -> Any:
+    # Discord sends snowflakes as integers over ETF
+    if isinstance(data, dict):
+        return {key: _as_sent_over_etf(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [_as_sent_over_etf(item) for item in data]
+    if isinstance(data, str) and len(data) >= 17 and data.isdigit():
+        return int(data)
+    return data
+
+
+def encode_events(events: list[dict[str, Any]], encoding: str, compression: Optional[str]) -> list[bytes]:
+    """Encode and compress events the way discord sends them"""
+    compress: Optional[Callable[[bytes], bytes]] = None
+    if compression == "zlib-stream":
+        compress = _zlib_compressor()
+    elif compression == "zstd-stream":
+        compress = _zstd_compressor()
+
+    frames = []
+    for event in events:
+        if encoding == "etf":
+            payload = etf.encode(_as_sent_over_etf(event))
+        else:
+            payload = json.dumps(event)
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+        frames.append(compress(payload) if compress is not None else payload)
+    return frames
+
+
+async def measure(frames: list[bytes], encoding: str, compression: Optional[str], repeat: int) -> float:
+    """The least CPU seconds it took to decompress and decode all frames"""
+    state = SimpleNamespace(loop=get_running_loop())
+    best = float("inf")
+    for _ in range(repeat):
+        shard = Shard(state, 0, encoding=encoding, compression=compression)  # type: ignore
+        # The same as Shard._receive_loop without dispatching
+        if compression is None:
+            decompress: Callable[[bytes], Any] = bytes
+        elif compression == "zstd-stream":
+            decompress = shard._decompress_zstd
+        else:
+            decompress = shard._decompress
+        loads = shard._loads
+        started = process_time()
+        for frame in frames:
+            loads(decompress(frame))
+        best = min(best, process_time() - started)
+    return best
+
+
+async def run_all(messages: int, repeat: int) -> list[dict[str, Any]]:
+    events = generate_events(messages)
+    compressions: list[Optional[str]] = ["zlib-stream", "zstd-stream", None] if HAS_ZSTD else ["zlib-stream", None]
+    results = []
+    for encoding in ("json", "etf"):
+        for compression in compressions:
+            frames = encode_events(events, encoding, compression)
+            seconds = await measure(frames, encoding, compression, repeat)
+            received = sum(len(frame) for frame in frames)
+            results.append(
+                {
+                    "encoding": encoding,
+                    "compression": compression,
+                    "events": len(events),
+                    "bytes_per_event": received / len(events),
+                    "cpu_us_per_event": seconds / len(events) * 1_000_000,
+                }
+            )
+    return results
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Compare gateway encodings and compressions")
+    parser.add_argument("--messages", type=int, default=20_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--json", action="store_true", help="Print the results as json")
+    args = parser.parse_args()
+
+    results = run(run_all(args.messages, args.repeat))
+    if args.json:
+        print(dumps(results, indent=2))
+        return
+    if not HAS_ZSTD:
+        print("zstd-stream is not available, install zstandard to compare it")
+    print(f"{'encoding':<10}{'compression':<14}{'bytes/event':>14}{'cpu us/event':>14}")
+    for result in results:
+        print(
+            f"{result['encoding']:<10}{str(result['compression']):<14}"
+            f"{result['bytes_per_event']:>14.1f}{result['cpu_us_per_event']:>14.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+"""Throughput benchmarks for the HTTPClient and its ratelimiting against :mod:`benchmarks.mock_discord`.
+
+Run with ``python -m benchmarks.http_throughput``. Pass ``--json`` to get machine readable results to compare runs.
+A good ratelimiter keeps the 429 rate at or close to 0 while getting close to the throughput the limits allow.
+"""
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from asyncio import gather, get_running_loop, run
+from json import dumps
+from time import perf_counter
+from types import SimpleNamespace
+from typing import TYPE_CHECKING
+
+from nextcord.core.http import HTTPClient, RouteTemplate
+from nextcord.core.retry import RetryPolicy
+from nextcord.exceptions import HTTPException
+from nextcord.type_sheet import TypeSheet
+
+from .mock_discord import MockDiscord
+
+if TYPE_CHECKING:
+    from typing import Any, Optional
+
+CREATE_MESSAGE = RouteTemplate("POST", "/channels/{channel_id}/messages")
+EDIT_MESSAGE = RouteTemplate("PATCH", "/channels/{channel_id}/messages/{message_id}")
+DELETE_MESSAGE = RouteTemplate("DELETE", "/channels/{channel_id}/messages/{message_id}")
+GET_CHANNEL = RouteTemplate("GET", "/channels/{channel_id}")
+
+
+class Scenario:
+    """A workload to run against the mock
+
+    Parameters
+    ----------
+    name: :class:`str`
+        The name shown in the results
+    requests: :class:`int`
+        How many requests to send in total
+    concurrency: :class:`int`
+        How many requests are in flight at once
+    channels: :class:`int`
+        How many channels to spread the requests over. Each channel has its own buckets
+    mock_options:
+        Passed to :class:`MockDiscord`
+    """
+
+    def __init__(self, name: str, *, requests: int, concurrency: int, channels: int, **mock_options: Any) -> None:
+        self.name: str = name
+        self.requests: int = requests
+        self.concurrency: int = concurrency
+        self.channels: int = channels
+        self.mock_options: dict[str, Any] = mock_options
+
+    def route(self, index: int) -> Any:
+        channel_id = index % self.channels
+        kind = index % 4
+        if kind == 0:
+            return CREATE_MESSAGE(channel_id=channel_id)
+        if kind == 1:
+            # Edit and delete share a bucket hash, which the client only learns from the responses
+            return EDIT_MESSAGE(channel_id=channel_id, message_id=index)
+        if kind == 2:
+            return DELETE_MESSAGE(channel_id=channel_id, message_id=index)
+        return GET_CHANNEL(channel_id=channel_id)
+
+
+SCENARIOS = (
+    Scenario("one channel", requests=200, concurrency=50, channels=1, limit=50, reset_after=0.25, global_limit=None),
+    Scenario("many channels", requests=2000, concurrency=200, channels=100, limit=5, reset_after=1, global_limit=None),
+    Scenario("global limited", requests=500, concurrency=200, channels=500, limit=5, reset_after=1, global_limit=200),
+    Scenario(
+        "server errors",
+        requests=1000,
+        concurrency=100,
+        channels=100,
+        limit=10,
+        reset_after=0.5,
+        global_limit=None,
+        latency=(0.005, 0.02),
+        error_rate=0.05,
+    ),
+)
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run_scenario(scenario: Scenario) -> dict[str, Any]:
+    mock = MockDiscord(**scenario.mock_options)
+    api_base = await mock.start()
+    state = SimpleNamespace(type_sheet=TypeSheet.default(), token=None, loop=get_running_loop())
+    global_limit: Optional[int] = scenario.mock_options.get("global_limit")
+    http = HTTPClient(
+        state,  # type: ignore
+        retry_policy=RetryPolicy(max_retries=10, backoff_base=0.05),
+        global_ratelimit=global_limit or 1_000_000,
+    )
+    http.api_base = api_base
+
+    latencies: list[float] = []
+    failures = 0
+    next_index = 0
+
+    async def worker() -> None:
+        nonlocal failures, next_index
+        while next_index < scenario.requests:
+            route = scenario.route(next_index)
+            next_index += 1
+            started = perf_counter()
+            try:
+                r = await http.request(route)
+                r.release()
+            except HTTPException:
+                failures += 1
+            latencies.append(perf_counter() - started)
+
+    try:
+        started = perf_counter()
+        await gather(*(worker() for _ in range(scenario.concurrency)))
+        duration = perf_counter() - started
+    finally:
+        await http.close()
+        await mock.close()
+
+    sent = mock.stats["requests"]
+    return {
+        "scenario": scenario.name,
+        "requests": scenario.requests,
+        "failures": failures,
+        "duration": duration,
+        "requests_per_second": scenario.requests / duration,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "sent": sent,
+        "ratelimit_429_rate": (mock.stats["429"] + mock.stats["global_429"]) / sent,
+        "global_429": mock.stats["global_429"],
+        "server_errors": mock.stats["5xx"],
+    }
+
+
+async def run_all(names: Optional[list[str]] = None) -> list[dict[str, Any]]:
+    results = []
+    for scenario in SCENARIOS:
+        if names and scenario.name not in names:
+            continue
+        results.append(await run_scenario(scenario))
+    return results
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Benchmark the HTTPClient against a mock of the Discord REST API")
+    parser.add_argument("scenarios", nargs="*", help=f"Which scenarios to run: {', '.join(s.name for s in SCENARIOS)}")
+    parser.add_argument("--json", action="store_true", help="Print the results as json")
+    args = parser.parse_args()
+
+    results = run(run_all(args.scenarios))
+    if args.json:
+        print(dumps(results, indent=2))
+        return
+    print(f"{'scenario':<16}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'429 rate':>10}{'sent':>8}{'failed':>8}")
+    for result in results:
+        print(
+            f"{result['scenario']:<16}{result['requests_per_second']:>10.1f}{result['p50_ms']:>10.1f}"
+            f"{result['p99_ms']:>10.1f}{result['ratelimit_429_rate']:>10.2%}{result['sent']:>8}{result['failures']:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
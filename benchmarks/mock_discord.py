@@ -0,0 +1,242 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+"""A stand-in for the Discord REST API to benchmark and test the HTTPClient against.
+
+It sends ratelimit headers like discord does, including shared bucket hashes, and can be told to add latency,
+enforce a global ratelimit and fail with server errors.
+
+Run it on its own with ``python -m benchmarks.mock_discord --port 8080``.
+"""
+
+from __future__ import annotations
+
+import re
+from argparse import ArgumentParser
+from asyncio import sleep
+from collections import Counter
+from hashlib import sha1
+from math import ceil
+from random import random, uniform
+from time import time
+from typing import TYPE_CHECKING
+
+from aiohttp import web
+
+if TYPE_CHECKING:
+    from typing import Optional
+
+_ID = re.compile(r"/\d+")
+_MAJOR = re.compile(r"^/(channels|guilds|webhooks)/(\d+)(?:/([^/]+))?")
+
+DEFAULT_SHARED_HASHES = {
+    # Like discord, some routes share a bucket hash
+    "DELETE /channels/{id}/messages/{id}": "messages-write",
+    "PATCH /channels/{id}/messages/{id}": "messages-write",
+}
+
+
+class _Bucket:
+    __slots__ = ("remaining", "reset_at")
+
+    def __init__(self) -> None:
+        self.remaining: int = 0
+        self.reset_at: float = 0
+
+
+class MockDiscord:
+    """A mock of the Discord REST API
+
+    Parameters
+    ----------
+    limit: :class:`int`
+        How many requests each bucket allows per window
+    reset_after: :class:`float`
+        How many seconds a bucket window lasts
+    global_limit: :class:`Optional[int]`
+        How many requests per second are allowed in total. None to disable the global ratelimit
+    latency: :class:`tuple[float, float]`
+        The minimum and maximum seconds to wait before responding
+    error_rate: :class:`float`
+        The chance of responding with a 502, 503 or 504 instead
+    shared_hashes: :class:`Optional[dict[str, str]]`
+        Bucket hashes shared between routes, keyed by ``"METHOD /path/{id}"``
+    """
+
+    def __init__(
+        self,
+        *,
+        limit: int = 5,
+        reset_after: float = 1,
+        global_limit: Optional[int] = 50,
+        latency: tuple[float, float] = (0, 0),
+        error_rate: float = 0,
+        shared_hashes: Optional[dict[str, str]] = None,
+    ) -> None:
+        self.limit: int = limit
+        self.reset_after: float = reset_after
+        self.global_limit: Optional[int] = global_limit
+        self.latency: tuple[float, float] = latency
+        self.error_rate: float = error_rate
+        self.shared_hashes: dict[str, str] = DEFAULT_SHARED_HASHES if shared_hashes is None else shared_hashes
+
+        self.stats: Counter[str] = Counter()
+        """How many requests were received, and how many were answered with 429s and server errors"""
+        self._buckets: dict[tuple[str, str], _Bucket] = {}
+        self._global_window: int = 0
+        self._global_count: int = 0
+        self._runner: Optional[web.AppRunner] = None
+
+    def bucket_hash(self, method: str, path: str) -> str:
+        """The bucket hash of a route"""
+        template = f"{method} {_ID.sub('/{id}', path)}"
+        shared = self.shared_hashes.get(template)
+        if shared is not None:
+            return shared
+        return sha1(template.encode()).hexdigest()[:16]
+
+    @staticmethod
+    def major_parameter(path: str) -> str:
+        """The major parameter of a path. Webhook tokens are part of it"""
+        match = _MAJOR.match(path)
+        if match is None:
+            return ""
+        kind, snowflake, token = match.groups()
+        if kind == "webhooks" and token is not None:
+            return f"{snowflake}/{token}"
+        return snowflake
+
+    @property
+    def app(self) -> web.Application:
+        """A aiohttp application serving the mock"""
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.stats["requests"] += 1
+        path = "/" + request.match_info["path"]
+        if self.latency[1]:
+            await sleep(uniform(*self.latency))
+        now = time()
+
+        if self.global_limit is not None:
+            window = int(now)
+            if window != self._global_window:
+                self._global_window = window
+                self._global_count = 0
+            self._global_count += 1
+            if self._global_count > self.global_limit:
+                self.stats["global_429"] += 1
+                retry_after = f"{window + 1 - now:.3f}"
+                headers = {"Retry-After": retry_after, "X-RateLimit-Global": "true", "X-RateLimit-Scope": "global"}
+                return self._json(
+                    {"message": "You are being rate limited.", "retry_after": float(retry_after), "global": True},
+                    status=429,
+                    headers=headers,
+                )
+
+        bucket_hash = self.bucket_hash(request.method, path)
+        key = (bucket_hash, self.major_parameter(path))
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket()
+        if bucket.reset_at <= now:
+            bucket.remaining = self.limit
+            # Rounded up to what the headers can hold so clients never retry too early
+            bucket.reset_at = ceil((now + self.reset_after) * 1000) / 1000
+        reset_after = bucket.reset_at - now
+        headers = {
+            "X-RateLimit-Bucket": bucket_hash,
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Reset": f"{bucket.reset_at:.3f}",
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+        }
+        if bucket.remaining <= 0:
+            self.stats["429"] += 1
+            headers |= {"X-RateLimit-Remaining": "0", "Retry-After": f"{reset_after:.3f}", "X-RateLimit-Scope": "user"}
+            return self._json(
+                {"message": "You are being rate limited.", "retry_after": reset_after, "global": False},
+                status=429,
+                headers=headers,
+            )
+        bucket.remaining -= 1
+        headers["X-RateLimit-Remaining"] = str(bucket.remaining)
+
+        if self.error_rate and random() < self.error_rate:
+            self.stats["5xx"] += 1
+            status = (502, 503, 504)[int(random() * 3)]
+            return web.Response(status=status, text="upstream connect error", headers={"via": "1.1 google"})
+
+        return self._json({"id": "1", "path": path}, headers=headers)
+
+    @staticmethod
+    def _json(data: object, *, status: int = 200, headers: dict[str, str]) -> web.Response:
+        headers["via"] = "1.1 google"
+        return web.json_response(data, status=status, headers=headers)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start serving the mock
+
+        Parameters
+        ----------
+        host: :class:`str`
+            The host to listen on
+        port: :class:`int`
+            The port to listen on. 0 picks a free one
+
+        Returns
+        -------
+        str
+            The base URL to use as :attr:`HTTPClient.api_base`
+        """
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        host, port = self._runner.addresses[0][:2]
+        return f"http://{host}:{port}"
+
+    async def close(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Run a mock of the Discord REST API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--limit", type=int, default=5, help="Requests per bucket window")
+    parser.add_argument("--reset-after", type=float, default=1, help="Seconds per bucket window")
+    parser.add_argument("--global-limit", type=int, default=50, help="Requests per second, 0 to disable")
+    parser.add_argument("--error-rate", type=float, default=0, help="Chance of a 5xx response")
+    args = parser.parse_args()
+
+    mock = MockDiscord(
+        limit=args.limit,
+        reset_after=args.reset_after,
+        global_limit=args.global_limit or None,
+        error_rate=args.error_rate,
+    )
+    web.run_app(mock.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,7 +22,8 @@
 __version__ = "3.0.0a"
 
 from .client.client import Client
+from .file import File
 from .flags import Intents
 from .type_sheet import TypeSheet
 
-__all__ = ("Client", "TypeSheet", "Intents")
+__all__ = ("Client", "TypeSheet", "Intents", "File")
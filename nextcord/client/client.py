@@ -30,7 +30,7 @@ from ..type_sheet import TypeSheet
 from .state import State
 
 if TYPE_CHECKING:
-    from typing import Optional
+    from typing import Any, Optional
 
     from ..flags import Intents
 
@@ -54,6 +54,13 @@ class Client:
 
         .. note::
             This will be locked in if you set it. If your bot ever outgrows your shardcount, you will get a error
+    http_options: :class:`Optional[dict[str, Any]]`
+        Keyword arguments passed to the :attr:`TypeSheet.http_client` when it is created.
+        For the default one this includes connection pool settings and a ``session`` to share between multiple clients.
+    gateway_options: :class:`Optional[dict[str, Any]]`
+        Keyword arguments passed to the :attr:`TypeSheet.gateway` when it is created.
+        For the default one see :class:`Gateway <nextcord.core.gateway.Gateway>`, this includes the ``encoding`` and
+        ``compression`` the shards connect with.
     """
 
     def __init__(
@@ -63,10 +70,12 @@ class Client:
         *,
         type_sheet: Optional[TypeSheet] = None,
         shard_count: Optional[int] = None,
+        http_options: Optional[dict[str, Any]] = None,
+        gateway_options: Optional[dict[str, Any]] = None,
     ) -> None:
         if type_sheet is None:
             type_sheet = TypeSheet.default()
-        self.state: State = State(self, type_sheet, token, intents.value, shard_count)
+        self.state: State = State(self, type_sheet, token, intents.value, shard_count, http_options, gateway_options)
         self._error_future: Future[
             None
         ] = Future()  # TODO: Make this return a Optional error instead of setting a attribute
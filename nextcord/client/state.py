@@ -22,7 +22,7 @@ from asyncio import AbstractEventLoop, get_event_loop
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
-    from typing import Optional
+    from typing import Any, Optional
 
     from ..type_sheet import TypeSheet
     from .client import Client
@@ -36,6 +36,8 @@ class State:
         token: str,
         intents: int,
         shard_count: Optional[int],
+        http_options: Optional[dict[str, Any]] = None,
+        gateway_options: Optional[dict[str, Any]] = None,
     ):
         self.client: Client = client
         self.type_sheet: TypeSheet = type_sheet
@@ -45,5 +47,5 @@ class State:
         self.intents: int = intents
 
         # Instances
-        self.http = self.type_sheet.http_client(self)
-        self.gateway = self.type_sheet.gateway(self, shard_count=shard_count)
+        self.http = self.type_sheet.http_client(self, **(http_options or {}))
+        self.gateway = self.type_sheet.gateway(self, shard_count=shard_count, **(gateway_options or {}))
@@ -0,0 +1,386 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+"""Spread shards over multiple processes so they can use every core.
+
+:class:`ShardCluster` spawns worker processes which each run a :class:`ClusterGateway` with a range of the shards.
+The parent hands out identify slots so all workers together respect ``max_concurrency``, and receives the events the
+workers forward to it over a unix socket.
+
+.. code-block:: python3
+
+    cluster = ShardCluster(token, intents, processes=4, forward_events=["MESSAGE_CREATE"])
+
+    @cluster.event_dispatcher.listen("MESSAGE_CREATE")
+    async def on_message(shard_id, data):
+        ...
+
+    cluster.run()
+"""
+
+from __future__ import annotations
+
+from asyncio import get_event_loop, sleep
+from logging import getLogger
+from multiprocessing import get_context
+from os import cpu_count, kill
+from signal import SIGINT
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from ...dispatcher import Dispatcher
+from ...utils import json
+from .gateway import Gateway
+from .identify import IdentifyConnection, IdentifyServer
+
+if TYPE_CHECKING:
+    from asyncio import AbstractEventLoop, StreamWriter
+    from multiprocessing.process import BaseProcess
+    from typing import Any, Awaitable, Callable, Iterable, Optional
+
+    from ...client.state import State
+    from ...flags import Intents
+    from ...type_sheet import TypeSheet
+    from .protocols.shard import ShardProtocol
+
+logger = getLogger(__name__)
+
+DEFAULT_CLUSTER_PATH = "/tmp/nextcord-cluster.sock"
+
+
+class ClusterCoordinator(IdentifyServer):
+    """The parent side of a cluster. Hands out identify slots and dispatches the events workers forward.
+
+    Parameters
+    ----------
+    path: :class:`str`
+        The unix socket to listen on
+    max_concurrency: :class:`int`
+        How many shards may identify at once. This is ``session_start_limit.max_concurrency`` from discord
+    """
+
+    def __init__(self, path: str = DEFAULT_CLUSTER_PATH, *, max_concurrency: int = 1) -> None:
+        super().__init__(path, max_concurrency=max_concurrency)
+        self.event_dispatcher: Dispatcher = Dispatcher()
+        """Dispatches forwarded events with the shard id and the decoded data"""
+        self.raw_event_dispatcher: Dispatcher = Dispatcher()
+        """Dispatches forwarded events with the shard id and the data as JSON encoded :class:`bytes`"""
+
+    @property
+    def path(self) -> str:
+        """The unix socket the workers connect to"""
+        return self.address
+
+    @property
+    def max_concurrency(self) -> int:
+        return self.scheduler.max_concurrency
+
+    @max_concurrency.setter
+    def max_concurrency(self, value: int) -> None:
+        self.scheduler.max_concurrency = value
+
+    def _handle_frame(self, writer: StreamWriter, header: dict[str, Any], body: bytes) -> None:
+        if header["op"] != "dispatch":
+            return super()._handle_frame(writer, header, body)
+        event_name = header["t"]
+        if self.raw_event_dispatcher.has_listeners(event_name):
+            self.raw_event_dispatcher.dispatch(event_name, header["shard_id"], body)
+        if self.event_dispatcher.has_listeners(event_name):
+            self.event_dispatcher.dispatch(event_name, header["shard_id"], json.loads(body))
+
+
+class ClusterConnection(IdentifyConnection):
+    """The worker side connection to a :class:`ClusterCoordinator`
+
+    Parameters
+    ----------
+    path: :class:`str`
+        The unix socket the coordinator is listening on
+    """
+
+    def __init__(self, path: str = DEFAULT_CLUSTER_PATH) -> None:
+        super().__init__(path)
+
+    def forward(self, event_name: str, shard_id: int, data: bytes) -> None:
+        """Send a event to the coordinator
+
+        Parameters
+        ----------
+        event_name: :class:`str`
+            The name of the event
+        shard_id: :class:`int`
+            The shard that received it
+        data: :class:`bytes`
+            The JSON encoded event data
+        """
+        if self._writer is None:
+            logger.debug("Dropping %s as the coordinator is not connected", event_name)
+            return
+        self.send({"op": "dispatch", "t": event_name, "shard_id": shard_id}, data)
+
+
+class ClusterGateway(Gateway):
+    """A :class:`Gateway` running in a :class:`ShardCluster` worker.
+
+    Events are forwarded to the :class:`ClusterCoordinator`, which also schedules identifies unless
+    ``identify_coordinator`` is set.
+
+    Parameters
+    ----------
+    state: :class:`State`
+        The current state of the bot
+    shard_count: :class:`Optional[int]`
+        The shard count of the whole cluster
+    cluster_path: :class:`str`
+        The unix socket the coordinator is listening on
+    forward_events: :class:`Optional[Iterable[str]]`
+        The events to forward to the coordinator. None forwards every event
+    options:
+        Passed to :class:`Gateway`
+    """
+
+    def __init__(
+        self,
+        state: State,
+        shard_count: Optional[int] = None,
+        *,
+        cluster_path: str = DEFAULT_CLUSTER_PATH,
+        forward_events: Optional[Iterable[str]] = None,
+        **options: Any,
+    ) -> None:
+        super().__init__(state, shard_count, **options)
+        self.connection: ClusterConnection = ClusterConnection(cluster_path)
+        if self.identify_connection is None:
+            self.identify_connection = self.connection
+        if forward_events is None:
+            self.raw_event_dispatcher.add_listener(self._forward)
+        else:
+            # Only listen to what gets forwarded so the other events can be skipped with lazy dispatch
+            for event_name in forward_events:
+                self.raw_event_dispatcher.add_listener(self._forwarder(event_name), event_name)
+
+    async def connect(self) -> None:
+        await self.connection.connect(shard_ids=self.shard_ids)
+        await super().connect()
+
+    async def close(self) -> None:
+        await super().close()
+        await self.connection.close()
+
+    async def _forward(self, event_name: str, shard: ShardProtocol, data: bytes) -> None:
+        self.connection.forward(event_name, shard.shard_id, data)
+
+    def _forwarder(self, event_name: str) -> Callable[[ShardProtocol, bytes], Awaitable[None]]:
+        async def forward(shard: ShardProtocol, data: bytes) -> None:
+            self.connection.forward(event_name, shard.shard_id, data)
+
+        return forward
+
+
+class _ClusterState:
+    """The parts of :class:`State <nextcord.client.state.State>` the HTTPClient uses"""
+
+    def __init__(self, type_sheet: TypeSheet, loop: AbstractEventLoop, token: str) -> None:
+        self.type_sheet: TypeSheet = type_sheet
+        self.loop: AbstractEventLoop = loop
+        self.token: str = token
+
+
+def _run_worker(
+    token: str,
+    intents: int,
+    shard_count: int,
+    shard_ids: list[int],
+    cluster_path: str,
+    forward_events: Optional[list[str]],
+    http_options: dict[str, Any],
+    gateway_options: dict[str, Any],
+) -> None:
+    # Imported here as the client imports the gateway
+    from ...client.client import Client
+    from ...flags import Intents
+    from ...type_sheet import TypeSheet
+
+    worker_intents = Intents()
+    worker_intents.value = intents
+    type_sheet = TypeSheet.default()
+    type_sheet.gateway = ClusterGateway
+    client = Client(
+        token,
+        worker_intents,
+        type_sheet=type_sheet,
+        shard_count=shard_count,
+        http_options=http_options,
+        gateway_options={
+            "lazy_dispatch": True,
+            **gateway_options,
+            "shard_ids": shard_ids,
+            "cluster_path": cluster_path,
+            "forward_events": forward_events,
+        },
+    )
+    client.run()
+
+
+class ShardCluster:
+    """Runs the shards of a bot in multiple processes, with one :attr:`event_dispatcher` in this process.
+
+    Parameters
+    ----------
+    token: :class:`str`
+        The bot token to connect with
+    intents: :class:`Intents`
+        The intents to connect with
+    processes: :class:`Optional[int]`
+        How many worker processes to spread the shards over. Defaults to the amount of cores
+    shard_count: :class:`Optional[int]`
+        How many shards to connect with. Fetched from discord if None
+    shard_ids: :class:`Optional[Iterable[int]]`
+        The shards to run when the bot runs on multiple hosts. This needs ``shard_count`` and ``identify_coordinator``
+    identify_coordinator: :class:`Optional[str]`
+        The address of a :class:`IdentifyServer <nextcord.core.gateway.identify.IdentifyServer>` shared with the other
+        hosts. If None, identifies are scheduled by this process
+    forward_events: :class:`Optional[Iterable[str]]`
+        The events workers forward to this process. None forwards every event, which costs a lot more
+    cluster_path: :class:`str`
+        The unix socket the workers talk to this process over
+    http_options: :class:`Optional[dict[str, Any]]`
+        Passed to the HTTP client of every worker. This has to be picklable
+    gateway_options: :class:`Optional[dict[str, Any]]`
+        Passed to the :class:`ClusterGateway` of every worker. This has to be picklable
+    """
+
+    def __init__(
+        self,
+        token: str,
+        intents: Intents,
+        *,
+        processes: Optional[int] = None,
+        shard_count: Optional[int] = None,
+        shard_ids: Optional[Iterable[int]] = None,
+        identify_coordinator: Optional[str] = None,
+        forward_events: Optional[Iterable[str]] = None,
+        cluster_path: str = DEFAULT_CLUSTER_PATH,
+        http_options: Optional[dict[str, Any]] = None,
+        gateway_options: Optional[dict[str, Any]] = None,
+    ) -> None:
+        self.token: str = token
+        self.intents: Intents = intents
+        self.process_count: int = processes or cpu_count() or 1
+        if shard_ids is not None and (shard_count is None or identify_coordinator is None):
+            raise ValueError("shard_count and identify_coordinator have to be set when running a subset of the shards")
+        self.shard_count: Optional[int] = shard_count
+        self.shard_ids: Optional[list[int]] = None if shard_ids is None else list(shard_ids)
+        self.forward_events: Optional[list[str]] = None if forward_events is None else list(forward_events)
+        self.http_options: dict[str, Any] = http_options or {}
+        self.gateway_options: dict[str, Any] = gateway_options or {}
+        if identify_coordinator is not None:
+            self.gateway_options["identify_coordinator"] = identify_coordinator
+
+        self.coordinator: ClusterCoordinator = ClusterCoordinator(cluster_path)
+        self.event_dispatcher: Dispatcher = self.coordinator.event_dispatcher
+        """Dispatches forwarded events with the shard id and the decoded data"""
+        self.raw_event_dispatcher: Dispatcher = self.coordinator.raw_event_dispatcher
+        """Dispatches forwarded events with the shard id and the data as JSON encoded :class:`bytes`"""
+        self.processes: list[BaseProcess] = []
+        """The running worker processes"""
+
+    def shard_ranges(self, shard_ids: list[int]) -> list[list[int]]:
+        """Split the shards into one contiguous range per process
+
+        Parameters
+        ----------
+        shard_ids: :class:`list[int]`
+            The shards this cluster runs
+        """
+        count = min(self.process_count, len(shard_ids))
+        total = len(shard_ids)
+        return [shard_ids[i * total // count : (i + 1) * total // count] for i in range(count)]
+
+    async def start(self) -> None:
+        """Fetch the shard count and max_concurrency from discord and start the workers"""
+        from ...type_sheet import TypeSheet
+
+        type_sheet = TypeSheet.default()
+        http = type_sheet.http_client(_ClusterState(type_sheet, get_event_loop(), self.token))  # type: ignore
+        try:
+            r = await http.get_gateway_bot()
+        finally:
+            await http.close()
+        if self.shard_count is None:
+            self.shard_count = r.data["shards"]
+        self.coordinator.max_concurrency = r.data["session_start_limit"]["max_concurrency"]
+        await self.coordinator.start()
+
+        context = get_context("spawn")
+        all_shard_ids = list(range(self.shard_count)) if self.shard_ids is None else self.shard_ids
+        for shard_ids in self.shard_ranges(all_shard_ids):
+            process = context.Process(
+                target=_run_worker,
+                args=(
+                    self.token,
+                    self.intents.value,
+                    self.shard_count,
+                    shard_ids,
+                    self.coordinator.path,
+                    self.forward_events,
+                    self.http_options,
+                    self.gateway_options,
+                ),
+                name=f"nextcord-shards-{shard_ids[0]}-{shard_ids[-1]}",
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+
+    async def close(self, timeout: float = 10) -> None:
+        """Stop the workers and the coordinator
+
+        Parameters
+        ----------
+        timeout: :class:`float`
+            How many seconds the workers get to close their shards before they are terminated
+        """
+        for process in self.processes:
+            if process.is_alive() and process.pid is not None:
+                # Workers close their client on KeyboardInterrupt, like Client.run does
+                kill(process.pid, SIGINT)
+        deadline = monotonic() + timeout
+        for process in self.processes:
+            while process.is_alive() and monotonic() < deadline:
+                await sleep(0.1)
+            if process.is_alive():
+                logger.warning("Worker %s did not close in time, terminating it", process.name)
+                process.terminate()
+                while process.is_alive():
+                    await sleep(0.1)
+        self.processes.clear()
+        await self.coordinator.close()
+
+    def run(self) -> None:
+        """Start the cluster and run until interrupted"""
+        loop = get_event_loop()
+        try:
+            loop.run_until_complete(self.start())
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            loop.run_until_complete(self.close())
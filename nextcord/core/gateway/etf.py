@@ -0,0 +1,267 @@
+# The MIT License (MIT)
+# Copyright (c) 2021-present vcokltfre & tag-epic
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+"""A encoder and decoder for the external term format discord uses with ``encoding=etf``.
+
+Decoding gives the same shapes as the JSON encoding so the rest of the library does not have to care which one is used:
+binaries are decoded to :class:`str`, the ``nil``, ``true`` and ``false`` atoms become :data:`None`, :data:`True` and
+:data:`False` and snowflakes, which discord sends as integers, become :class:`str`.
+
+This is written in Python and is much slower than decoding JSON, it is not meant as a way to speed up the gateway.
+"""
+
+from __future__ import annotations
+
+from struct import Struct
+from struct import error as StructError
+from typing import TYPE_CHECKING
+from zlib import decompress
+
+from .exceptions import BadDataException
+
+if TYPE_CHECKING:
+    from typing import Any
+
+__all__ = ("encode", "decode")
+
+VERSION = 131
+NEW_FLOAT_EXT = 70
+COMPRESSED = 80
+SMALL_INTEGER_EXT = 97
+INTEGER_EXT = 98
+FLOAT_EXT = 99
+ATOM_EXT = 100
+SMALL_TUPLE_EXT = 104
+LARGE_TUPLE_EXT = 105
+NIL_EXT = 106
+STRING_EXT = 107
+LIST_EXT = 108
+BINARY_EXT = 109
+SMALL_BIG_EXT = 110
+LARGE_BIG_EXT = 111
+MAP_EXT = 116
+SMALL_ATOM_EXT = 115
+ATOM_UTF8_EXT = 118
+SMALL_ATOM_UTF8_EXT = 119
+
+MAX_SAFE_INTEGER = 2**53
+"""Integers from here on can not be represented in JSON, this is where discord uses strings for snowflakes instead"""
+
+_u16 = Struct(">H")
+_u32 = Struct(">I")
+_i32 = Struct(">i")
+_f64 = Struct(">d")
+# Bound once, looking these up is a noticeable part of decoding
+_unpack_u16 = _u16.unpack_from
+_unpack_u32 = _u32.unpack_from
+_unpack_i32 = _i32.unpack_from
+_unpack_f64 = _f64.unpack_from
+
+_ATOMS: dict[str, Any] = {"nil": None, "true": True, "false": False}
+
+
+def decode(data: bytes) -> Any:
+    """Decode a ETF encoded payload
+
+    Parameters
+    ----------
+    data: :class:`bytes`
+        The payload, starting with the version byte
+
+    Raises
+    ------
+    BadDataException
+        The payload is not valid ETF
+    """
+    if not data or data[0] != VERSION:
+        raise BadDataException
+    try:
+        if data[1] == COMPRESSED:
+            (size,) = _unpack_u32(data, 2)
+            data = decompress(data[6:], bufsize=size)
+            value, offset = _decode(data, 0)
+        else:
+            value, offset = _decode(data, 1)
+    except (IndexError, StructError, UnicodeDecodeError, ValueError, TypeError) as e:
+        # TypeError is a map key which decoded to a unhashable list or dict
+        raise BadDataException from e
+    if offset != len(data):
+        raise BadDataException
+    return value
+
+
+def _decode(data: bytes, offset: int) -> tuple[Any, int]:
+    # Ordered by how common the tags are in gateway payloads
+    tag = data[offset]
+    offset += 1
+    if tag == BINARY_EXT:
+        (size,) = _unpack_u32(data, offset)
+        offset += 4
+        return data[offset : offset + size].decode("utf-8"), offset + size
+    if tag == MAP_EXT:
+        (arity,) = _unpack_u32(data, offset)
+        offset += 4
+        result = {}
+        for _ in range(arity):
+            # Keys are almost always atoms
+            if data[offset] == SMALL_ATOM_UTF8_EXT:
+                size = data[offset + 1]
+                offset += 2
+                key = data[offset : offset + size].decode("utf-8")
+                offset += size
+            else:
+                key, offset = _decode(data, offset)
+            result[key], offset = _decode(data, offset)
+        return result, offset
+    if tag == SMALL_ATOM_UTF8_EXT or tag == SMALL_ATOM_EXT:
+        size = data[offset]
+        offset += 1
+        return _atom(data[offset : offset + size]), offset + size
+    if tag == SMALL_INTEGER_EXT:
+        return data[offset], offset + 1
+    if tag == INTEGER_EXT:
+        return _unpack_i32(data, offset)[0], offset + 4
+    if tag == NIL_EXT:
+        return [], offset
+    if tag == LIST_EXT:
+        (length,) = _unpack_u32(data, offset)
+        offset += 4
+        items = []
+        for _ in range(length):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        # Proper lists end with a empty list as the tail
+        tail, offset = _decode(data, offset)
+        if tail != []:
+            raise ValueError("Improper lists are not supported")
+        return items, offset
+    if tag == SMALL_BIG_EXT or tag == LARGE_BIG_EXT:
+        if tag == SMALL_BIG_EXT:
+            size = data[offset]
+            offset += 1
+        else:
+            (size,) = _unpack_u32(data, offset)
+            offset += 4
+        sign = data[offset]
+        offset += 1
+        number = int.from_bytes(data[offset : offset + size], "little")
+        if sign:
+            number = -number
+        if number >= MAX_SAFE_INTEGER:
+            # A snowflake. JSON has these as strings
+            return str(number), offset + size
+        return number, offset + size
+    if tag == NEW_FLOAT_EXT:
+        return _unpack_f64(data, offset)[0], offset + 8
+    if tag == ATOM_UTF8_EXT or tag == ATOM_EXT:
+        (size,) = _unpack_u16(data, offset)
+        offset += 2
+        return _atom(data[offset : offset + size]), offset + size
+    if tag == STRING_EXT:
+        # Erlang sends lists of small integers like this
+        (size,) = _unpack_u16(data, offset)
+        offset += 2
+        return list(data[offset : offset + size]), offset + size
+    if tag == SMALL_TUPLE_EXT or tag == LARGE_TUPLE_EXT:
+        if tag == SMALL_TUPLE_EXT:
+            arity = data[offset]
+            offset += 1
+        else:
+            (arity,) = _unpack_u32(data, offset)
+            offset += 4
+        items = []
+        for _ in range(arity):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == FLOAT_EXT:
+        return float(data[offset : offset + 31].rstrip(b"\x00")), offset + 31
+    raise ValueError(f"Unknown ETF tag {tag}")
+
+
+def _atom(name: bytes) -> Any:
+    atom = name.decode("utf-8")
+    return _ATOMS.get(atom, atom)
+
+
+def encode(data: Any) -> bytes:
+    """Encode a payload to send to discord as ETF
+
+    Parameters
+    ----------
+    data: :class:`Any`
+        A payload made of the types JSON supports. Tuples are encoded as lists
+    """
+    buffer = bytearray((VERSION,))
+    _encode(data, buffer)
+    return bytes(buffer)
+
+
+def _encode(data: Any, buffer: bytearray) -> None:
+    if data is None:
+        buffer += b"\x77\x03nil"
+    elif data is True:
+        buffer += b"\x77\x04true"
+    elif data is False:
+        buffer += b"\x77\x05false"
+    elif isinstance(data, str):
+        encoded = data.encode("utf-8")
+        buffer.append(BINARY_EXT)
+        buffer += _u32.pack(len(encoded))
+        buffer += encoded
+    elif isinstance(data, int):
+        if 0 <= data <= 255:
+            buffer.append(SMALL_INTEGER_EXT)
+            buffer.append(data)
+        elif -(2**31) <= data < 2**31:
+            buffer.append(INTEGER_EXT)
+            buffer += _i32.pack(data)
+        else:
+            magnitude = abs(data)
+            digits = magnitude.to_bytes((magnitude.bit_length() + 7) // 8, "little")
+            if len(digits) > 255:
+                raise ValueError("Integer is too big to encode")
+            buffer.append(SMALL_BIG_EXT)
+            buffer.append(len(digits))
+            buffer.append(data < 0)
+            buffer += digits
+    elif isinstance(data, float):
+        buffer.append(NEW_FLOAT_EXT)
+        buffer += _f64.pack(data)
+    elif isinstance(data, dict):
+        buffer.append(MAP_EXT)
+        buffer += _u32.pack(len(data))
+        for key, value in data.items():
+            if isinstance(key, str) and len(key) < 64:
+                # Keys are atoms like discord sends them, less than 64 characters always fit in 255 bytes
+                encoded = key.encode("utf-8")
+                buffer.append(SMALL_ATOM_UTF8_EXT)
+                buffer.append(len(encoded))
+                buffer += encoded
+            else:
+                _encode(key, buffer)
+            _encode(value, buffer)
+    elif isinstance(data, (list, tuple)):
+        if data:
+            buffer.append(LIST_EXT)
+            buffer += _u32.pack(len(data))
+            for item in data:
+                _encode(item, buffer)
+        buffer.append(NIL_EXT)
+    else:
+        raise TypeError(f"Cannot encode {type(data).__name__} as ETF")
@@ -20,24 +20,33 @@
 # DEALINGS IN THE SOFTWARE.
 from __future__ import annotations
 
-from collections import defaultdict
+from asyncio import TimeoutError, sleep, wait_for
+from collections import OrderedDict
 from logging import getLogger
 from typing import TYPE_CHECKING
 
 from ...dispatcher import Dispatcher
-from ..ratelimiter import TimesPer
+from ...exceptions import NextcordException
+from ...utils import json
 from .exceptions import NotEnoughShardsException
+from .identify import IdentifyConnection, IdentifyScheduler
 from .protocols.gateway import GatewayProtocol
+from .startup import ShardStartup
 
 if TYPE_CHECKING:
-    from typing import Any, Optional
+    from asyncio import Task
+    from typing import Any, AsyncContextManager, Iterable, Literal, Optional
 
     from ...client.state import State
-    from ...exceptions import NextcordException
+    from .health import ShardHealth
+    from .protocols.session_store import SessionStoreProtocol
     from .protocols.shard import ShardProtocol
 
 logger = getLogger(__name__)
 
+DEDUPLICATION_WINDOW = 50_000
+"""How many recent events are remembered to drop duplicates while both shard sets run during a rescale"""
+
 
 class Gateway(GatewayProtocol):
     """A fast and simple :class:`GatewayProtocol` implementation
@@ -48,52 +57,207 @@ class Gateway(GatewayProtocol):
         The current state of the bot
     shard_count: :class:`Optional[int]`
         The current shard count. If this is not None it is expected for it to error instead of changing shard count
-
+    encoding: :class:`str`
+        How the shards encode payloads. ``json`` or ``etf``.
+        Use ``json`` for performance. ETF is about as big once compressed and decoding it in Python takes around ten
+        times as long, see ``benchmarks/gateway_encoding.py``. It is only here for compatibility.
+    compression: :class:`Optional[str]`
+        How the shards compress their connection. ``zlib-stream``, ``zstd-stream`` or None.
+        ``zstd-stream`` needs Python 3.14 or the ``zstandard`` package.
+    lazy_dispatch: :class:`bool`
+        Only parse events that have listeners. Events nobody listens to only have their name and sequence read.
+        This only applies to the ``json`` encoding.
+    shard_ids: :class:`Optional[Iterable[int]]`
+        The shards to run when they are spread over multiple gateways. None runs all of them.
+        This needs ``shard_count`` to be set so every gateway uses the same one.
+    identify_coordinator: :class:`Optional[str]`
+        The address of a :class:`IdentifyServer <nextcord.core.gateway.identify.IdentifyServer>` to schedule identifies
+        with when the shards are spread over multiple hosts. ``tcp://host:port`` or a unix socket path
+    session_store: :class:`Optional[SessionStoreProtocol]`
+        Where to save the shard sessions so they can be resumed after a restart instead of identifying again.
+        See :class:`FileSessionStore <nextcord.core.gateway.session.FileSessionStore>` and
+        :class:`SqliteSessionStore <nextcord.core.gateway.session.SqliteSessionStore>`.
+    session_save_interval: :class:`float`
+        How often to save the sessions while running, in seconds. They are also saved when closing.
+    rescale_overlap: :class:`float`
+        How long the old shards keep running after the new ones took over when rescaling, in seconds.
+        Events received by both are only dispatched once.
+    rescale_timeout: :class:`float`
+        How long the new shards get to become ready when rescaling, in seconds.
+        If they don't make it they are closed and the current shards keep running.
+    heartbeat_timeout: :class:`Optional[float]`
+        How long shards wait for a heartbeat ACK before reconnecting, in seconds. Lower it to replace dead connections
+        sooner. None waits until the next heartbeat is due.
     """
 
-    def __init__(self, state: State, shard_count: Optional[int] = None) -> None:
+    def __init__(
+        self,
+        state: State,
+        shard_count: Optional[int] = None,
+        *,
+        encoding: Literal["json", "etf"] = "json",
+        compression: Optional[Literal["zlib-stream", "zstd-stream"]] = "zlib-stream",
+        lazy_dispatch: bool = False,
+        shard_ids: Optional[Iterable[int]] = None,
+        identify_coordinator: Optional[str] = None,
+        session_store: Optional[SessionStoreProtocol] = None,
+        session_save_interval: float = 60,
+        rescale_overlap: float = 10,
+        rescale_timeout: float = 600,
+        heartbeat_timeout: Optional[float] = None,
+    ) -> None:
+        if shard_ids is not None and shard_count is None:
+            raise ValueError("shard_count has to be set when running a subset of the shards")
         self.state: State = state
+        self.encoding: Literal["json", "etf"] = encoding
+        self.compression: Optional[Literal["zlib-stream", "zstd-stream"]] = compression
+        self.lazy_dispatch: bool = lazy_dispatch
+        self.session_store: Optional[SessionStoreProtocol] = session_store
+        """Where shard sessions are saved between restarts"""
+        self.session_save_interval: float = session_save_interval
+        self._session_saver: Optional[Task[None]] = None
+        self._closing: bool = False
+        self.rescale_overlap: float = rescale_overlap
+        self.rescale_timeout: float = rescale_timeout
+        self.heartbeat_timeout: Optional[float] = heartbeat_timeout
 
         # Ratelimiting
-        self._identify_ratelimits: defaultdict[int, TimesPer] = defaultdict(lambda: TimesPer(1, 5))
+        self._identify_scheduler: Optional[IdentifyScheduler] = None
         self._max_concurrency: Optional[int] = None
+        self.identify_connection: Optional[IdentifyConnection] = (
+            None if identify_coordinator is None else IdentifyConnection(identify_coordinator)
+        )
+        """The connection to the identify server, if identifies are scheduled by one"""
 
         # Shard count
         self.shard_count: Optional[int] = shard_count
         """The current shard count"""
         self._shard_count_locked: bool = self.shard_count is not None
+        self.shard_ids: Optional[list[int]] = None if shard_ids is None else list(shard_ids)
+        """The shards this gateway runs. None if it runs all of them"""
 
         # Shard sets
         self.shards: list[ShardProtocol] = []
         """The currently active shards"""
         # When we get disconnected for too low shard count, we start creating a second set of inactive shards.
-        self._pending_shard_set: list[Any] = []
+        self._pending_shard_set: list[ShardProtocol] = []
+        self._pending_shard_count: Optional[int] = None
+        self._pending_dispatcher: Optional[Dispatcher] = None
+        # The old set after the new one took over, until it is closed
+        self._retired_shards: list[ShardProtocol] = []
         self._recreating_shards: bool = False
+        # While both shard sets run, the hashes of recently dispatched events with the shard count of the set that
+        # dispatched them and how often the other set has yet to receive them. None otherwise
+        self._recent_events: Optional[OrderedDict[int, list[int]]] = None
+
+        self.startup: ShardStartup = ShardStartup()
+        """How far along starting the shards is"""
 
         # Dispatchers
         self.event_dispatcher: Dispatcher = Dispatcher()
         self.raw_dispatcher: Dispatcher = Dispatcher()
+        self.raw_event_dispatcher: Dispatcher = Dispatcher()
 
     async def connect(self) -> None:
         """Connect to the gateway"""
         r = await self.state.http.get_gateway_bot()
-        gateway_info = await r.json()
+        gateway_info = r.data
 
         if self.shard_count is None:
             self.shard_count = gateway_info["shards"]
 
         session_start_limit = gateway_info["session_start_limit"]
-        self._max_concurrency = session_start_limit["max_concurrency"]
+        max_concurrency: int = session_start_limit["max_concurrency"]
+        self._max_concurrency = max_concurrency
+        if self.identify_connection is not None:
+            await self.identify_connection.connect(max_concurrency=max_concurrency, shard_ids=self.shard_ids)
+        else:
+            self._identify_scheduler = IdentifyScheduler(max_concurrency)
+
+        for shard_id in range(self.shard_count) if self.shard_ids is None else self.shard_ids:
+            self.shards.append(self._create_shard(shard_id, self.shard_count))
+        if self.session_store is not None:
+            await self._restore_sessions()
+            self._session_saver = self.state.loop.create_task(self._save_sessions_loop())
+        self.state.loop.create_task(self.startup.run(self.shards, max_concurrency, self.event_dispatcher))
+
+    def _create_shard(self, shard_id: int, shard_count: int) -> ShardProtocol:
+        return self.state.type_sheet.shard(
+            self.state,
+            shard_id,
+            encoding=self.encoding,
+            compression=self.compression,
+            lazy_dispatch=self.lazy_dispatch,
+            shard_count=shard_count,
+            heartbeat_timeout=self.heartbeat_timeout,
+        )
+
+    async def _restore_sessions(self) -> None:
+        assert self.session_store is not None
+        sessions = await self.session_store.load()
+        for shard in self.shards:
+            session = sessions.get(shard.shard_id)
+            if session is not None and session.shard_count == self.shard_count:
+                shard.session = session
+        logger.info("Resuming %s saved sessions", sum(shard.session is not None for shard in self.shards))
 
-        for shard_id in range(self.shard_count):
-            shard = self.state.type_sheet.shard(
-                self.state,
-                shard_id,
-            )
-            self.state.loop.create_task(shard.connect())
-            self.shards.append(shard)
+    async def save_sessions(self) -> None:
+        """Save the sessions of the shards to :attr:`session_store`"""
+        if self.session_store is None:
+            return
+        sessions = {shard.shard_id: session for shard in self.shards if (session := shard.session) is not None}
+        if sessions:
+            await self.session_store.save(sessions)
+
+    async def _save_sessions_loop(self) -> None:
+        while True:
+            await sleep(self.session_save_interval)
+            try:
+                await self.save_sessions()
+            except Exception:
+                logger.exception("Could not save the shard sessions")
+
+    async def wait_until_ready(self) -> None:
+        """Wait until every shard received READY and streamed its guilds or failed to start.
+        See :attr:`startup` for progress and which shards failed.
+        """
+        await self.startup.wait()
+
+    async def send(self, data: dict[str, Any], *, shard_id: int = 0) -> None:
+        """Send a raw message to the gateway on one of the active shards
 
-    def get_identify_ratelimiter(self, shard_id: int) -> TimesPer:
+        Parameters
+        ----------
+        data: :class:`dict[str, Any]`
+            The raw data to send to discord
+        shard_id: :class:`int`
+            Which shard id to send on. This defaults to shard 0
+        """
+        for shard in self.shards:
+            if shard.shard_id == shard_id:
+                await shard.send(data)
+                return
+        raise NextcordException(f"Shard {shard_id} is not run by this gateway")
+
+    def health(self) -> list[ShardHealth]:
+        """How the connection of every active shard is doing
+
+        Returns
+        -------
+        list[ShardHealth]
+            The health of each shard in :attr:`shards`
+        """
+        return [shard.health() for shard in self.shards]
+
+    @property
+    def latency(self) -> Optional[float]:
+        """The average heartbeat latency of the shards in seconds. None if no shard has received a heartbeat ACK yet"""
+        latencies = [shard.latency for shard in self.health() if shard.latency is not None]
+        if not latencies:
+            return None
+        return sum(latencies) / len(latencies)
+
+    def get_identify_ratelimiter(self, shard_id: int) -> AsyncContextManager[Any]:
         """Get the ratelimiter the shard should use while connecting
 
         Parameters
@@ -103,9 +267,11 @@ class Gateway(GatewayProtocol):
 
         """
 
-        if self._max_concurrency is None:
+        if self.identify_connection is not None:
+            return self.identify_connection.slot(shard_id)
+        if self._identify_scheduler is None:
             raise NextcordException("Cannot get identify ratelimit before max_concurrency is filled")
-        return self._identify_ratelimits[shard_id % self._max_concurrency]
+        return self._identify_scheduler.slot(shard_id)
 
     def should_reconnect(self, shard: ShardProtocol) -> bool:
         """Called on :class:`ShardProtocol` disconnect to check if it should auto reconnect.
@@ -116,27 +282,162 @@ class Gateway(GatewayProtocol):
         shard: :class:`ShardProtocol`
             The shard asking if it should reconnect
         """
-        if not self._recreating_shards:
-            return True
-        if shard in self.shards:
+        if self._closing:
             return False
+        # Shards that are not part of a set anymore, like the old ones after rescaling, stay closed
+        return shard in self.shards or shard in self._pending_shard_set
 
-        return True
+    def should_dispatch(self, shard: ShardProtocol, event_name: str, data: Any) -> bool:
+        """Called by :class:`ShardProtocol` for every event to check if it should reach the gateway dispatchers.
+
+        While rescaling, events of the new shards are only used to track their startup until they take over.
+        Events received by both shard sets are only dispatched once.
+
+        Parameters
+        ----------
+        shard: :class:`ShardProtocol`
+            The shard that received the event
+        event_name: :class:`str`
+            The name of the event
+        data: :class:`Any`
+            The event data, either parsed or as JSON encoded :class:`bytes` or :class:`memoryview`
+        """
+        if self._pending_shard_count is not None and shard.shard_count == self._pending_shard_count:
+            if self._pending_dispatcher is not None and event_name in ("READY", "RESUMED", "GUILD_CREATE"):
+                if isinstance(data, memoryview):
+                    data = json.loads(bytes(data))
+                self._pending_dispatcher.dispatch(event_name, shard, data)
+            return False
+        recent_events = self._recent_events
+        if recent_events is None:
+            return True
+
+        # Both sets get the same events, only the sequence differs
+        key = hash((event_name, self._deduplication_key(data)))
+        seen = recent_events.get(key)
+        if seen is None or seen[0] == shard.shard_count:
+            # The same payload can come twice on one set, like a presence changing back, so count them
+            if seen is None:
+                recent_events[key] = [shard.shard_count, 1]
+            else:
+                seen[1] += 1
+                recent_events.move_to_end(key)
+            if len(recent_events) > DEDUPLICATION_WINDOW:
+                recent_events.popitem(last=False)
+            return True
+        # Already dispatched by the other set
+        seen[1] -= 1
+        if seen[1] == 0:
+            del recent_events[key]
+        return False
+
+    @staticmethod
+    def _deduplication_key(data: Any) -> Any:
+        # Any difference in the payload is a different event, raw ones are parsed so key order does not matter
+        if isinstance(data, (bytes, memoryview)):
+            data = json.loads(bytes(data))
+        if isinstance(data, dict):
+            return tuple(sorted((key, Gateway._deduplication_key(value)) for key, value in data.items()))
+        if isinstance(data, list):
+            return tuple(Gateway._deduplication_key(value) for value in data)
+        return data
 
     async def close(self) -> None:
         """Close all connections and cleanup.
         This should only be called once
         """
-        for shard in self.shards + self._pending_shard_set:
-            await shard.close()
+        self._closing = True
+        if self._session_saver is not None:
+            self._session_saver.cancel()
+        for shard in self.shards + self._pending_shard_set + self._retired_shards:
+            # Closing with 1000 ends the session, any other code keeps it resumable
+            await shard.close(1000 if self.session_store is None else 4000)
+        await self.save_sessions()
+        if self.identify_connection is not None:
+            await self.identify_connection.close()
+
+    async def _start_pending_shards(self, startup: ShardStartup, dispatcher: Dispatcher) -> None:
+        await startup.run(self._pending_shard_set, self._max_concurrency or 1, dispatcher)
+        await startup.wait()
 
     # Dispatcher handles
     async def handle_rescale(self) -> None:
         if self._recreating_shards:
-            # Possibly error here as this should never be dispatched?
+            # Every shard of the old set can ask for this
             return
         if self._shard_count_locked:
             await self.state.client.close(NotEnoughShardsException())
             return
+        try:
+            await self.rescale()
+        except NextcordException:
+            logger.exception("Could not rescale, keeping the current shards")
+
+    async def rescale(self, shard_count: Optional[int] = None) -> None:
+        """Move to a new shard count without downtime.
+
+        A new set of shards is started in the background while the current one keeps dispatching events.
+        Once every new shard is ready and streamed its guilds, :attr:`shards` is switched over to the new set.
+        The old set keeps running for :attr:`rescale_overlap` seconds so no events are missed, then it is closed.
+        If a new shard fails to start or they take longer than :attr:`rescale_timeout`, the new set is closed and the
+        old one keeps running.
+
+        Parameters
+        ----------
+        shard_count: :class:`Optional[int]`
+            The shard count to move to. None uses the one discord recommends
+
+        Raises
+        ------
+        NextcordException
+            The new shards could not be started. The current ones are still running
+        """
+        if self.shard_ids is not None:
+            raise NextcordException("Cannot rescale a gateway running a subset of the shards")
+        if self._recreating_shards:
+            return
         self._recreating_shards = True
-        # TODO: Rescale.
+        try:
+            if shard_count is None:
+                r = await self.state.http.get_gateway_bot()
+                shard_count = r.data["shards"]
+            if shard_count == self.shard_count:
+                return
+            logger.info("Rescaling from %s to %s shards", self.shard_count, shard_count)
+
+            self._pending_shard_count = shard_count
+            self._pending_dispatcher = Dispatcher()
+            self._pending_shard_set = [self._create_shard(shard_id, shard_count) for shard_id in range(shard_count)]
+            startup = ShardStartup()
+            try:
+                await wait_for(self._start_pending_shards(startup, self._pending_dispatcher), self.rescale_timeout)
+            except TimeoutError:
+                raise NextcordException(f"Rescaling to {shard_count} shards timed out, {startup}") from None
+            if startup.failed:
+                raise NextcordException(f"Shards {sorted(startup.failed)} failed to start, not rescaling")
+
+            # Nothing can dispatch in between, so every event goes to one of the sets
+            self._retired_shards = self.shards
+            self.shards = self._pending_shard_set
+            self.shard_count = shard_count
+            self._pending_shard_set = []
+            self._pending_shard_count = None
+            self._pending_dispatcher = None
+            # Only events received by both sets while they overlap can be duplicates
+            self._recent_events = OrderedDict()
+            logger.info("Switched to %s shards, closing the old ones in %ss", shard_count, self.rescale_overlap)
+
+            await sleep(self.rescale_overlap)
+            for shard in self._retired_shards:
+                await shard.close()
+            self._recent_events = None
+        finally:
+            # Shards left over if this failed part way, the old set keeps running
+            for shard in self._pending_shard_set:
+                await shard.close()
+            self._pending_shard_set = []
+            self._pending_shard_count = None
+            self._pending_dispatcher = None
+            self._retired_shards = []
+            self._recent_events = None
+            self._recreating_shards = False
@@ -0,0 +1,73 @@
+# The MIT License (MIT)
+# Copyright (c) 2021-present vcokltfre & tag-epic
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from typing import Optional
+
+
+class ShardHealth:
+    """A snapshot of how a shard's connection is doing
+
+    Parameters
+    ----------
+    shard_id: :class:`int`
+        The id of the shard
+    connected: :class:`bool`
+        If the shard has an open connection
+    latency: :class:`Optional[float]`
+        Seconds between sending the last acknowledged heartbeat and receiving its ACK. None before the first ACK
+    last_event_age: :class:`Optional[float]`
+        Seconds since the last payload was received. None if nothing was received yet
+    reconnects: :class:`int`
+        How many times the shard connected again after its first connection
+    bytes_received: :class:`int`
+        How many bytes were received, as sent over the wire
+    bytes_sent: :class:`int`
+        How many bytes were sent
+    """
+
+    __slots__ = ("shard_id", "connected", "latency", "last_event_age", "reconnects", "bytes_received", "bytes_sent")
+
+    def __init__(
+        self,
+        shard_id: int,
+        *,
+        connected: bool,
+        latency: Optional[float],
+        last_event_age: Optional[float],
+        reconnects: int,
+        bytes_received: int,
+        bytes_sent: int,
+    ) -> None:
+        self.shard_id: int = shard_id
+        self.connected: bool = connected
+        self.latency: Optional[float] = latency
+        self.last_event_age: Optional[float] = last_event_age
+        self.reconnects: int = reconnects
+        self.bytes_received: int = bytes_received
+        self.bytes_sent: int = bytes_sent
+
+    def __repr__(self) -> str:
+        return (
+            f"<ShardHealth shard_id={self.shard_id} connected={self.connected} latency={self.latency} "
+            f"last_event_age={self.last_event_age} reconnects={self.reconnects}>"
+        )
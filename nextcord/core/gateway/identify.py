@@ -0,0 +1,420 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+"""Identify scheduling, in process or shared between hosts through a :class:`IdentifyServer`.
+
+Discord lets ``max_concurrency`` shards identify every 5 seconds, one per bucket of ``shard_id % max_concurrency``.
+To start shards on multiple hosts at that rate, run a server with ``python -m nextcord.core.gateway.identify`` and
+point every gateway at it:
+
+.. code-block:: python3
+
+    client = Client(
+        token,
+        intents,
+        shard_count=1024,
+        gateway_options={"shard_ids": range(0, 256), "identify_coordinator": "tcp://10.0.0.1:7000"},
+    )
+"""
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from asyncio import (
+    Future,
+    IncompleteReadError,
+    Lock,
+    get_event_loop,
+    open_connection,
+    open_unix_connection,
+    run,
+    sleep,
+    start_server,
+    start_unix_server,
+)
+from contextlib import asynccontextmanager
+from logging import getLogger
+from struct import Struct
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from ...exceptions import NextcordException
+from ...utils import json
+
+if TYPE_CHECKING:
+    from asyncio import AbstractServer, StreamReader, StreamWriter, Task, TimerHandle
+    from typing import Any, AsyncIterator, Optional
+
+logger = getLogger(__name__)
+
+DEFAULT_IDENTIFY_ADDRESS = "tcp://127.0.0.1:7000"
+
+# The size of the header and body together, then the size of the header
+_FRAME = Struct(">IH")
+
+
+def write_frame(writer: StreamWriter, header: dict[str, Any], body: bytes = b"") -> None:
+    """Write a length prefixed frame made of a JSON header and a raw body
+
+    Parameters
+    ----------
+    writer: :class:`StreamWriter`
+        Where to write the frame to
+    header: :class:`dict[str, Any]`
+        What the frame is about
+    body: :class:`bytes`
+        Data sent as is. Used for event data so it does not have to be encoded again
+    """
+    encoded = json.dumps(header)
+    if isinstance(encoded, str):
+        encoded = encoded.encode("utf-8")
+    writer.write(_FRAME.pack(len(encoded) + len(body), len(encoded)) + encoded + body)
+
+
+async def read_frame(reader: StreamReader) -> tuple[dict[str, Any], bytes]:
+    """Read a frame written by :func:`write_frame`
+
+    Raises
+    ------
+    IncompleteReadError
+        The connection closed
+    """
+    size, header_size = _FRAME.unpack(await reader.readexactly(_FRAME.size))
+    data = await reader.readexactly(size)
+    return json.loads(data[:header_size]), data[header_size:]
+
+
+def parse_address(address: str) -> tuple[Optional[str], Any]:
+    """Split a ``tcp://host:port`` or unix socket path address
+
+    Returns
+    -------
+    tuple[Optional[str], Any]
+        The host and port, or None and the path
+    """
+    if address.startswith("tcp://"):
+        host, _, port = address[len("tcp://") :].rpartition(":")
+        return host, int(port)
+    return None, address.removeprefix("unix://")
+
+
+class _IdentifyBucket:
+    __slots__ = ("lock", "available_at")
+
+    def __init__(self) -> None:
+        self.lock: Lock = Lock()
+        self.available_at: float = 0
+
+
+class IdentifyScheduler:
+    """Hands out identify slots per ``max_concurrency`` bucket.
+
+    A bucket is held while the shard identifies and opens up again ``interval`` seconds after it finished, so the
+    time it took to get the slot to the shard does not matter. Shards get their slot in the order they asked for it.
+
+    Parameters
+    ----------
+    max_concurrency: :class:`int`
+        How many shards may identify at once
+    interval: :class:`float`
+        How many seconds to wait between identifies in the same bucket. This has a margin over discord's 5 seconds
+        for network jitter
+    """
+
+    def __init__(self, max_concurrency: int = 1, *, interval: float = 5.25) -> None:
+        self.max_concurrency: int = max_concurrency
+        self.interval: float = interval
+        self._buckets: dict[int, _IdentifyBucket] = {}
+
+    def _bucket(self, shard_id: int) -> _IdentifyBucket:
+        key = shard_id % self.max_concurrency
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _IdentifyBucket()
+        return bucket
+
+    async def acquire(self, shard_id: int) -> None:
+        """Wait for the bucket of a shard to be free. Call :meth:`release` once the shard sent its identify"""
+        bucket = self._bucket(shard_id)
+        await bucket.lock.acquire()
+        try:
+            delay = bucket.available_at - monotonic()
+            if delay > 0:
+                await sleep(delay)
+        except BaseException:
+            bucket.lock.release()
+            raise
+
+    def release(self, shard_id: int) -> None:
+        """The shard sent its identify, the next one in the bucket can go after the interval"""
+        bucket = self._bucket(shard_id)
+        bucket.available_at = monotonic() + self.interval
+        bucket.lock.release()
+
+    @asynccontextmanager
+    async def slot(self, shard_id: int) -> AsyncIterator[None]:
+        """Hold the identify slot of a shard
+
+        Parameters
+        ----------
+        shard_id: :class:`int`
+            The shard id of the connecting shard
+        """
+        await self.acquire(shard_id)
+        try:
+            yield
+        finally:
+            self.release(shard_id)
+
+
+class IdentifyServer:
+    """Schedules identifies for gateways on multiple hosts connected through :class:`IdentifyConnection`.
+
+    Run one per bot with ``python -m nextcord.core.gateway.identify``.
+
+    Parameters
+    ----------
+    address: :class:`str`
+        ``tcp://host:port`` or the path of a unix socket to listen on
+    max_concurrency: :class:`Optional[int]`
+        How many shards may identify at once. If None it is taken from the first gateway connecting
+    interval: :class:`float`
+        How many seconds to wait between identifies in the same bucket
+    hold_timeout: :class:`float`
+        How long a shard may hold a slot before it is given to the next one
+    """
+
+    def __init__(
+        self,
+        address: str = DEFAULT_IDENTIFY_ADDRESS,
+        *,
+        max_concurrency: Optional[int] = None,
+        interval: float = 5.25,
+        hold_timeout: float = 30,
+    ) -> None:
+        self.address: str = address
+        self.scheduler: IdentifyScheduler = IdentifyScheduler(max_concurrency or 1, interval=interval)
+        self.hold_timeout: float = hold_timeout
+        self._max_concurrency_known: bool = max_concurrency is not None
+        self._acquiring: dict[StreamWriter, dict[int, Task[None]]] = {}
+        self._held: dict[StreamWriter, dict[int, tuple[int, TimerHandle]]] = {}
+        self._server: Optional[AbstractServer] = None
+
+    async def start(self) -> None:
+        """Start listening. If the port is 0, :attr:`address` is updated with the picked port"""
+        host, location = parse_address(self.address)
+        if host is None:
+            self._server = await start_unix_server(self._handle_connection, location)
+        else:
+            self._server = await start_server(self._handle_connection, host, location)
+            if location == 0:
+                port = self._server.sockets[0].getsockname()[1]
+                self.address = f"tcp://{host}:{port}"
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()  # type: ignore
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Let the gateways find out, they reconnect once the server is back
+            for writer in list(self._held):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle_connection(self, reader: StreamReader, writer: StreamWriter) -> None:
+        self._acquiring[writer] = {}
+        self._held[writer] = {}
+        try:
+            while True:
+                try:
+                    header, body = await read_frame(reader)
+                except (IncompleteReadError, ConnectionError):
+                    break
+                self._handle_frame(writer, header, body)
+        finally:
+            # Gateway died, give back everything it was holding
+            for task in self._acquiring.pop(writer).values():
+                task.cancel()
+            for grant_id in list(self._held[writer]):
+                self._release(writer, grant_id)
+            del self._held[writer]
+            writer.close()
+
+    def _handle_frame(self, writer: StreamWriter, header: dict[str, Any], body: bytes) -> None:
+        op = header["op"]
+        if op == "acquire":
+            task = get_event_loop().create_task(self._grant(writer, header["id"], header["shard_id"]))
+            self._acquiring[writer][header["id"]] = task
+        elif op == "release":
+            # Still waiting for the scheduler if it is here, the task removes itself once granted
+            acquiring: Optional[Task[None]] = self._acquiring[writer].pop(header["id"], None)
+            if acquiring is not None:
+                acquiring.cancel()
+            self._release(writer, header["id"])
+        elif op == "hello":
+            max_concurrency = header.get("max_concurrency")
+            if max_concurrency and not self._max_concurrency_known:
+                self._max_concurrency_known = True
+                self.scheduler.max_concurrency = max_concurrency
+            logger.info("Gateway connected with %s", header)
+
+    async def _grant(self, writer: StreamWriter, grant_id: int, shard_id: int) -> None:
+        await self.scheduler.acquire(shard_id)
+        self._acquiring[writer].pop(grant_id, None)
+        timeout = get_event_loop().call_later(self.hold_timeout, self._release, writer, grant_id)
+        self._held[writer][grant_id] = (shard_id, timeout)
+        write_frame(writer, {"op": "grant", "id": grant_id})
+
+    def _release(self, writer: StreamWriter, grant_id: int) -> None:
+        held = self._held.get(writer, {}).pop(grant_id, None)
+        if held is None:
+            return
+        shard_id, timeout = held
+        timeout.cancel()
+        self.scheduler.release(shard_id)
+
+
+class IdentifyConnection:
+    """A connection to a :class:`IdentifyServer`
+
+    Parameters
+    ----------
+    address: :class:`str`
+        ``tcp://host:port`` or the path of the unix socket the server is listening on
+    reconnect_delay: :class:`float`
+        How many seconds to wait before trying again when the server can not be reached
+    """
+
+    def __init__(self, address: str = DEFAULT_IDENTIFY_ADDRESS, *, reconnect_delay: float = 1) -> None:
+        self.address: str = address
+        self.reconnect_delay: float = reconnect_delay
+        self._writer: Optional[StreamWriter] = None
+        # Sent again when reconnecting after the server restarted
+        self._hello: dict[str, Any] = {}
+        self._grants: dict[int, Future[None]] = {}
+        self._next_id: int = 0
+        self._connect_lock: Lock = Lock()
+
+    async def connect(self, **hello: Any) -> None:
+        """Connect to the server, telling it about this gateway
+
+        Parameters
+        ----------
+        hello:
+            Information about the gateway, like ``max_concurrency`` and ``shard_ids``
+        """
+        self._hello.update(hello)
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            host, location = parse_address(self.address)
+            if host is None:
+                reader, self._writer = await open_unix_connection(location)
+            else:
+                reader, self._writer = await open_connection(host, location)
+            get_event_loop().create_task(self._receive_loop(reader))
+            write_frame(self._writer, {"op": "hello", **self._hello})
+
+    async def _receive_loop(self, reader: StreamReader) -> None:
+        while True:
+            try:
+                header, body = await read_frame(reader)
+            except (IncompleteReadError, ConnectionError):
+                break
+            self._handle_frame(header, body)
+        logger.warning("Lost connection to %s", self.address)
+        self._writer = None
+        for future in self._grants.values():
+            if not future.done():
+                future.set_exception(NextcordException(f"Lost connection to {self.address}"))
+        self._grants.clear()
+
+    def _handle_frame(self, header: dict[str, Any], body: bytes) -> None:
+        if header["op"] == "grant":
+            future = self._grants.pop(header["id"], None)
+            if future is not None and not future.done():
+                future.set_result(None)
+
+    def send(self, header: dict[str, Any], body: bytes = b"") -> None:
+        if self._writer is None:
+            raise NextcordException(f"Not connected to {self.address}")
+        write_frame(self._writer, header, body)
+
+    @asynccontextmanager
+    async def slot(self, shard_id: int) -> AsyncIterator[None]:
+        """Hold the identify slot of a shard
+
+        Parameters
+        ----------
+        shard_id: :class:`int`
+            The shard id of the connecting shard
+        """
+        grant_id = self._next_id
+        self._next_id += 1
+        while True:
+            try:
+                # The connection is gone if the server restarted since the last identify
+                await self.connect()
+            except OSError as error:
+                logger.warning("Could not connect to %s, retrying: %s", self.address, error)
+                await sleep(self.reconnect_delay)
+                continue
+            future: Future[None] = Future()
+            self._grants[grant_id] = future
+            self.send({"op": "acquire", "id": grant_id, "shard_id": shard_id})
+            try:
+                await future
+            except NextcordException:
+                # Lost the connection while waiting, ask the server again once it is back
+                continue
+            break
+        try:
+            yield
+        finally:
+            self._grants.pop(grant_id, None)
+            if self._writer is not None:
+                self.send({"op": "release", "id": grant_id})
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Schedule identifies for nextcord gateways on multiple hosts")
+    parser.add_argument("--address", default=DEFAULT_IDENTIFY_ADDRESS, help="tcp://host:port or a unix socket path")
+    parser.add_argument("--max-concurrency", type=int, default=None, help="Taken from the gateways if not set")
+    args = parser.parse_args()
+
+    async def serve() -> None:
+        server = IdentifyServer(args.address, max_concurrency=args.max_concurrency)
+        await server.serve_forever()
+
+    run(serve())
+
+
+if __name__ == "__main__":
+    main()
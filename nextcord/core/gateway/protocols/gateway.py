@@ -22,10 +22,8 @@ from __future__ import annotations
 
 from typing import TYPE_CHECKING, Protocol
 
-from nextcord.core.ratelimiter import TimesPer
-
 if TYPE_CHECKING:
-    from typing import Any, Optional
+    from typing import Any, AsyncContextManager, Optional
 
     from ....client.state import State
     from ....dispatcher import Dispatcher
@@ -46,6 +44,8 @@ class GatewayProtocol(Protocol):
         The current state of the bot
     shard_count: :class:`Optional[int]`
         The current shard count. If this is not None it is expected for it to error instead of changing shard count
+    options:
+        Implementation specific options, passed as ``gateway_options`` to the :class:`Client <nextcord.client.client.Client>`
     """
 
     state: State
@@ -56,14 +56,21 @@ class GatewayProtocol(Protocol):
     """A dispatcher for events dispatched through the dispatch opcode. This will be dispatched by :class:`ShardProtocol`"""
     raw_dispatcher: Dispatcher
     """A dispatcher from raw shard data. This will be dispatched by :class:`ShardProtocol`"""
+    raw_event_dispatcher: Dispatcher
+    """Like :attr:`event_dispatcher`, but with the data as JSON encoded :class:`bytes`.
+    This is for forwarding events elsewhere without decoding them. This will be dispatched by :class:`ShardProtocol`"""
 
-    def __init__(self, state: State, shard_count: Optional[int] = None) -> None:
+    def __init__(self, state: State, shard_count: Optional[int] = None, **options: Any) -> None:
         ...
 
     async def connect(self) -> None:
         """Connect to the gateway."""
         ...
 
+    async def wait_until_ready(self) -> None:
+        """Wait until every shard is ready"""
+        ...
+
     async def send(self, data: dict[str, Any], *, shard_id: int = 0) -> None:
         """Sends a raw message to the gateway. Generally this should not be used often as gateway version might differ.
 
@@ -87,14 +94,33 @@ class GatewayProtocol(Protocol):
         """
         ...
 
+    def should_dispatch(self, shard: ShardProtocol, event_name: str, data: Any) -> bool:
+        """Called by :class:`ShardProtocol` for every event before dispatching it to the gateway dispatchers.
+        This can be used to hide events from shards that are still starting or drop duplicates while rescaling
+
+        Parameters
+        ----------
+        shard: :class:`ShardProtocol`
+            The shard that received the event
+        event_name: :class:`str`
+            The name of the event
+        data: :class:`Any`
+            The event data, either parsed or as JSON encoded :class:`bytes` or :class:`memoryview`
+        """
+        ...
+
+    async def handle_rescale(self) -> None:
+        """Called by :class:`ShardProtocol` when discord says more shards are needed"""
+        ...
+
     async def close(self) -> None:
         """Close all connections and cleanup.
         This should only be called once
         """
         ...
 
-    def get_identify_ratelimiter(self, shard_id: int) -> TimesPer:
-        """Get the ratelimiter the shard should use while connecting
+    def get_identify_ratelimiter(self, shard_id: int) -> AsyncContextManager[Any]:
+        """Get the ratelimiter the shard should use while connecting. The shard holds it while it identifies
 
         Parameters
         ----------
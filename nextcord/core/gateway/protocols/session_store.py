@@ -0,0 +1,48 @@
+# The MIT License (MIT)
+# Copyright (c) 2021-present vcokltfre & tag-epic
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Protocol
+
+if TYPE_CHECKING:
+    from ..session import Session
+
+
+class SessionStoreProtocol(Protocol):
+    """Keeps shard sessions between restarts so :class:`GatewayProtocol` can resume them instead of identifying"""
+
+    async def load(self) -> dict[int, Session]:
+        """Load the saved sessions
+
+        Returns
+        -------
+        dict[int, Session]
+            The saved sessions by shard id
+        """
+        ...
+
+    async def save(self, sessions: dict[int, Session]) -> None:
+        """Save sessions, replacing the saved sessions of the same shards
+
+        Parameters
+        ----------
+        sessions: :class:`dict[int, Session]`
+            The sessions to save by shard id
+        """
+        ...
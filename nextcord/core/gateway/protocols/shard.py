@@ -27,7 +27,10 @@ from nextcord.dispatcher import Dispatcher
 
 if TYPE_CHECKING:
     from asyncio import Event
-    from typing import Any
+    from typing import Any, Optional
+
+    from ..health import ShardHealth
+    from ..session import Session
 
 
 class ShardProtocol(Protocol):
@@ -51,7 +54,21 @@ class ShardProtocol(Protocol):
     event_dispatcher: Dispatcher
     """A dispatcher that gets all events dispatched via the dispatch opcode from the gateway. This should only dispatch the data"""
 
-    def __init__(self, state: State, shard_id: int) -> None:
+    def __init__(self, state: State, shard_id: int, **options: Any) -> None:
+        ...
+
+    @property
+    def shard_count(self) -> int:
+        """The shard count this shard identifies with. While rescaling this differs from :attr:`GatewayProtocol.shard_count`"""
+        ...
+
+    @property
+    def session(self) -> Optional[Session]:
+        """The session to resume, None if the shard has to identify. This is set before connecting to resume a saved one"""
+        ...
+
+    @session.setter
+    def session(self, session: Optional[Session]) -> None:
         ...
 
     async def connect(self) -> None:
@@ -72,7 +89,11 @@ class ShardProtocol(Protocol):
         """
         ...
 
-    async def close(self) -> None:
+    def health(self) -> ShardHealth:
+        """How the connection is doing right now, like heartbeat latency and how long ago something was received"""
+        ...
+
+    async def close(self, code: int = 1000) -> None:
         """Closes the connection to the gateway
 
         .. note::
@@ -0,0 +1,170 @@
+# The MIT License (MIT)
+# Copyright (c) 2021-present vcokltfre & tag-epic
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+"""Stores to keep shard sessions between restarts so the shards can resume instead of identifying again."""
+
+from __future__ import annotations
+
+import sqlite3
+from asyncio import get_running_loop
+from os import replace
+from typing import TYPE_CHECKING
+
+from ...utils import json
+from .protocols.session_store import SessionStoreProtocol
+
+if TYPE_CHECKING:
+    from typing import Any, Optional
+
+
+class Session:
+    """What a shard needs to resume its session
+
+    Parameters
+    ----------
+    session_id: :class:`str`
+        The session id received in READY
+    sequence: :class:`Optional[int]`
+        The last sequence number the shard received
+    resume_url: :class:`Optional[str]`
+        The gateway url to resume on, received in READY
+    shard_count: :class:`int`
+        The shard count the session was identified with. A session can only be resumed with the same shard count
+    """
+
+    __slots__ = ("session_id", "sequence", "resume_url", "shard_count")
+
+    def __init__(self, session_id: str, sequence: Optional[int], resume_url: Optional[str], shard_count: int) -> None:
+        self.session_id: str = session_id
+        self.sequence: Optional[int] = sequence
+        self.resume_url: Optional[str] = resume_url
+        self.shard_count: int = shard_count
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "session_id": self.session_id,
+            "sequence": self.sequence,
+            "resume_url": self.resume_url,
+            "shard_count": self.shard_count,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> Session:
+        return cls(data["session_id"], data["sequence"], data["resume_url"], data["shard_count"])
+
+    def __repr__(self) -> str:
+        return f"<Session session_id={self.session_id!r} sequence={self.sequence} shard_count={self.shard_count}>"
+
+
+class FileSessionStore(SessionStoreProtocol):
+    """A :class:`SessionStoreProtocol` keeping sessions in a json file.
+
+    The file is rewritten on every save, so this is meant for a single process.
+    Use :class:`SqliteSessionStore` when multiple processes share a store.
+
+    Parameters
+    ----------
+    path: :class:`str`
+        Where to keep the file
+    """
+
+    def __init__(self, path: str = "nextcord-sessions.json") -> None:
+        self.path: str = path
+
+    async def load(self) -> dict[int, Session]:
+        return await get_running_loop().run_in_executor(None, self._load)
+
+    async def save(self, sessions: dict[int, Session]) -> None:
+        await get_running_loop().run_in_executor(None, self._save, sessions)
+
+    def _read(self) -> dict[str, Any]:
+        try:
+            with open(self.path, "rb") as f:
+                data: dict[str, Any] = json.loads(f.read())
+                return data
+        except FileNotFoundError:
+            return {}
+
+    def _load(self) -> dict[int, Session]:
+        return {int(shard_id): Session.from_dict(data) for shard_id, data in self._read().items()}
+
+    def _save(self, sessions: dict[int, Session]) -> None:
+        saved = self._read()
+        for shard_id, session in sessions.items():
+            saved[str(shard_id)] = session.to_dict()
+        data = json.dumps(saved)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        # Written next to it first so a crash while saving never leaves a half written file
+        with open(f"{self.path}.tmp", "wb") as f:
+            f.write(data)
+        replace(f"{self.path}.tmp", self.path)
+
+
+class SqliteSessionStore(SessionStoreProtocol):
+    """A :class:`SessionStoreProtocol` keeping sessions in a sqlite database.
+
+    Every save only touches the rows of the shards saved, so multiple processes can share a database.
+
+    Parameters
+    ----------
+    path: :class:`str`
+        Where to keep the database
+    """
+
+    def __init__(self, path: str = "nextcord-sessions.sqlite3") -> None:
+        self.path: str = path
+
+    async def load(self) -> dict[int, Session]:
+        return await get_running_loop().run_in_executor(None, self._load)
+
+    async def save(self, sessions: dict[int, Session]) -> None:
+        await get_running_loop().run_in_executor(None, self._save, sessions)
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=30)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "shard_id INTEGER PRIMARY KEY, session_id TEXT NOT NULL, sequence INTEGER, resume_url TEXT, "
+            "shard_count INTEGER NOT NULL)"
+        )
+        return connection
+
+    def _load(self) -> dict[int, Session]:
+        connection = self._connect()
+        try:
+            rows = connection.execute(
+                "SELECT shard_id, session_id, sequence, resume_url, shard_count FROM sessions"
+            ).fetchall()
+        finally:
+            connection.close()
+        return {shard_id: Session(*session) for shard_id, *session in rows}
+
+    def _save(self, sessions: dict[int, Session]) -> None:
+        connection = self._connect()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                    [
+                        (shard_id, session.session_id, session.sequence, session.resume_url, session.shard_count)
+                        for shard_id, session in sessions.items()
+                    ],
+                )
+        finally:
+            connection.close()
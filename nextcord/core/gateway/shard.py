@@ -18,12 +18,14 @@
 # DEALINGS IN THE SOFTWARE.
 from __future__ import annotations
 
+import re
 import zlib
 from asyncio.locks import Event
 from asyncio.tasks import sleep
 from logging import getLogger
 from random import random
 from sys import platform
+from time import monotonic
 from typing import TYPE_CHECKING, Any
 
 from aiohttp import WSMsgType
@@ -32,6 +34,7 @@ from ...dispatcher import Dispatcher
 from ...exceptions import NextcordException
 from ...utils import json
 from ..ratelimiter import TimesPer
+from . import etf
 from .enums import CloseCodeEnum, OpcodeEnum
 from .exceptions import (
     BadDataException,
@@ -39,45 +42,133 @@ from .exceptions import (
     PrivilegedIntentsRequiredException,
     ShardClosedException,
 )
+from .health import ShardHealth
 from .protocols.shard import ShardProtocol
+from .session import Session
+
+try:
+    # Python 3.14+
+    from compression.zstd import ZstdDecompressor, ZstdError  # type: ignore[import]
+
+    def _zstd_decompressobj() -> Any:
+        return ZstdDecompressor()
+
+    HAS_ZSTD = True
+except ModuleNotFoundError:
+    try:
+        from zstandard import ZstdDecompressor, ZstdError  # type: ignore[import]
+
+        def _zstd_decompressobj() -> Any:
+            return ZstdDecompressor().decompressobj()
+
+        HAS_ZSTD = True
+    except ModuleNotFoundError:
+        HAS_ZSTD = False
 
 if TYPE_CHECKING:
     from logging import Logger
-    from typing import Optional
+    from typing import Callable, Literal, Optional, Union
 
     from aiohttp import ClientWebSocketResponse
 
     from ...client.state import State
 
 ZLIB_SUFFIX = b"\x00\x00\xff\xff"
+MAX_BUFFER_SIZE = 64 * 1024 * 1024
+"""The most fragmented compressed data we will hold for one message before giving up on the connection"""
+RETAINED_BUFFER_SIZE = 1024 * 1024
+"""How big the fragment buffer may stay between messages. Bigger buffers are freed once the message is done"""
+
+
+# Discord sends d last, so the header can be read without parsing it. Anything else falls back to a full parse
+_DISPATCH_HEADER = re.compile(rb'\{"t":"([A-Z0-9_]+)","s":(?:null|(\d+)),"op":0,"d":')
+
+ENCODINGS = ("json", "etf")
+COMPRESSIONS = ("zlib-stream", "zstd-stream", None)
 
 
 class Shard(ShardProtocol):
+    """A :class:`ShardProtocol` implementation
+
+    Parameters
+    ----------
+    state: :class:`State`
+        The current state of the bot
+    shard_id: :class:`int`
+        The id of this shard
+    encoding: :class:`str`
+        How payloads are encoded. ``json`` or ``etf``. ETF is decoded in Python and is much slower than ``json``
+    compression: :class:`Optional[str]`
+        How the connection is compressed. ``zlib-stream``, ``zstd-stream`` or None.
+        ``zstd-stream`` needs Python 3.14 or the ``zstandard`` package.
+    lazy_dispatch: :class:`bool`
+        Only parse dispatched events if something listens to them. This only applies to the ``json`` encoding.
+    shard_count: :class:`Optional[int]`
+        The shard count to identify with. None uses :attr:`GatewayProtocol.shard_count`
+    heartbeat_timeout: :class:`Optional[float]`
+        How long to wait for a heartbeat ACK before considering the connection dead and reconnecting, in seconds.
+        None waits until the next heartbeat is due, which is what discord asks for.
+    """
+
     def __init__(
         self,
         state: State,
         shard_id: int,
+        *,
+        encoding: Literal["json", "etf"] = "json",
+        compression: Optional[Literal["zlib-stream", "zstd-stream"]] = "zlib-stream",
+        lazy_dispatch: bool = False,
+        shard_count: Optional[int] = None,
+        heartbeat_timeout: Optional[float] = None,
     ) -> None:
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unknown gateway encoding {encoding!r}")
+        if compression not in COMPRESSIONS:
+            raise ValueError(f"Unknown gateway compression {compression!r}")
+        if compression == "zstd-stream" and not HAS_ZSTD:
+            raise ValueError("zstd-stream compression needs Python 3.14 or the zstandard package")
         self.shard_id: int = shard_id
+        self.encoding: str = encoding
+        self.compression: Optional[str] = compression
+        self.lazy_dispatch: bool = lazy_dispatch and encoding == "json"
+        self._shard_count: Optional[int] = shard_count
+        self.heartbeat_timeout: Optional[float] = heartbeat_timeout
 
         # Events
         self.ready: Event = Event()
 
         # Internal things
-        self._gateway_url = "wss://gateway.discord.gg?v=9&compress=zlib-stream"
+        self._gateway_query = f"v=9&encoding={encoding}"
+        if compression is not None:
+            self._gateway_query += f"&compress={compression}"
+        self._gateway_url = f"wss://gateway.discord.gg?{self._gateway_query}"
+        self._loads: Callable[[Any], Any] = etf.decode if encoding == "etf" else json.loads
         self._ws: Optional[ClientWebSocketResponse] = None
         self._state: State = state
         self._ratelimiter: TimesPer = TimesPer(120 - 3, 60)  # 3 margin for heartbeats
         self._zlib = zlib.decompressobj()
+        self._zstd: Any = _zstd_decompressobj() if compression == "zstd-stream" else None
+        # Only used for fragmented messages. This is reused, _buffer_size is how much of it is filled
         self._buffer = bytearray()
+        self._buffer_size: int = 0
         self._logger: Logger = getLogger(f"nextcord.shard.{self.shard_id}")
 
         # Discord info
         self._seq: Optional[int] = None
         self._session_id: Optional[str] = None
+        self._resume_url: Optional[str] = None
 
         # Heartbeating related
         self._has_acknowledged_heartbeat: bool = True
+        self._heartbeat_sent_at: Optional[float] = None
+        self.latency: Optional[float] = None
+        """Seconds between sending the last acknowledged heartbeat and receiving its ACK"""
+
+        # Health
+        self._last_received_at: Optional[float] = None
+        self._connections: int = 0
+        self.bytes_received: int = 0
+        self.bytes_sent: int = 0
 
         # Dispatchers
         self.opcode_dispatcher: Dispatcher = Dispatcher()
@@ -87,28 +178,61 @@ class Shard(ShardProtocol):
         # Register handles
         self.opcode_dispatcher.add_listener(self._handle_hello, OpcodeEnum.HELLO.value)
         self.opcode_dispatcher.add_listener(self._handle_heartbeat_ack, OpcodeEnum.HEARTBEAT_ACK.value)
-        self.opcode_dispatcher.add_listener(self._handle_set_sequence)
-        self.opcode_dispatcher.add_listener(self._handle_raw_dispatch)
+        self.opcode_dispatcher.add_listener(self._handle_invalid_session, OpcodeEnum.INVALID_SESSION.value)
         self.event_dispatcher.add_listener(self._handle_ready, "READY")
-        self.event_dispatcher.add_listener(self._handle_dispatch)
+        self.event_dispatcher.add_listener(self._handle_resumed, "RESUMED")
         self.disconnect_dispatcher.add_listener(self._handle_disconnect)
 
+    @property
+    def shard_count(self) -> int:
+        """The shard count this shard identifies with"""
+        if self._shard_count is None:
+            return self._state.gateway.shard_count  # type: ignore
+        return self._shard_count
+
+    @property
+    def session(self) -> Optional[Session]:
+        """The session to resume, None if the shard has to identify. Set this before connecting to resume a saved one"""
+        if self._session_id is None:
+            return None
+        return Session(self._session_id, self._seq, self._resume_url, self.shard_count)
+
+    @session.setter
+    def session(self, session: Optional[Session]) -> None:
+        if session is None:
+            self._session_id = self._seq = self._resume_url = None
+            return
+        self._session_id = session.session_id
+        self._seq = session.sequence
+        self._resume_url = session.resume_url
+
     async def connect(self) -> None:
-        self._ws = await self._state.http.ws_connect(self._gateway_url)
+        if self._session_id is not None and self._resume_url is not None:
+            url = f"{self._resume_url}?{self._gateway_query}"
+        else:
+            url = self._gateway_url
+        self._ws = await self._state.http.ws_connect(url)
+        self._connections += 1
         self._zlib = zlib.decompressobj()
+        if self._zstd is not None:
+            self._zstd = _zstd_decompressobj()
+        self._buffer_size = 0
         self._state.loop.create_task(self._receive_loop())
         if self._session_id is None:
-            async with self._state.gateway.get_identify_ratelimiter(self.shard_id):
-                try:
-                    await self.identify()
-                except ShardClosedException:
-                    self._logger.debug("Ignoring identify as shard closed")
-                    return
-            self._logger.info("Connected to the gateway")
-            self.ready.set()
+            await self._identify_in_turn()
         else:
             await self.resume()
-            self._logger.info("Reconnected to the gateway")
+            self._logger.info("Resuming session")
+
+    async def _identify_in_turn(self) -> None:
+        async with self._state.gateway.get_identify_ratelimiter(self.shard_id):
+            try:
+                await self.identify()
+            except ShardClosedException:
+                self._logger.debug("Ignoring identify as shard closed")
+                return
+        self._logger.info("Connected to the gateway")
+        self.ready.set()
 
     async def _send(self, data: dict[str, Any]) -> None:
         if self._ws is None:
@@ -116,9 +240,13 @@ class Shard(ShardProtocol):
         if self._ws.closed:
             raise NextcordException("Cannot send message to closed WS")
         self._logger.debug("> %s", data)
-        payload = json.dumps(data)
-        if isinstance(payload, str):
-            payload = payload.encode("utf-8")
+        if self.encoding == "etf":
+            payload = etf.encode(data)
+        else:
+            payload = json.dumps(data)
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+        self.bytes_sent += len(payload)
         try:
             await self._ws.send_bytes(payload)
         except ConnectionResetError:
@@ -132,22 +260,31 @@ class Shard(ShardProtocol):
         if self._ws is None:
             raise NextcordException("Receive loop got called before WS was created.")
         async for message in self._ws:
+            self._last_received_at = monotonic()
             if message.type == WSMsgType.BINARY:
-                try:
-                    raw_data = self._decompress(message.data)
-                except PartialDataException:
-                    continue
-                except:
-                    # Corruption/drop. Resetting is the only way as we are stateless
-                    return await self.connect()
-                data = json.loads(raw_data.decode("utf-8"))
-                self._logger.debug("< %s", data)
-                self.opcode_dispatcher.dispatch(data["op"], data)
-
-                if data["op"] == OpcodeEnum.DISPATCH.value:
-                    self.event_dispatcher.dispatch(data["t"], data["d"])
+                self.bytes_received += len(message.data)
+                if self.compression is None:
+                    raw_data = message.data
+                else:
+                    try:
+                        raw_data = (
+                            self._decompress(message.data)
+                            if self._zstd is None
+                            else self._decompress_zstd(message.data)
+                        )
+                    except PartialDataException:
+                        continue
+                    except:
+                        # Corruption/drop. Resetting is the only way as we are stateless
+                        return await self.connect()
+            elif message.type == WSMsgType.TEXT:
+                self.bytes_received += len(message.data)
+                # JSON without compression is sent as text
+                raw_data = message.data.encode("utf-8") if self.lazy_dispatch else message.data
             else:
                 self._logger.debug("Unknown message type %s", message.type)
+                continue
+            self._handle_payload(raw_data)
         close_code = self._ws.close_code
         if close_code is None:
             return
@@ -159,54 +296,175 @@ class Shard(ShardProtocol):
             self._logger.info("Disconnected with code %s (%s)", close_code, close_code_enum)
         self.disconnect_dispatcher.dispatch(close_code)
 
+    def _handle_payload(self, raw_data: Union[bytes, str]) -> None:
+        if self.lazy_dispatch:
+            # Always bytes when dispatching lazily
+            header = _DISPATCH_HEADER.match(raw_data)  # type: ignore
+            if header is not None and raw_data[-1:] == b"}":
+                return self._handle_dispatch_lazily(header, raw_data)  # type: ignore
+
+        # Both orjson and json take the utf-8 bytes directly
+        data = self._loads(raw_data)
+        self._logger.debug("< %s", data)
+        forward = True
+        if data["op"] == OpcodeEnum.DISPATCH.value:
+            gateway = self._state.gateway
+            forward = gateway.should_dispatch(self, data["t"], data["d"])
+            if forward and gateway.raw_event_dispatcher.has_listeners(data["t"]):
+                raw_event = json.dumps(data["d"])
+                if isinstance(raw_event, str):
+                    raw_event = raw_event.encode("utf-8")
+                gateway.raw_event_dispatcher.dispatch(data["t"], self, raw_event)
+        self._dispatch(data, forward)
+
+    def _handle_dispatch_lazily(self, header: re.Match[bytes], raw_data: bytes) -> None:
+        event_name = header[1].decode()
+        if header[2] is not None:
+            self._set_sequence(int(header[2]))
+        gateway = self._state.gateway
+        forward = gateway.should_dispatch(self, event_name, memoryview(raw_data)[header.end() : -1])
+        if forward and gateway.raw_event_dispatcher.has_listeners(event_name):
+            gateway.raw_event_dispatcher.dispatch(event_name, self, raw_data[header.end() : -1])
+        if (
+            self.event_dispatcher.listeners.get(event_name)
+            or self.opcode_dispatcher.listeners.get(OpcodeEnum.DISPATCH.value)
+            or forward
+            and (
+                gateway.event_dispatcher.has_listeners(event_name)
+                or gateway.raw_dispatcher.has_listeners(OpcodeEnum.DISPATCH.value)
+            )
+        ):
+            data = self._loads(raw_data)
+            self._logger.debug("< %s", data)
+            self._dispatch(data, forward)
+        else:
+            self._logger.debug("< %s without listeners", event_name)
+
+    def _dispatch(self, data: dict[str, Any], forward: bool = True) -> None:
+        # forward is False for events the gateway should not see, like the ones from shards still starting to rescale
+        if (seq := data["s"]) is not None:
+            self._set_sequence(seq)
+        gateway = self._state.gateway
+        self.opcode_dispatcher.dispatch(data["op"], data)
+        if forward:
+            gateway.raw_dispatcher.dispatch(data["op"], self, data)
+
+        if data["op"] == OpcodeEnum.DISPATCH.value:
+            self.event_dispatcher.dispatch(data["t"], data["d"])
+            if forward:
+                gateway.event_dispatcher.dispatch(data["t"], self, data["d"])
+
+    def _set_sequence(self, seq: int) -> None:
+        # Not a listener, tasks for earlier payloads could run after later ones and set it back
+        self._logger.debug("Updated sequence number to %s", seq)
+        self._seq = seq
+
     async def _heartbeat_loop(self, heartbeat_interval: float) -> None:
-        if self._ws is None:
+        ws = self._ws
+        if ws is None:
             raise NextcordException("WS was None when HB loop started")
-        while not self._ws.closed:
-            if not self._has_acknowledged_heartbeat:
-                await self._ws.close(code=1008)
-                return
+        # Discord asks for a random first heartbeat so shards started together do not heartbeat together
+        await sleep(heartbeat_interval * random())
+        timeout = heartbeat_interval
+        if self.heartbeat_timeout is not None:
+            timeout = min(self.heartbeat_timeout, heartbeat_interval)
+        # Stops when this connection closes, a reconnect starts a new loop
+        while not ws.closed and ws is self._ws:
             self._has_acknowledged_heartbeat = False
+            self._heartbeat_sent_at = monotonic()
             await self._send(
                 {"op": OpcodeEnum.HEARTBEAT.value, "d": self._seq},
             )
-            await sleep(heartbeat_interval)
+            await sleep(timeout)
+            if not self._has_acknowledged_heartbeat:
+                # A zombie connection, a non 1000 code keeps the session so it can resume
+                self._logger.warning("No heartbeat ACK within %.1fs, reconnecting", timeout)
+                await ws.close(code=1008)
+                return
+            await sleep(heartbeat_interval - timeout)
 
     def _decompress(self, data: bytes) -> bytes:
-        self._buffer.extend(data)
+        complete = data[-4:] == ZLIB_SUFFIX
+        if complete and not self._buffer_size:
+            # The whole message is in this frame, which is almost always the case. No need to copy it
+            payload: Union[bytes, memoryview] = data
+        else:
+            # This might happen with big payloads like member chunking
+            end = self._buffer_size + len(data)
+            if end > MAX_BUFFER_SIZE:
+                self._reset_buffer()
+                raise BadDataException
+            self._buffer[self._buffer_size : end] = data
+            self._buffer_size = end
+            if not complete:
+                raise PartialDataException
+            payload = memoryview(self._buffer)[:end]
+            self._buffer_size = 0
 
-        if len(data) < 4 or data[-4:] != ZLIB_SUFFIX:
-            # This might happen with big payloads like member chunking? Not sure if discord uses it or not...
-            raise PartialDataException
         try:
-            decompressed = self._zlib.decompress(self._buffer)
-        except:
-            # Most likely corrupted data. We are going to ignore it and pretend nothing happened..."
-            self._buffer = bytearray()
+            return self._zlib.decompress(payload)
+        except zlib.error:
+            # Most likely corrupted data. We are going to ignore it and pretend nothing happened...
+            self._reset_buffer()
             raise BadDataException
-        self._buffer = bytearray()  # reset buffer
-        return decompressed
+        finally:
+            if isinstance(payload, memoryview):
+                payload.release()
+                if len(self._buffer) > RETAINED_BUFFER_SIZE:
+                    self._buffer = bytearray()
+
+    def _decompress_zstd(self, data: bytes) -> bytes:
+        # Every message is flushed, so one message always gives the whole payload
+        try:
+            return bytes(self._zstd.decompress(data))
+        except ZstdError:
+            raise BadDataException
+
+    def _reset_buffer(self) -> None:
+        self._buffer_size = 0
+        if len(self._buffer) > RETAINED_BUFFER_SIZE:
+            self._buffer = bytearray()
 
     async def close(self, code: int = 1000) -> None:
         if self._ws:
             await self._ws.close(code=code)
-        self._buffer.clear()
+        self._buffer = bytearray()
+        self._buffer_size = 0
 
     # Handles
     async def _handle_hello(self, data: dict[str, Any]) -> None:
         heartbeat_interval = data["d"]["heartbeat_interval"] / 1000
-
-        intitial_wait_time = heartbeat_interval * random()
-        await sleep(intitial_wait_time)
         self._state.loop.create_task(self._heartbeat_loop(heartbeat_interval))
 
-    async def _handle_set_sequence(self, _: int, data: dict[str, Any]) -> None:
-        if (seq := data["s"]) is not None:
-            self._logger.debug("Updated sequence number to %s", seq)
-            self._seq = seq
-
     async def _handle_heartbeat_ack(self, _: dict[str, Any]) -> None:
         self._has_acknowledged_heartbeat = True
+        if self._heartbeat_sent_at is not None:
+            self.latency = monotonic() - self._heartbeat_sent_at
+
+    def health(self) -> ShardHealth:
+        """How the connection is doing right now"""
+        now = monotonic()
+        return ShardHealth(
+            self.shard_id,
+            connected=self._ws is not None and not self._ws.closed,
+            latency=self.latency,
+            last_event_age=None if self._last_received_at is None else now - self._last_received_at,
+            reconnects=max(self._connections - 1, 0),
+            bytes_received=self.bytes_received,
+            bytes_sent=self.bytes_sent,
+        )
+
+    async def _handle_invalid_session(self, data: dict[str, Any]) -> None:
+        # Discord asks to wait a random 1-5 seconds before trying again
+        await sleep(1 + random() * 4)
+        if data["d"] and self._session_id is not None:
+            self._logger.info("Session was interrupted, resuming it")
+            await self.resume()
+            return
+        # Saved sessions can be too old to resume after a restart
+        self._logger.info("Session is no longer valid, identifying")
+        self.session = None
+        await self._identify_in_turn()
 
     async def _handle_disconnect(self, close_code: Optional[int]) -> None:
         if close_code == None:
@@ -223,9 +481,12 @@ class Shard(ShardProtocol):
             # TODO: Error
             await self._state.client.close(PrivilegedIntentsRequiredException())
             return
+        if close_code == CloseCodeEnum.SHARDING_REQUIRED:
+            # The other shards keep running until a new set with more shards takes over
+            await self._state.gateway.handle_rescale()
+            return
         # Errors which should never happen
         if close_code in [
-            CloseCodeEnum.SHARDING_REQUIRED,
             CloseCodeEnum.INVALID_SHARD,
             CloseCodeEnum.INVALID_API_VERSION,
         ]:
@@ -238,21 +499,19 @@ class Shard(ShardProtocol):
             CloseCodeEnum.SESSION_TIMED_OUT,
         ]:
             # Cannot connect back with same session, reconnect (w/new session)
-            self._session_id = None
-            self._seq = None
+            self.session = None
 
         # Reconnect and hope it works
         await self.connect()
 
     async def _handle_ready(self, data: dict[str, Any]) -> None:
         self._session_id = data["session_id"]
+        self._resume_url = data.get("resume_gateway_url")
         self._logger.debug("Session id set!")
 
-    async def _handle_raw_dispatch(self, opcode: int, data: dict[str, Any]) -> None:
-        self._state.gateway.raw_dispatcher.dispatch(opcode, self, data)
-
-    async def _handle_dispatch(self, event_name: str, data: Any) -> None:
-        self._state.gateway.event_dispatcher.dispatch(event_name, self, data)
+    async def _handle_resumed(self, _: Any) -> None:
+        self._logger.info("Resumed session")
+        self.ready.set()
 
     # Wrappers
     async def identify(self) -> None:
@@ -267,7 +526,7 @@ class Shard(ShardProtocol):
                         "$browser": "nextcord",
                         "$device": "nextcord",
                     },
-                    "shard": (self.shard_id, self._state.gateway.shard_count),
+                    "shard": (self.shard_id, self.shard_count),
                 },
             }
         )
@@ -0,0 +1,228 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+from __future__ import annotations
+
+from asyncio import Event, TimeoutError, gather, get_event_loop, wait_for
+from logging import getLogger
+from time import monotonic
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from asyncio import TimerHandle
+    from typing import Any, Optional
+
+    from ...dispatcher import Dispatcher
+    from .protocols.shard import ShardProtocol
+
+logger = getLogger(__name__)
+
+
+class ShardStartup:
+    """Starts shards bucket by bucket and tracks how far along they are.
+
+    Every ``max_concurrency`` bucket starts its shards in order, opening the next connection once the previous shard
+    identified. The identify ratelimiter spaces them out, so there are never more connections waiting to identify
+    than there are buckets.
+
+    Shards with a saved session resume straight away as resuming is not ratelimited.
+
+    A shard is done once it received READY and a GUILD_CREATE for every guild listed in it, or no new guild arrived
+    for ``guild_timeout`` seconds as some guilds can stay unavailable.
+    A shard which did not identify or resume within ``identify_timeout`` is counted as :attr:`failed` so
+    :meth:`wait` still returns.
+
+    Parameters
+    ----------
+    identify_timeout: :class:`float`
+        How long to wait for a shard to identify or resume before marking it failed and moving on to the next one in
+        the bucket
+    guild_timeout: :class:`float`
+        How long to wait for the next guild of a shard before considering it done
+    """
+
+    def __init__(self, *, identify_timeout: float = 60, guild_timeout: float = 10) -> None:
+        self.identify_timeout: float = identify_timeout
+        self.guild_timeout: float = guild_timeout
+
+        self.shards: int = 0
+        """How many shards are starting"""
+        self.identified: int = 0
+        """How many shards have identified"""
+        self.resumed: int = 0
+        """How many shards resumed a saved session instead of identifying"""
+        self.ready: int = 0
+        """How many shards have received READY"""
+        self.failed: set[int] = set()
+        """The ids of the shards which did not identify or resume in time"""
+        self.guilds_expected: int = 0
+        """How many guilds the shards that received READY are going to stream"""
+        self.guilds_received: int = 0
+        """How many of those guilds have been received"""
+        self.started_at: Optional[float] = None
+        """When starting began, from :func:`time.monotonic`"""
+        self.finished_at: Optional[float] = None
+        """When every shard was done, from :func:`time.monotonic`"""
+
+        self._done: Event = Event()
+        self._ready_shards: set[int] = set()
+        self._pending_guilds: dict[int, set[str]] = {}
+        self._guild_timeouts: dict[int, TimerHandle] = {}
+        self._resume_timeouts: list[TimerHandle] = []
+        self._dispatcher: Optional[Dispatcher] = None
+
+    @property
+    def done(self) -> bool:
+        """If every shard received READY and its guilds or failed"""
+        return self._done.is_set()
+
+    async def wait(self) -> None:
+        """Wait until every shard received READY and its guilds or failed. Check :attr:`failed` afterwards"""
+        await self._done.wait()
+
+    async def run(self, shards: list[ShardProtocol], max_concurrency: int, dispatcher: Dispatcher) -> None:
+        """Start shards and track them until they are ready
+
+        Parameters
+        ----------
+        shards: :class:`list[ShardProtocol]`
+            The shards to start
+        max_concurrency: :class:`int`
+            How many shards may identify at once
+        dispatcher: :class:`Dispatcher`
+            Where shards dispatch READY, RESUMED and GUILD_CREATE, like :attr:`GatewayProtocol.event_dispatcher`
+        """
+        self.shards = len(shards)
+        self.started_at = monotonic()
+        if not shards:
+            self._finish()
+            return
+        self._dispatcher = dispatcher
+        dispatcher.add_listener(self._handle_ready, "READY")
+        dispatcher.add_listener(self._handle_resumed, "RESUMED")
+        dispatcher.add_listener(self._handle_guild_create, "GUILD_CREATE")
+
+        loop = get_event_loop()
+        buckets: dict[int, list[ShardProtocol]] = {}
+        for shard in sorted(shards, key=lambda shard: shard.shard_id):
+            if shard.session is not None:
+                loop.create_task(shard.connect())
+                self._resume_timeouts.append(loop.call_later(self.identify_timeout, self._resume_timed_out, shard))
+                continue
+            buckets.setdefault(shard.shard_id % max_concurrency, []).append(shard)
+        await gather(*(self._start_bucket(bucket) for bucket in buckets.values()))
+
+    async def _start_bucket(self, shards: list[ShardProtocol]) -> None:
+        loop = get_event_loop()
+        for shard in shards:
+            loop.create_task(shard.connect())
+            try:
+                await wait_for(shard.ready.wait(), self.identify_timeout)
+            except TimeoutError:
+                logger.warning("Shard %s did not identify in time, starting the next one", shard.shard_id)
+                self._fail(shard.shard_id)
+                continue
+            self.identified += 1
+
+    def _resume_timed_out(self, shard: ShardProtocol) -> None:
+        if shard.shard_id not in self._ready_shards:
+            logger.warning("Shard %s did not resume in time", shard.shard_id)
+            self._fail(shard.shard_id)
+
+    def _fail(self, shard_id: int) -> None:
+        if shard_id in self._ready_shards or self.done:
+            return
+        self.failed.add(shard_id)
+        self._check_done()
+
+    async def _handle_ready(self, shard: ShardProtocol, data: dict[str, Any]) -> None:
+        if shard.shard_id in self._ready_shards:
+            return
+        self._ready_shards.add(shard.shard_id)
+        # Slower than identify_timeout but it made it after all
+        self.failed.discard(shard.shard_id)
+        guilds = {guild["id"] for guild in data.get("guilds", ())}
+        self.ready += 1
+        self.guilds_expected += len(guilds)
+        logger.info("Shard %s is ready, %s", shard.shard_id, self)
+        self._pending_guilds[shard.shard_id] = guilds
+        self._check_streamed(shard.shard_id)
+
+    async def _handle_resumed(self, shard: ShardProtocol, _: Any) -> None:
+        if shard.shard_id in self._ready_shards:
+            return
+        self._ready_shards.add(shard.shard_id)
+        self.failed.discard(shard.shard_id)
+        # Guilds are not streamed again, the shard still has them from before
+        self.resumed += 1
+        self.ready += 1
+        logger.info("Shard %s resumed, %s", shard.shard_id, self)
+        self._pending_guilds[shard.shard_id] = set()
+        self._check_streamed(shard.shard_id)
+
+    async def _handle_guild_create(self, shard: ShardProtocol, data: dict[str, Any]) -> None:
+        pending = self._pending_guilds.get(shard.shard_id)
+        if pending is None or data["id"] not in pending:
+            return
+        pending.remove(data["id"])
+        self.guilds_received += 1
+        self._check_streamed(shard.shard_id)
+
+    def _check_streamed(self, shard_id: int) -> None:
+        timeout = self._guild_timeouts.pop(shard_id, None)
+        if timeout is not None:
+            timeout.cancel()
+        if self._pending_guilds[shard_id]:
+            self._guild_timeouts[shard_id] = get_event_loop().call_later(
+                self.guild_timeout, self._guilds_timed_out, shard_id
+            )
+            return
+        del self._pending_guilds[shard_id]
+        self._check_done()
+
+    def _check_done(self) -> None:
+        if self.ready + len(self.failed) == self.shards and not self._pending_guilds:
+            self._finish()
+
+    def _guilds_timed_out(self, shard_id: int) -> None:
+        pending = self._pending_guilds.get(shard_id, ())
+        logger.info("Shard %s is done with %s guilds still unavailable", shard_id, len(pending))
+        self._pending_guilds[shard_id] = set()
+        self._check_streamed(shard_id)
+
+    def _finish(self) -> None:
+        self.finished_at = monotonic()
+        for timeout in self._resume_timeouts:
+            timeout.cancel()
+        if self._dispatcher is not None:
+            self._dispatcher.remove_listener(self._handle_ready, "READY")
+            self._dispatcher.remove_listener(self._handle_resumed, "RESUMED")
+            self._dispatcher.remove_listener(self._handle_guild_create, "GUILD_CREATE")
+        if self.failed:
+            logger.warning("Shards %s failed to start, %s", sorted(self.failed), self)
+        else:
+            logger.info("All shards are ready in %.1fs, %s", self.finished_at - (self.started_at or 0), self)
+        self._done.set()
+
+    def __str__(self) -> str:
+        return (
+            f"{self.identified}/{self.shards} shards identified, {self.resumed} resumed, {self.ready}/{self.shards} ready, "
+            f"{self.guilds_received}/{self.guilds_expected} guilds received, {len(self.failed)} failed"
+        )
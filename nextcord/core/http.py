@@ -21,34 +21,74 @@
 
 from __future__ import annotations
 
-from asyncio import Future, get_event_loop
-from collections import defaultdict
+from asyncio import (
+    CancelledError,
+    Event,
+    Future,
+    get_event_loop,
+    shield,
+    sleep,
+    wait_for,
+)
+from collections import OrderedDict, defaultdict, deque
 from logging import getLogger
-from time import time
-from typing import TYPE_CHECKING, Type
+from string import Formatter
+from time import monotonic, perf_counter, time
+from typing import TYPE_CHECKING, Type, overload
+from urllib.parse import urlencode
 
-from aiohttp import ClientSession
+from aiohttp import ClientConnectionError, ClientSession, FormData, TCPConnector
+from aiohttp.resolver import AsyncResolver
 
 from .. import __version__
 from ..exceptions import CloudflareBanException, DiscordException, HTTPException
 from ..utils import json
-from .protocols.http import BucketProtocol, HTTPClientProtocol, RouteProtocol
+from .protocols.http import (
+    BucketProtocol,
+    HTTPClientProtocol,
+    HTTPMetricsProtocol,
+    ResponseCacheProtocol,
+    RouteProtocol,
+)
+from .ratelimiter import InvalidRequestTracker, TokenBucket
+from .retry import RetryPolicy
 
 if TYPE_CHECKING:
-    from typing import Any, Literal, Optional
+    from asyncio import Task, TimerHandle
+    from typing import Any, Literal, Optional, Union
 
     from aiohttp import ClientWebSocketResponse
     from aiohttp.client_reqrep import ClientResponse
+    from multidict import CIMultiDictProxy
 
     from ..client.state import State
+    from ..file import File
 
 
+try:
+    import aiodns  # type: ignore[import]  # noqa: F401
+
+    HAS_AIODNS = True
+except ModuleNotFoundError:
+    HAS_AIODNS = False
+
 logger = getLogger(__name__)
 
 
+def _json_serialize(obj: Any) -> str:
+    data = json.dumps(obj)
+    if isinstance(data, bytes):
+        # orjson dumps to bytes, aiohttp and form fields want str
+        return data.decode("utf-8")
+    return data
+
+
 class Route(RouteProtocol):
     """Metadata about a Discord API route
 
+    .. note::
+        For routes used often, declare a :class:`RouteTemplate` once instead.
+
     Parameters
     ----------
     method: :class:`str`
@@ -61,6 +101,20 @@ class Route(RouteProtocol):
         Parameters to format path with. You can include guild_id, channel_id, webhook_id or webhook_token to specify ratelimit parameters.
     """
 
+    __slots__ = (
+        "method",
+        "unformatted_path",
+        "path",
+        "use_webhook_global",
+        "guild_id",
+        "channel_id",
+        "webhook_id",
+        "webhook_token",
+        "_ratelimit_key",
+        "_major_parameters",
+        "_bucket",
+    )
+
     def __init__(
         self,
         method: Literal[
@@ -83,7 +137,7 @@ class Route(RouteProtocol):
         """The HTTP method for this route"""
         self.unformatted_path = path
         """The unformatted path"""
-        self.path = path.format(**parameters)
+        self.path = path.format_map(parameters)
         """The route to be requested from discord"""
 
         self.use_webhook_global = use_webhook_global
@@ -94,32 +148,219 @@ class Route(RouteProtocol):
         self.webhook_id: Optional[int] = parameters.get("webhook_id")
         self.webhook_token: Optional[str] = parameters.get("webhook_token")
 
+        # Computed on first use
+        self._ratelimit_key: Optional[str] = None
+        self._major_parameters: Optional[str] = None
+        self._bucket: Optional[str] = None
+
+    @property
+    def ratelimit_key(self) -> str:  # type: ignore
+        """The key discord's bucket hash for this route is stored under"""
+        if self._ratelimit_key is None:
+            self._ratelimit_key = f"{self.method}:{self.unformatted_path}"
+        return self._ratelimit_key
+
+    @property
+    def major_parameters(self) -> str:  # type: ignore
+        """The major parameters of this route. Routes with the same bucket hash only share a bucket if these match"""
+        if self._major_parameters is None:
+            self._major_parameters = f"{self.guild_id}:{self.channel_id}:{self.webhook_id}:{self.webhook_token}"
+        return self._major_parameters
+
     @property
     def bucket(self) -> str:  # type: ignore
-        """The ratelimit bucket this is under"""
-        return f"{self.method}:{self.unformatted_path}:{self.guild_id}:{self.channel_id}:{self.webhook_id}:{self.webhook_token}"
+        """The temporary ratelimit bucket this is under until discord tells us the bucket hash"""
+        if self._bucket is None:
+            self._bucket = f"{self.ratelimit_key}:{self.major_parameters}"
+        return self._bucket
+
+
+class RouteTemplate:
+    """A route declared once, for example at module level, and filled in with parameters for every request.
+
+    This does the work shared by every request to the route up front, so creating a :class:`Route` from it is cheap.
+
+    .. code-block:: python3
+
+        CREATE_MESSAGE = RouteTemplate("POST", "/channels/{channel_id}/messages")
+
+        await http.request(CREATE_MESSAGE(channel_id=channel_id), json={"content": "Hello"})
+
+    Parameters
+    ----------
+    method: :class:`str`
+        The HTTP method for this route
+    path: :class:`str`
+        The unformatted API path
+    use_webhook_global: :class:`bool`
+        If this route uses the webhook global LINK MISSING
+    """
+
+    __slots__ = ("method", "path", "use_webhook_global", "ratelimit_key", "_static")
+
+    def __init__(
+        self,
+        method: Literal[
+            "GET",
+            "HEAD",
+            "POST",
+            "PUT",
+            "DELETE",
+            "CONNECT",
+            "OPTIONS",
+            "TRACE",
+            "PATCH",
+        ],
+        path: str,
+        *,
+        use_webhook_global: bool = False,
+    ) -> None:
+        self.method = method
+        self.path = path
+        self.use_webhook_global = use_webhook_global
+        self.ratelimit_key: str = f"{method}:{path}"
+        """The key discord's bucket hash for this route is stored under"""
+        # Paths without parameters don't have to be formatted
+        self._static: bool = not any(field for _, field, _, _ in Formatter().parse(path))
+
+    def __call__(self, **parameters: Any) -> Route:
+        """Create a route with the parameters filled in
+
+        Parameters
+        ----------
+        parameters:
+            Parameters to format path with. You can include guild_id, channel_id, webhook_id or webhook_token to specify ratelimit parameters.
+        """
+        route = _new_route(Route)
+        route.method = self.method
+        route.unformatted_path = path = self.path
+        route.path = path if self._static else path.format_map(parameters)
+        route.use_webhook_global = self.use_webhook_global
+        get = parameters.get
+        route.guild_id = get("guild_id")
+        route.channel_id = get("channel_id")
+        route.webhook_id = get("webhook_id")
+        route.webhook_token = get("webhook_token")
+        route._ratelimit_key = self.ratelimit_key
+        route._major_parameters = None
+        route._bucket = None
+        return route
+
+    def __repr__(self) -> str:
+        return f"<RouteTemplate method={self.method} path={self.path}>"
+
+
+_new_route = Route.__new__
+
+GET_GATEWAY_BOT = RouteTemplate("GET", "/gateway/bot")
+
+
+class RatelimitInfo:
+    """The ratelimit headers discord sent with a response
+
+    Parameters
+    ----------
+    headers: :class:`CIMultiDictProxy[str]`
+        The response headers
+    """
+
+    __slots__ = ("limit", "remaining", "reset_at", "reset_after", "bucket", "scope")
+
+    def __init__(self, headers: CIMultiDictProxy[str]) -> None:
+        limit = headers.get("X-RateLimit-Limit")
+        remaining = headers.get("X-RateLimit-Remaining")
+        reset_at = headers.get("X-RateLimit-Reset")
+        reset_after = headers.get("X-RateLimit-Reset-After")
+
+        self.limit: Optional[int] = None if limit is None else int(limit)
+        """How many requests fit in the bucket"""
+        self.remaining: Optional[int] = None if remaining is None else int(remaining)
+        """How many requests are remaining"""
+        self.reset_at: Optional[float] = None if reset_at is None else float(reset_at)
+        """When the bucket fills up again. (UTC time)"""
+        self.reset_after: Optional[float] = None if reset_after is None else float(reset_after)
+        """How many seconds until the bucket fills up again"""
+        self.bucket: Optional[str] = headers.get("X-RateLimit-Bucket")
+        """The bucket hash of the route"""
+        self.scope: Optional[str] = headers.get("X-RateLimit-Scope")
+        """The scope of the ratelimit if this is a 429"""
+
+
+class HTTPResponse:
+    """A response from discord with the body already decoded.
+    The connection has been released, so this is all that is left of the response.
+
+    Parameters
+    ----------
+    status: :class:`int`
+        The HTTP status code
+    data: :class:`Any`
+        The decoded JSON body. None if the body was empty.
+    ratelimit: :class:`RatelimitInfo`
+        The ratelimit headers
+    """
+
+    __slots__ = ("status", "data", "ratelimit")
+
+    def __init__(self, status: int, data: Any, ratelimit: RatelimitInfo) -> None:
+        self.status: int = status
+        self.data: Any = data
+        self.ratelimit: RatelimitInfo = ratelimit
+
+    @classmethod
+    async def from_response(cls, response: ClientResponse) -> HTTPResponse:
+        """Read and decode a response in one pass and release the connection.
+
+        Parameters
+        ----------
+        response: :class:`ClientResponse`
+            The response to decode
+        """
+        try:
+            body = await response.read()
+        finally:
+            response.release()
+        # orjson parses bytes directly, so we skip decoding to str first
+        data = json.loads(body) if body else None
+        return cls(response.status, data, RatelimitInfo(response.headers))
 
 
 class Bucket(BucketProtocol):
     """A simple and fast ratelimiting implementation for HTTP
 
     .. warning::
-        This is not multiprocess safe.
+        This is not multiprocess safe. Use :class:`nextcord.core.shared_bucket.SharedBucket` if you need that.
     .. note::
         This is a async context manager.
     """
 
-    def __init__(self, route: Route):
+    def __init__(self, route: Route, key: str):
+        self.key: str = key
+        """The key this bucket is stored under in the HTTPClient"""
         self._remaining: Optional[int] = None
         self.limit: Optional[int] = None
         """How many requests fit in a bucket"""
         self.reset_at: Optional[float] = None
         """When the Bucket fills up again. (UTC time)"""
         self._route: Route = route
-        self._pending: list[Future[None]] = []
+        self._pending: dict[int, deque[Future[None]]] = {}
+        self._pending_count: int = 0
         self._reserved: int = 0
+        self._reset_timer: Optional[TimerHandle] = None
+        self._reset_timer_at: Optional[float] = None
+        self._unlimited: bool = False
         self._loop = get_event_loop()
 
+    @property
+    def unlimited(self) -> bool:
+        """If the route turned out to have no ratelimit"""
+        return self._unlimited
+
+    @unlimited.setter
+    def unlimited(self, new_value: bool) -> None:
+        self._unlimited = new_value
+        self._release()
+
     @property  # type: ignore
     def remaining(self) -> Optional[int]:  # type: ignore
         """How many requests are remaining."""
@@ -128,53 +369,129 @@ class Bucket(BucketProtocol):
     @remaining.setter
     def remaining(self, new_value: int) -> None:
         self._remaining = new_value
-        if new_value == 0:
-            self._pending_reset = True
-            sleep_time = self.reset_at - time()
-            self._loop.call_later(sleep_time, self._reset)
+        if new_value <= 0:
+            # HTTPClient sets reset_at first, without it there is nothing to wait for
+            reset_at = time() if self.reset_at is None else self.reset_at
+            if self._reset_timer is None or reset_at != self._reset_timer_at:
+                # release() counts down before the response headers are applied, so the timer can be from the last
+                # window. The headers then give the real reset time.
+                self._cancel_reset()
+                self._reset_timer_at = reset_at
+                self._reset_timer = self._loop.call_later(reset_at - time(), self._reset)
+        else:
+            self._cancel_reset()
+            self._release()
+
+    def migrate(self) -> None:
+        """Release all pending requests so they can queue up on the shared bucket this got merged into"""
+        while (future := self._pop_pending()) is not None:
+            self._reserved += 1  # Reserved on behalf of the waiter, given back when it exits
+            future.set_result(None)
+
+    def lock_global(self, retry_after: float) -> None:
+        """The global ratelimit is only kept by the HTTPClient, nothing to do here"""
 
     def _reset(self) -> None:
         """Reset the bucket usage to the top and then start attempting to release the pending requests"""
+        self._reset_timer = None
         self._remaining = self.limit
+        self._release()
 
-        for _ in range(self._calculated_remaining):
-            try:
-                future = self._pending.pop(0)
-            except IndexError:
-                break  # No more pendings, ignore
+    def _cancel_reset(self) -> None:
+        if self._reset_timer is not None:
+            self._reset_timer.cancel()
+            self._reset_timer = None
+
+    def _release(self) -> None:
+        """Hand out free spots to the pending requests with the highest priority first"""
+        while self._calculated_remaining > 0 and (future := self._pop_pending()) is not None:
+            self._reserved += 1  # Reserved on behalf of the waiter so nothing can take the spot before it wakes up
             future.set_result(None)
 
+    def _pop_pending(self) -> Optional[Future[None]]:
+        """Get the oldest pending request with the highest priority that is still waiting"""
+        for priority in sorted(self._pending, reverse=True):
+            queue = self._pending[priority]
+            while queue:
+                future = queue.popleft()
+                self._pending_count -= 1
+                if not future.done():
+                    return future
+            del self._pending[priority]
+        return None
+
+    @property
+    def pending(self) -> int:
+        """How many requests are waiting for a spot in this bucket"""
+        return self._pending_count
+
+    @property
+    def idle(self) -> bool:
+        """If nothing is using or waiting on this bucket and its ratelimit has reset"""
+        if self._reserved or any(self._pending.values()):
+            return False
+        return self.reset_at is None or self.reset_at <= time()
+
     @property
     def _calculated_remaining(self) -> int:
         # TODO: Replace this with the getter of remaining
         if self.remaining is None:
-            return 1  # We have no data, let's just assume we have one request so we can fetch the info.
+            if self._unlimited:
+                return 1  # No ratelimit, there is always room for one more
+            return 1 - self._reserved  # No data yet, only let one request through to fetch the info.
         return self.remaining - self._reserved
 
-    async def __aenter__(self) -> "Bucket":
+    async def acquire(self, priority: int = 0) -> None:
         """Reserve a spot in the bucket for the request.
-        If all are taken, it will add it to a queue.
+        If all are taken, it will add it to a queue. Requests with a higher priority get released first.
         """
-        # TODO: This should return same type as itself. Not sure what's wrong when I try
-        if self.remaining is None:
-            self._reserved += 1
-            return self  # We have no ratelimiting info, let's just try
         if self._calculated_remaining <= 0:
             # Ratelimit pending, let's wait
             future: Future[None] = Future()
-            self._pending.append(future)
-            logger.debug("Waiting for %s to clear up. %s pending", str(self), len(self._pending))
-            await future
+            self._pending.setdefault(priority, deque()).append(future)
+            self._pending_count += 1
+            logger.debug("Waiting for %s to clear up. %s pending", self.key, self._pending_count)
+            try:
+                await future
+            except CancelledError:
+                if not future.cancelled():
+                    # We got a spot but got cancelled before we could use it, let someone else have it
+                    self._reserved -= 1
+                    self._release()
+                elif (queue := self._pending.get(priority)) is not None and future in queue:
+                    # Timed out or cancelled while waiting, stop counting it as pending
+                    queue.remove(future)
+                    self._pending_count -= 1
+                    if not queue:
+                        del self._pending[priority]
+                raise
+            return  # The spot got reserved for us when we got released
         self._reserved += 1
-        return self
 
-    async def __aexit__(self, *_: Any) -> None:
+    async def release(self) -> None:
         """
         Request finished
         """
         self._reserved -= 1
         if self.remaining is not None:
             self.remaining -= 1
+        else:
+            # The response had no ratelimit info, let the next request through to try again
+            self._release()
+
+    async def __aenter__(self) -> "Bucket":
+        """Reserve a spot in the bucket for the request with the default priority.
+        If all are taken, it will add it to a queue.
+        """
+        # TODO: This should return same type as itself. Not sure what's wrong when I try
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *_: Any) -> None:
+        """
+        Request finished
+        """
+        await self.release()
 
 
 class HTTPClient(HTTPClientProtocol):
@@ -184,8 +501,44 @@ class HTTPClient(HTTPClientProtocol):
     ----------
     state: :class:`State`
         The current state of the bot
+    api_base: :class:`Optional[str]`
+        The URL requests are sent to. Defaults to the discord API
+    proxied: :class:`bool`
+        Set this if ``api_base`` is a ratelimiting proxy like :mod:`nextcord.core.http_proxy`.
+        Local buckets and the global ratelimit are skipped, 429s and server errors from the proxy are still retried.
     max_retries: :class:`int`
-        How many times we will attempt to retry after a unexpected failure (server error or ratelimit issue)
+        How many times we will attempt to retry after a unexpected failure (server error or ratelimit issue).
+        Ignored if a retry policy is passed
+    retry_policy: :class:`Optional[RetryPolicy]`
+        When and how long to wait before retrying server errors and connection errors
+    invalid_requests: :class:`Optional[InvalidRequestTracker]`
+        Tracks 401, 403 and 429 responses to slow down and refuse requests before Cloudflare bans the IP.
+        Pass the same tracker to every client sharing a IP.
+    metrics: :class:`Optional[HTTPMetricsProtocol]`
+        Where to record latencies, ratelimit waits, 429s and retries, for example :class:`nextcord.core.http_metrics.HTTPMetrics`
+    global_ratelimit: :class:`int`
+        How many requests per second we are allowed to send. This is 50 unless discord has raised it for your bot
+    webhook_global_ratelimit: :class:`int`
+        How many requests per second we are allowed to send to routes using the webhook global
+    max_buckets: :class:`int`
+        How many ratelimit buckets to keep before removing the least recently used idle ones
+    bucket_ttl: :class:`float`
+        How many seconds an idle bucket is kept after it was last used
+    coalesce_requests: :class:`bool`
+        If identical GET requests running at the same time should share one request to discord.
+        The response body will already be read so every caller can use it.
+    cache: :class:`Optional[ResponseCacheProtocol]`
+        A cache for GET responses, for example :class:`nextcord.core.http_cache.ResponseCache`.
+        Cached responses will have their body read already.
+    session: :class:`Optional[ClientSession]`
+        A session to send requests with. Use :meth:`HTTPClient.create_session` to share one connection pool between multiple clients.
+        A session passed here is not closed by :meth:`HTTPClient.close`.
+    connection_limit: :class:`int`
+        How many connections the connection pool can have open at once. Ignored if a session is passed
+    keepalive_timeout: :class:`float`
+        How many seconds to keep idle connections open for reuse. Ignored if a session is passed
+    dns_cache_ttl: :class:`int`
+        How many seconds to cache DNS lookups for. Ignored if a session is passed
 
     """
 
@@ -193,31 +546,142 @@ class HTTPClient(HTTPClientProtocol):
         self,
         state: State,
         *,
+        api_base: Optional[str] = None,
+        proxied: bool = False,
         max_retries: int = 5,
+        retry_policy: Optional[RetryPolicy] = None,
+        invalid_requests: Optional[InvalidRequestTracker] = None,
+        metrics: Optional[HTTPMetricsProtocol] = None,
+        global_ratelimit: int = 50,
+        webhook_global_ratelimit: int = 50,
+        max_buckets: int = 10_000,
+        bucket_ttl: float = 300,
+        coalesce_requests: bool = False,
+        cache: Optional[ResponseCacheProtocol] = None,
+        session: Optional[ClientSession] = None,
+        connection_limit: int = 200,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
     ):
         self.version = 9
-        self.api_base = f"https://discord.com/api/v{self.version}"
+        self.api_base = api_base or f"https://discord.com/api/v{self.version}"
+        self.proxied: bool = proxied
+        """If ratelimiting is handled by the proxy at :attr:`api_base`"""
 
         self.state = state
 
-        self.max_retries = max_retries
-        self._global_lock = self.state.type_sheet.http_bucket(Route("POST", "/global"))
-        self._webhook_global_lock = self.state.type_sheet.http_bucket(Route("POST", "/global/webhook"))
-        self._session = ClientSession(json_serialize=json.dumps)
-        self._buckets: dict[str, BucketProtocol] = {}
+        self.retry_policy: RetryPolicy = retry_policy or RetryPolicy(max_retries=max_retries)
+        self.invalid_requests: InvalidRequestTracker = invalid_requests or InvalidRequestTracker()
+        """The invalid request budget. Use :attr:`InvalidRequestTracker.remaining` to see how much is left"""
+        self.metrics: Optional[HTTPMetricsProtocol] = metrics
+        self._global_ratelimiter = TokenBucket(global_ratelimit, 1)
+        self._webhook_global_ratelimiter = TokenBucket(webhook_global_ratelimit, 1)
+        # Cleared while discord has globally ratelimited us
+        self._global_unlocked = Event()
+        self._global_unlocked.set()
+        self._webhook_global_unlocked = Event()
+        self._webhook_global_unlocked.set()
+        # Created on first use as aiohttp needs a running event loop
+        self._session: Optional[ClientSession] = session
+        self._owns_session: bool = session is None
+        self._connector_options: dict[str, Any] = {
+            "connection_limit": connection_limit,
+            "keepalive_timeout": keepalive_timeout,
+            "dns_cache_ttl": dns_cache_ttl,
+        }
+        self.max_buckets: int = max_buckets
+        self.bucket_ttl: float = bucket_ttl
+        self.bucket_evictions: int = 0
+        """How many idle buckets have been removed"""
+        # Least recently used first
+        self._buckets: OrderedDict[str, BucketProtocol] = OrderedDict()
+        self._bucket_last_used: dict[str, float] = {}
+        self._bucket_hashes: dict[str, str] = {}
         self._http_errors: defaultdict[int, Type[HTTPException]] = defaultdict((lambda: HTTPException), {})
+        self.coalesce_requests: bool = coalesce_requests
+        self._inflight_requests: dict[str, Task[ClientResponse]] = {}
+        self.cache: Optional[ResponseCacheProtocol] = cache
 
         self._headers = {"User-Agent": "DiscordBot (https://github.com/nextcord/nextcord, {})".format(__version__)}
         if self.state.token:
             self._headers["Authorization"] = f"Bot {self.state.token}"
 
+    @staticmethod
+    def create_session(
+        *,
+        connection_limit: int = 200,
+        keepalive_timeout: float = 30,
+        dns_cache_ttl: int = 300,
+    ) -> ClientSession:
+        """Create a session with a connection pool tuned for talking to discord.
+        This uses aiodns for DNS lookups if it is installed.
+
+        .. note::
+            This has to be called with a running event loop. You are responsible for closing it.
+
+        Parameters
+        ----------
+        connection_limit: :class:`int`
+            How many connections can be open at once
+        keepalive_timeout: :class:`float`
+            How many seconds to keep idle connections open for reuse
+        dns_cache_ttl: :class:`int`
+            How many seconds to cache DNS lookups for
+        """
+        connector = TCPConnector(
+            limit=connection_limit,
+            keepalive_timeout=keepalive_timeout,
+            ttl_dns_cache=dns_cache_ttl,
+            resolver=AsyncResolver() if HAS_AIODNS else None,
+        )
+        return ClientSession(connector=connector, json_serialize=_json_serialize)
+
+    @property
+    def session(self) -> ClientSession:
+        """The session requests are sent with"""
+        if self._session is None:
+            self._session = self.create_session(**self._connector_options)
+        return self._session
+
+    @overload
     async def request(
         self,
         route: RouteProtocol,
         *,
         headers: Optional[dict[str, str]] = None,
+        priority: int = 0,
+        files: Optional[list[File]] = None,
+        decode: Literal[False] = False,
+        timeout: Optional[float] = None,
         **kwargs: Any,
     ) -> ClientResponse:
+        ...
+
+    @overload
+    async def request(
+        self,
+        route: RouteProtocol,
+        *,
+        headers: Optional[dict[str, str]] = None,
+        priority: int = 0,
+        files: Optional[list[File]] = None,
+        decode: Literal[True],
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> HTTPResponse:
+        ...
+
+    async def request(
+        self,
+        route: RouteProtocol,
+        *,
+        headers: Optional[dict[str, str]] = None,
+        priority: int = 0,
+        files: Optional[list[File]] = None,
+        decode: bool = False,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> Union[ClientResponse, HTTPResponse]:
         """Send a request to discord.
         This automatically handles ratelimits.
 
@@ -229,63 +693,348 @@ class HTTPClient(HTTPClientProtocol):
             Metadata about the route you are executing
         headers: :class:`Optional[dict[str, str]]`
             Request headers. This will add a bot token if availible
+        priority: :class:`int`
+            Requests with a higher priority skip ahead of lower priority requests waiting in the same bucket.
+            Use this for latency critical requests like interaction responses.
+        files: :class:`Optional[list[File]]`
+            Files to upload. They will be streamed as multipart form data with the ``json`` kwarg sent as ``payload_json``.
+        decode: :class:`bool`
+            Read and decode the body and release the connection straight away, returning a :class:`HTTPResponse`
+            instead of the aiohttp response.
+        timeout: :class:`Optional[float]`
+            How many seconds the request may take in total, including waiting for ratelimits, retries and decoding.
+            Raises :exc:`asyncio.TimeoutError` once it runs out, without using up a slot in the bucket.
         kwargs:
             Keyword only arguments passed to `ClientSession.request <https://docs.aiohttp.org/en/stable/client_reference.html#aiohttp.ClientSession.trace_config>`_
         """
-        global_lock = self._webhook_global_lock if route.use_webhook_global else self._global_lock
+        coro = self._get_decoded_response(
+            route, headers=headers, priority=priority, files=files, decode=decode, **kwargs
+        )
+        if timeout is None:
+            return await coro
+        # Cancelling a request waiting in a bucket hands its slot to the next one
+        return await wait_for(coro, timeout)
+
+    async def _get_decoded_response(
+        self, route: RouteProtocol, *, decode: bool, **kwargs: Any
+    ) -> Union[ClientResponse, HTTPResponse]:
+        r = await self._get_response(route, **kwargs)
+        if decode:
+            # Releases the response even if this gets cancelled part way through reading
+            return await HTTPResponse.from_response(r)
+        return r
+
+    async def _get_response(
+        self,
+        route: RouteProtocol,
+        *,
+        headers: Optional[dict[str, str]] = None,
+        priority: int = 0,
+        files: Optional[list[File]] = None,
+        **kwargs: Any,
+    ) -> ClientResponse:
+        if (
+            (self.coalesce_requests or self.cache is not None)
+            and route.method == "GET"
+            and files is None
+            and not headers
+            and kwargs.keys() <= {"params"}
+        ):
+            request_key = self._get_request_key(route, kwargs.get("params"))
+            if self.cache is not None:
+                entry = self.cache.get(route, request_key)
+                if entry is not None and entry.fresh:
+                    return entry.response
+            if not self.coalesce_requests:
+                return await self._fetch(route, request_key, priority=priority, **kwargs)
+
+            task = self._inflight_requests.get(request_key)
+            if task is None:
+                task = self.state.loop.create_task(self._fetch(route, request_key, priority=priority, **kwargs))
+                self._inflight_requests[request_key] = task
+                task.add_done_callback(lambda _: self._inflight_requests.pop(request_key, None))
+            else:
+                logger.debug("Joining in-flight request for %s", request_key)
+            # Shielded so one caller getting cancelled does not cancel the request for everyone else
+            return await shield(task)
+        return await self._request(route, headers=headers, priority=priority, files=files, **kwargs)
+
+    async def _fetch(self, route: RouteProtocol, request_key: str, **kwargs: Any) -> ClientResponse:
+        """Send a GET request, read the body and update the cache"""
+        entry = self.cache.get(route, request_key) if self.cache is not None else None
+        headers = None
+        if entry is not None and entry.etag is not None:
+            headers = {"If-None-Match": entry.etag}
+
+        r = await self._request(route, headers=headers, **kwargs)
+        if r.status == 304 and entry is not None:
+            # Not modified, keep using the cached response
+            r.release()
+            r = entry.response
+        else:
+            try:
+                await r.read()
+            except CancelledError:
+                r.release()
+                raise
+        if self.cache is not None:
+            self.cache.set(route, request_key, r)
+        return r
+
+    @staticmethod
+    def _create_form(files: list[File], payload: Any) -> FormData:
+        form = FormData(quote_fields=False)
+        if payload is not None:
+            form.add_field("payload_json", _json_serialize(payload), content_type="application/json")
+        for index, file in enumerate(files):
+            form.add_field(f"files[{index}]", file.stream(), filename=file.filename, content_type=file.content_type)
+        return form
+
+    @staticmethod
+    def _get_request_key(route: RouteProtocol, params: Any) -> str:
+        """The key identical GET requests are coalesced under"""
+        if not params:
+            return route.path
+        if isinstance(params, str):
+            return f"{route.path}?{params}"
+        if isinstance(params, dict):
+            params = sorted(params.items())
+        return f"{route.path}?{urlencode(params)}"
+
+    async def _request(
+        self,
+        route: RouteProtocol,
+        *,
+        headers: Optional[dict[str, str]] = None,
+        priority: int = 0,
+        files: Optional[list[File]] = None,
+        raise_errors: bool = True,
+        **kwargs: Any,
+    ) -> ClientResponse:
+        if route.use_webhook_global:
+            global_ratelimiter = self._webhook_global_ratelimiter
+            global_unlocked = self._webhook_global_unlocked
+        else:
+            global_ratelimiter = self._global_ratelimiter
+            global_unlocked = self._global_unlocked
 
         if headers is None:
             headers = {}
         headers |= self._headers
+        if files is not None:
+            payload = kwargs.pop("json", None)
 
-        for _ in range(self.max_retries):
-            async with global_lock:
-                bucket_str = route.bucket
-                bucket = self._buckets.get(bucket_str)
-
-                if bucket is None:
-                    bucket = self.state.type_sheet.http_bucket(route)
-                    self._buckets[bucket_str] = bucket
-
-                async with bucket:
-                    r = await self._session.request(
+        retry_policy = self.retry_policy
+        metrics = self.metrics
+        for attempt in range(retry_policy.max_retries):
+            if delay := self.invalid_requests.delay(priority):
+                logger.debug(
+                    "Delaying %s %s by %.2fs, %s invalid requests left",
+                    route.method,
+                    route.path,
+                    delay,
+                    self.invalid_requests.remaining,
+                )
+                await sleep(delay)
+            if files is not None:
+                # Files are streamed, so the form has to be created again for every attempt
+                kwargs["data"] = self._create_form(files, payload)
+            try:
+                if self.proxied:
+                    if metrics is not None:
+                        sent_at = perf_counter()
+                    r = await self.session.request(
                         route.method,
                         self.api_base + route.path,
                         headers=headers,
                         **kwargs,
                     )
-                logger.debug("%s %s", route.method, route.path)
+                else:
+                    while True:
+                        bucket = self._get_bucket(route)
+                        if metrics is not None:
+                            queue_depth = bucket.pending
+                            waiting_since = perf_counter()
+                        await bucket.acquire(priority)
+                        try:
+                            if bucket is not self._get_bucket(route):
+                                # The bucket got merged into a shared bucket while we waited, queue up there instead
+                                continue
+                            if metrics is not None:
+                                acquired_at = perf_counter()
+                                metrics.observe_bucket_wait(route, acquired_at - waiting_since, queue_depth)
+                            # Wait out global ratelimits only once we are at the front of the bucket
+                            await global_unlocked.wait()
+                            async with global_ratelimiter:
+                                if metrics is not None:
+                                    sent_at = perf_counter()
+                                    metrics.observe_global_wait(route, sent_at - acquired_at)
+                                r = await self.session.request(
+                                    route.method,
+                                    self.api_base + route.path,
+                                    headers=headers,
+                                    **kwargs,
+                                )
+                        finally:
+                            await bucket.release()
+                        break
+            except ClientConnectionError as error:
+                if not retry_policy.should_retry(route.method, attempt, error=error):
+                    raise
+                if metrics is not None:
+                    metrics.retried(route, "connection")
+                backoff = retry_policy.backoff(attempt)
+                logger.debug("%s %s failed with %r, retrying in %.2fs", route.method, route.path, error, backoff)
+                await sleep(backoff)
+                continue
+            logger.debug("%s %s", route.method, route.path)
+            if metrics is not None:
+                metrics.observe_request(route, r.status, perf_counter() - sent_at)
 
+            if not self.proxied:
+                if (bucket_hash := r.headers.get("X-RateLimit-Bucket")) is not None:
+                    self._learn_bucket_hash(route, bucket_hash)
+                    bucket = self._get_bucket(route)
                 try:
                     bucket.reset_at = float(r.headers["X-RateLimit-Reset"])
                     bucket.limit = int(r.headers["X-RateLimit-Limit"])
                     bucket.remaining = int(r.headers["X-RateLimit-Remaining"])
                 except KeyError:
                     # Ratelimiting info is not sent on some routes and on error
-                    pass
+                    if r.status < 300 and bucket.remaining is None:
+                        # Never going to learn the limits, stop sending one request at a time
+                        bucket.unlimited = True
 
-                if (status := r.status) >= 300:
-                    if status == 429:
-                        if "via" not in r.headers.keys():
-                            raise
+            if (status := r.status) in (401, 403) or (status == 429 and r.headers.get("X-RateLimit-Scope") != "shared"):
+                # Shared ratelimits do not count towards the invalid request limit
+                self.invalid_requests.record()
+            if status >= 300 and status != 304:
+                if status == 429:
+                    if "via" not in r.headers.keys():
+                        # Ratelimited by cloudflare instead of discord
+                        raise CloudflareBanException()
+                    is_global = r.headers.get("X-RateLimit-Global") == "true"
+                    if metrics is not None:
+                        scope = "global" if is_global else r.headers.get("X-RateLimit-Scope", "user")
+                        metrics.ratelimited(route, scope)
+                    if not raise_errors and attempt + 1 >= retry_policy.max_retries:
+                        return r
+                    if metrics is not None:
+                        metrics.retried(route, "ratelimit")
+                    r.release()
+                    if self.proxied:
+                        # Passed through by the proxy, it keeps track of the buckets so only wait it out
+                        await sleep(float(r.headers.get("Retry-After", 0)))
+                    elif is_global:
+                        retry_after = float(r.headers["Retry-After"])
+                        self._lock_global(global_unlocked, global_ratelimiter, retry_after)
+                        bucket.lock_global(retry_after)
+                    else:
                         logger.debug("Ratelimit exceeded")
-                        continue
-                    error = await r.json()
-                    raise self._http_errors[status](r.status, error["code"], error["message"])
+                    continue
+                if retry_policy.should_retry(route.method, attempt, status=status):
+                    r.release()
+                    if metrics is not None:
+                        metrics.retried(route, "status")
+                    backoff = retry_policy.backoff(attempt)
+                    if self.proxied and status == 503:
+                        # The proxy is holding requests back to avoid a Cloudflare ban
+                        backoff = max(backoff, float(r.headers.get("Retry-After", 0)))
+                    logger.debug("%s %s returned %s, retrying in %.2fs", route.method, route.path, status, backoff)
+                    await sleep(backoff)
+                    continue
+                if not raise_errors:
+                    return r
+                try:
+                    body = await r.read()
+                finally:
+                    r.release()
+                try:
+                    data = json.loads(body)
+                    code, message = data["code"], data["message"]
+                except (ValueError, TypeError, KeyError):
+                    # Errors from cloudflare or a proxy are not json
+                    code, message = 0, body.decode("utf-8", "replace")
+                raise self._http_errors[status](r.status, code, message)
 
-                return r
+            return r
 
         raise DiscordException(
-            f"Ratelimiting failed {self.max_retries} times. This should only happen if you are running multiple bots with the same IP."
+            f"Ratelimiting failed {retry_policy.max_retries} times. This should only happen if you are running multiple bots with the same IP."
         )
 
+    def _lock_global(self, global_unlocked: Event, global_ratelimiter: TokenBucket, retry_after: float) -> None:
+        """Pause every request using a global ratelimit until discord lets us send again"""
+        if not global_unlocked.is_set():
+            # Already locked by another request
+            return
+        # Start again at the refill rate once unlocked, a full burst right away would go over again
+        global_ratelimiter.drain(retry_after)
+        logger.warning("Hit the global ratelimit, pausing requests for %s seconds", retry_after)
+        global_unlocked.clear()
+        self.state.loop.call_later(retry_after, global_unlocked.set)
+
+    def _get_bucket(self, route: RouteProtocol) -> BucketProtocol:
+        """Get the bucket a route should be ratelimited by.
+        This is the shared bucket for the route's bucket hash if we know it, otherwise a temporary one.
+        """
+        bucket_hash = self._bucket_hashes.get(route.ratelimit_key)
+        if bucket_hash is None:
+            bucket_key = route.bucket
+        else:
+            bucket_key = f"{bucket_hash}:{route.major_parameters}"
+
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            self._evict_buckets()
+            bucket = self.state.type_sheet.http_bucket(route, bucket_key)
+            self._buckets[bucket_key] = bucket
+        else:
+            self._buckets.move_to_end(bucket_key)
+        self._bucket_last_used[bucket_key] = monotonic()
+        return bucket
+
+    @property
+    def bucket_count(self) -> int:
+        """How many ratelimit buckets are currently stored"""
+        return len(self._buckets)
+
+    def _evict_buckets(self) -> None:
+        """Remove idle buckets that have not been used for :attr:`bucket_ttl` or that don't fit in :attr:`max_buckets`"""
+        now = monotonic()
+        for _ in range(len(self._buckets)):
+            bucket_key, bucket = next(iter(self._buckets.items()))
+            if len(self._buckets) < self.max_buckets and now - self._bucket_last_used[bucket_key] < self.bucket_ttl:
+                break  # Every bucket after this one has been used more recently
+            if bucket.idle:
+                del self._buckets[bucket_key]
+                del self._bucket_last_used[bucket_key]
+                self.bucket_evictions += 1
+            else:
+                # Still in use, check it again later
+                self._buckets.move_to_end(bucket_key)
+
+    def _learn_bucket_hash(self, route: RouteProtocol, bucket_hash: str) -> None:
+        """Store the bucket hash discord gave us for a route and retire the temporary bucket if it has one.
+
+        Requests pending on the temporary bucket get moved over to the shared bucket for the hash.
+        """
+        self._bucket_hashes[route.ratelimit_key] = bucket_hash
+
+        temporary_bucket = self._buckets.pop(route.bucket, None)
+        self._bucket_last_used.pop(route.bucket, None)
+        if temporary_bucket is not None:
+            logger.debug("Merging %s into bucket %s", route.bucket, bucket_hash)
+            temporary_bucket.migrate()
+
     async def ws_connect(self, url: str) -> ClientWebSocketResponse:
-        return await self._session.ws_connect(url, max_msg_size=0, autoclose=False, headers=self._headers)
+        return await self.session.ws_connect(url, max_msg_size=0, autoclose=False, headers=self._headers)
 
     async def close(self) -> None:
-        await self._session.close()
+        if self._owns_session and self._session is not None:
+            await self._session.close()
 
     # Wrappers around the http methods
-    async def get_gateway_bot(self) -> ClientResponse:
-        route = Route("GET", "/gateway/bot")
-        return await self.request(route)
+    async def get_gateway_bot(self) -> HTTPResponse:
+        route = GET_GATEWAY_BOT()
+        return await self.request(route, decode=True)
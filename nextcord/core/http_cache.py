@@ -0,0 +1,145 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from logging import getLogger
+from time import monotonic
+from typing import TYPE_CHECKING
+
+from .protocols.http import ResponseCacheProtocol
+
+if TYPE_CHECKING:
+    from typing import Any, Optional
+
+    from aiohttp import ClientResponse
+
+    from ..dispatcher import Dispatcher
+    from .protocols.http import RouteProtocol
+
+logger = getLogger(__name__)
+
+
+class CacheEntry:
+    """A cached response
+
+    Parameters
+    ----------
+    response: :class:`ClientResponse`
+        The response with the body already read
+    expires_at: :class:`float`
+        When the entry has to be revalidated. (monotonic time)
+    """
+
+    __slots__ = ("response", "etag", "expires_at")
+
+    def __init__(self, response: ClientResponse, expires_at: float) -> None:
+        self.response: ClientResponse = response
+        self.etag: Optional[str] = response.headers.get("ETag")
+        """The ETag to revalidate with once the entry is stale"""
+        self.expires_at: float = expires_at
+
+    @property
+    def fresh(self) -> bool:
+        """If the response can be used without asking discord"""
+        return self.expires_at > monotonic()
+
+
+class ResponseCache(ResponseCacheProtocol):
+    """A size bounded LRU cache for GET responses with a TTL per route
+
+    Parameters
+    ----------
+    ttls: :class:`Optional[dict[str, float]]`
+        How many seconds to cache each route for, keyed by the unformatted path. For example ``{"/guilds/{guild_id}/roles": 60}``
+    default_ttl: :class:`Optional[float]`
+        How many seconds to cache routes not in ttls for. None to not cache them
+    max_size: :class:`int`
+        How many responses to keep before removing the least recently used ones
+    """
+
+    def __init__(
+        self,
+        ttls: Optional[dict[str, float]] = None,
+        *,
+        default_ttl: Optional[float] = None,
+        max_size: int = 1000,
+    ) -> None:
+        self.ttls: dict[str, float] = ttls or {}
+        self.default_ttl: Optional[float] = default_ttl
+        self.max_size: int = max_size
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+
+    def get(self, route: RouteProtocol, key: str) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def set(self, route: RouteProtocol, key: str, response: ClientResponse) -> None:
+        ttl = self.ttls.get(route.unformatted_path, self.default_ttl)
+        if ttl is None or response.status >= 300:
+            return
+        self._entries[key] = CacheEntry(response, monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, path: str) -> None:
+        """Remove every cached response for a path, no matter the query
+
+        Parameters
+        ----------
+        path: :class:`str`
+            The formatted path, for example ``/guilds/1234/roles``
+        """
+        self._entries.pop(path, None)
+        prefix = path + "?"
+        for key in [key for key in self._entries if key.startswith(prefix)]:
+            del self._entries[key]
+
+    def invalidate_on(self, dispatcher: Dispatcher, event_name: str, path: str) -> None:
+        """Invalidate a path whenever an event gets dispatched
+
+        Parameters
+        ----------
+        dispatcher: :class:`Dispatcher`
+            The dispatcher to listen on, for example :attr:`GatewayProtocol.event_dispatcher`
+        event_name: :class:`str`
+            The event to listen for
+        path: :class:`str`
+            The path to invalidate. This gets formatted with the event data, for example ``/guilds/{guild_id}/roles``
+        """
+
+        async def invalidate(_: Any, data: dict[str, Any]) -> None:
+            try:
+                formatted_path = path.format_map(data)
+            except KeyError:
+                logger.debug("Could not invalidate %s, %s is missing data", path, event_name)
+                return
+            self.invalidate(formatted_path)
+
+        dispatcher.add_listener(invalidate, event_name)
+
+    def clear(self) -> None:
+        """Remove every cached response"""
+        self._entries.clear()
@@ -0,0 +1,234 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import annotations
+
+from bisect import bisect_left
+from collections import defaultdict
+from logging import getLogger
+from typing import TYPE_CHECKING
+
+from aiohttp import web
+
+from .protocols.http import HTTPMetricsProtocol
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional, Sequence
+
+    from .protocols.http import RouteProtocol
+
+logger = getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+"""The default histogram buckets in seconds"""
+
+
+class Histogram:
+    """A histogram with fixed buckets
+
+    Parameters
+    ----------
+    buckets: :class:`Sequence[float]`
+        The upper bounds of the buckets, sorted
+    """
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets: Sequence[float] = buckets
+        self.counts: list[int] = [0] * len(buckets)
+        """How many observations fell into each bucket. This is not cumulative"""
+        self.sum: float = 0
+        self.count: int = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.buckets, value)
+        if index < len(self.counts):
+            self.counts[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class HTTPMetrics(HTTPMetricsProtocol):
+    """Keeps HTTP metrics in memory and renders them in the Prometheus text format.
+
+    Everything is labelled with the method and the unformatted path, so ``/channels/1/messages`` and
+    ``/channels/2/messages`` are counted together.
+
+    .. code-block:: python3
+
+        metrics = HTTPMetrics()
+        client = Client(token, http_options={"metrics": metrics})
+        await metrics.serve(port=9100)
+
+    Parameters
+    ----------
+    buckets: :class:`Sequence[float]`
+        The histogram buckets in seconds
+    """
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        self.buckets: Sequence[float] = tuple(sorted(buckets))
+        self.latency: defaultdict[tuple[str, str], Histogram] = defaultdict(self._histogram)
+        """Seconds from sending a request to receiving the response headers"""
+        self.bucket_wait: defaultdict[tuple[str, str], Histogram] = defaultdict(self._histogram)
+        """Seconds spent waiting for a spot in the ratelimit bucket"""
+        self.global_wait: defaultdict[tuple[str, str], Histogram] = defaultdict(self._histogram)
+        """Seconds spent waiting for the global ratelimit"""
+        self.queue_depth: dict[tuple[str, str], int] = {}
+        """How many requests were waiting in the bucket when the last request to the route started waiting"""
+        self.responses: defaultdict[tuple[str, str, int], int] = defaultdict(int)
+        """Responses by status code"""
+        self.ratelimits: defaultdict[tuple[str, str, str], int] = defaultdict(int)
+        """429 responses by scope"""
+        self.retries: defaultdict[tuple[str, str, str], int] = defaultdict(int)
+        """Retries by reason"""
+        self._runner: Optional[web.AppRunner] = None
+
+    def _histogram(self) -> Histogram:
+        return Histogram(self.buckets)
+
+    def observe_request(self, route: RouteProtocol, status: int, latency: float) -> None:
+        self.latency[route.method, route.unformatted_path].observe(latency)
+        self.responses[route.method, route.unformatted_path, status] += 1
+
+    def observe_bucket_wait(self, route: RouteProtocol, wait: float, queue_depth: int) -> None:
+        self.bucket_wait[route.method, route.unformatted_path].observe(wait)
+        self.queue_depth[route.method, route.unformatted_path] = queue_depth
+
+    def observe_global_wait(self, route: RouteProtocol, wait: float) -> None:
+        self.global_wait[route.method, route.unformatted_path].observe(wait)
+
+    def ratelimited(self, route: RouteProtocol, scope: str) -> None:
+        self.ratelimits[route.method, route.unformatted_path, scope] += 1
+
+    def retried(self, route: RouteProtocol, reason: str) -> None:
+        self.retries[route.method, route.unformatted_path, reason] += 1
+
+    def render(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        lines: list[str] = []
+        self._render_histograms(
+            lines, "nextcord_http_request_duration_seconds", "Discord API response latency", self.latency
+        )
+        self._render_histograms(
+            lines, "nextcord_http_bucket_wait_seconds", "Time spent waiting for ratelimit buckets", self.bucket_wait
+        )
+        self._render_histograms(
+            lines, "nextcord_http_global_wait_seconds", "Time spent waiting for the global ratelimit", self.global_wait
+        )
+        self._render_values(
+            lines,
+            "nextcord_http_bucket_queue_depth",
+            "gauge",
+            "Requests waiting in the bucket when the last request started waiting",
+            ("method", "route"),
+            self.queue_depth.items(),
+        )
+        self._render_values(
+            lines,
+            "nextcord_http_responses_total",
+            "counter",
+            "Responses by status code",
+            ("method", "route", "status"),
+            self.responses.items(),
+        )
+        self._render_values(
+            lines,
+            "nextcord_http_ratelimits_total",
+            "counter",
+            "429 responses by scope",
+            ("method", "route", "scope"),
+            self.ratelimits.items(),
+        )
+        self._render_values(
+            lines,
+            "nextcord_http_retries_total",
+            "counter",
+            "Retried requests by reason",
+            ("method", "route", "reason"),
+            self.retries.items(),
+        )
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _labels(names: Sequence[str], values: Iterable[object]) -> str:
+        return ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+
+    def _render_histograms(
+        self, lines: list[str], name: str, description: str, histograms: dict[tuple[str, str], Histogram]
+    ) -> None:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, histogram in list(histograms.items()):
+            labels = self._labels(("method", "route"), key)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+    def _render_values(
+        self,
+        lines: list[str],
+        name: str,
+        kind: str,
+        description: str,
+        label_names: Sequence[str],
+        values: Iterable[tuple[tuple[object, ...], int]],
+    ) -> None:
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key, value in list(values):
+            lines.append(f"{name}{{{self._labels(label_names, key)}}} {value}")
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9100) -> None:
+        """Serve the metrics for Prometheus to scrape at ``/metrics``
+
+        Parameters
+        ----------
+        host: :class:`str`
+            The host to listen on. This only listens locally by default
+        port: :class:`int`
+            The port to listen on
+        """
+
+        async def handler(_: web.Request) -> web.Response:
+            return web.Response(text=self.render(), content_type="text/plain", charset="utf-8")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handler)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info("Serving HTTP metrics on %s:%s", host, port)
+
+    async def close(self) -> None:
+        """Stop serving the metrics"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
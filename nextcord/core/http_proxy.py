@@ -0,0 +1,246 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+"""A HTTP proxy ratelimiting requests to discord for many bot processes.
+
+Run it with ``python -m nextcord.core.http_proxy --port 8080`` and point clients at it:
+
+.. code-block:: python3
+
+    client = Client(token, http_options={"api_base": "http://127.0.0.1:8080", "proxied": True})
+"""
+
+from __future__ import annotations
+
+import re
+from argparse import ArgumentParser
+from asyncio import get_running_loop
+from logging import getLogger
+from typing import TYPE_CHECKING
+
+from aiohttp import ClientConnectionError, web
+
+from ..exceptions import (
+    CloudflareBanException,
+    DiscordException,
+    InvalidRequestLimitException,
+)
+from ..type_sheet import TypeSheet
+from .http import HTTPClient
+from .protocols.http import RouteProtocol
+
+if TYPE_CHECKING:
+    from asyncio import AbstractEventLoop
+    from typing import Any, Optional
+
+logger = getLogger(__name__)
+
+_ID = re.compile(r"/\d+(?=/|$)")
+_MAJOR = re.compile(r"^/(channels|guilds|webhooks)/(\d+)(?:/([^/]+))?")
+# Webhook and interaction tokens are major parameters, they should not end up in the ratelimit key
+_TOKEN = re.compile(r"^(/(?:webhooks|interactions)/\{id\})/[^/]+")
+_WEBHOOK_GLOBAL = re.compile(r"^/(webhooks/\d+/[^/]+|interactions/\d+/[^/]+/callback)")
+
+# Headers describing the connection to the proxy instead of the request itself
+_HOP_BY_HOP_HEADERS = frozenset(
+    (
+        "connection",
+        "keep-alive",
+        "transfer-encoding",
+        "content-length",
+        "content-encoding",
+        "accept-encoding",
+        "host",
+        "upgrade",
+    )
+)
+
+
+class ProxiedRoute(RouteProtocol):
+    """A route parsed from a formatted path received by the proxy.
+
+    Snowflakes in the path are replaced with ``{id}`` to get the ratelimit key and major parameters are taken from the start.
+
+    Parameters
+    ----------
+    method: :class:`str`
+        The HTTP method
+    path: :class:`str`
+        The formatted path, without the API base
+    """
+
+    __slots__ = (
+        "method",
+        "path",
+        "unformatted_path",
+        "use_webhook_global",
+        "ratelimit_key",
+        "major_parameters",
+        "bucket",
+    )
+
+    def __init__(self, method: str, path: str) -> None:
+        self.method = method
+        self.path = path
+        self.unformatted_path = _TOKEN.sub(r"\1/{token}", _ID.sub("/{id}", path))
+        self.use_webhook_global = _WEBHOOK_GLOBAL.match(path) is not None
+
+        guild_id = channel_id = webhook_id = webhook_token = None
+        if (match := _MAJOR.match(path)) is not None:
+            kind, snowflake, rest = match.groups()
+            if kind == "guilds":
+                guild_id = snowflake
+            elif kind == "channels":
+                channel_id = snowflake
+            else:
+                webhook_id = snowflake
+                webhook_token = rest
+        self.ratelimit_key = f"{method}:{self.unformatted_path}"
+        # The same format as Route so keys look the same in logs
+        self.major_parameters = f"{guild_id}:{channel_id}:{webhook_id}:{webhook_token}"
+        self.bucket = f"{self.ratelimit_key}:{self.major_parameters}"
+
+
+class _ProxyState:
+    """The parts of :class:`State <nextcord.client.state.State>` the HTTPClient uses"""
+
+    def __init__(self, type_sheet: TypeSheet, loop: AbstractEventLoop) -> None:
+        self.type_sheet: TypeSheet = type_sheet
+        self.loop: AbstractEventLoop = loop
+        # Every request carries the Authorization header of the bot sending it
+        self.token: Optional[str] = None
+
+
+class RatelimitProxy:
+    """Forwards requests to discord, ratelimiting them with a :class:`HTTPClient` per bot token.
+
+    Every process sending through the same proxy shares buckets and the global ratelimit.
+    Responses, including errors, are passed through as they are. If discord could not be reached the proxy answers with
+    a 502, and while it holds requests back to avoid a Cloudflare ban it answers with a 503 and a ``Retry-After`` of
+    when requests can be sent again.
+
+    Parameters
+    ----------
+    type_sheet: :class:`Optional[TypeSheet]`
+        The type sheet to create clients and buckets from. Use a :class:`SharedBucket <nextcord.core.shared_bucket.SharedBucket>`
+        here to run multiple proxies with shared state.
+    http_options:
+        Options passed to every :class:`HTTPClient`
+    """
+
+    def __init__(self, type_sheet: Optional[TypeSheet] = None, **http_options: Any) -> None:
+        self.type_sheet: TypeSheet = type_sheet or TypeSheet.default()
+        self.http_options: dict[str, Any] = http_options
+        self._clients: dict[Optional[str], HTTPClient] = {}
+        self._runner: Optional[web.AppRunner] = None
+
+    def _get_client(self, authorization: Optional[str]) -> HTTPClient:
+        client: Optional[HTTPClient] = self._clients.get(authorization)
+        if client is None:
+            state = _ProxyState(self.type_sheet, get_running_loop())
+            new_client = self.type_sheet.http_client(state, **self.http_options)  # type: ignore
+            if not isinstance(new_client, HTTPClient):
+                # Requests are forwarded with HTTPClient._request to get errors passed through
+                raise TypeError(f"The ratelimit proxy needs a HTTPClient, not {type(new_client).__name__}")
+            client = new_client
+            self._clients[authorization] = client
+        return client
+
+    @property
+    def app(self) -> web.Application:
+        """A aiohttp application serving the proxy"""
+        app = web.Application(client_max_size=0)
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        app.on_cleanup.append(lambda _: self.close_clients())
+        return app
+
+    async def handle(self, request: web.Request) -> web.StreamResponse:
+        route = ProxiedRoute(request.method, "/" + request.match_info["path"])
+        headers = {key: value for key, value in request.headers.items() if key.lower() not in _HOP_BY_HOP_HEADERS}
+        client = self._get_client(request.headers.get("Authorization"))
+        body = await request.read()
+
+        try:
+            r = await client._request(
+                route,
+                headers=headers,
+                raise_errors=False,
+                params=request.query_string or None,
+                data=body or None,
+            )
+        except CloudflareBanException:
+            # Pass it on as it was received so the clients find out too
+            return web.Response(status=429, text="You are being blocked from accessing our API temporarily.")
+        except InvalidRequestLimitException as error:
+            # Not a ratelimit, retrying straight away would only be refused again
+            return web.json_response(
+                {"message": str(error), "retry_after": error.retry_after},
+                status=503,
+                headers={"Retry-After": f"{error.retry_after:.3f}"},
+            )
+        except (ClientConnectionError, DiscordException) as error:
+            logger.warning("Could not forward %s %s: %s", route.method, route.path, error)
+            return web.json_response({"message": str(error)}, status=502)
+
+        response_headers = {key: value for key, value in r.headers.items() if key.lower() not in _HOP_BY_HOP_HEADERS}
+        return web.Response(status=r.status, body=await r.read(), headers=response_headers)
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        """Start the proxy
+
+        Parameters
+        ----------
+        host: :class:`str`
+            The host to listen on
+        port: :class:`int`
+            The port to listen on
+        """
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info("Ratelimit proxy listening on %s:%s", host, port)
+
+    async def close_clients(self) -> None:
+        for client in self._clients.values():
+            await client.close()
+        self._clients.clear()
+
+    async def close(self) -> None:
+        """Stop the proxy"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        await self.close_clients()
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Run a ratelimiting proxy for the discord API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--api-base", default=None, help="Where to forward requests to. Defaults to the discord API")
+    parser.add_argument("--global-ratelimit", type=int, default=50, help="Requests per second per bot")
+    args = parser.parse_args()
+
+    proxy = RatelimitProxy(api_base=args.api_base, global_ratelimit=args.global_ratelimit)
+    web.run_app(proxy.app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
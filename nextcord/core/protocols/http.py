@@ -20,16 +20,19 @@
 # DEALINGS IN THE SOFTWARE.
 from __future__ import annotations
 
-from typing import TYPE_CHECKING, Protocol
+from typing import TYPE_CHECKING, Protocol, overload
 
 from nextcord.client.state import State
 
 if TYPE_CHECKING:
-    from typing import Any, Literal, Optional, Type, TypeVar
+    from typing import Any, Literal, Optional, Type, TypeVar, Union
 
     from aiohttp import ClientResponse, ClientWebSocketResponse
 
+    from ...file import File
     from ...type_sheet import TypeSheet
+    from ..http import HTTPResponse
+    from ..http_cache import CacheEntry
 
     T = TypeVar("T")
 
@@ -50,12 +53,20 @@ class RouteProtocol(Protocol):
 
     """
 
+    __slots__ = ()
+
     method: str
     """The HTTP method"""
     path: str
     """The route to be requested from discord"""
+    unformatted_path: str
+    """The path before it got formatted with the parameters"""
     bucket: str
-    """The ratelimit bucket this is under"""
+    """The ratelimit bucket this is under until the bucket hash is known"""
+    ratelimit_key: str
+    """The key discord's bucket hash for this route is stored under. This is usually the method and unformatted path"""
+    major_parameters: str
+    """The major parameters of this route. Routes with the same bucket hash only share a bucket if these match"""
     use_webhook_global: bool
     """If this route uses the webhook global LINK MISSING"""
 
@@ -83,7 +94,7 @@ class RouteProtocol(Protocol):
 class BucketProtocol(Protocol):
     """Ratelimiting for HTTP!
 
-    You have to implement a async with context manager that waits when it runs out.
+    You have to implement :meth:`acquire` and :meth:`release`, and a async with context manager doing the same with the default priority.
     Limit remaining and reset_at will be automatically set by HTTPClient.
 
     .. note::
@@ -93,6 +104,8 @@ class BucketProtocol(Protocol):
     ----------
     route: :class:`RouteProtocol`
         The route this is for
+    key: :class:`str`
+        The key the HTTPClient stores this bucket under. Routes sharing a bucket hash use the same key.
     """
 
     limit: Optional[int]
@@ -101,8 +114,35 @@ class BucketProtocol(Protocol):
     """How many is remaining."""
     reset_at: Optional[float]
     """When the bucket resets"""
+    unlimited: bool
+    """Set when a successful response had no ratelimit headers, so the route has no bucket and requests don't have to
+    wait for each other"""
+
+    def __init__(self, route: RouteProtocol, key: str) -> None:
+        ...
+
+    @property
+    def idle(self) -> bool:
+        """If nothing is using or waiting on this bucket and its ratelimit has reset. Idle buckets may be removed by the HTTPClient."""
+        ...
+
+    @property
+    def pending(self) -> int:
+        """How many requests are waiting for a spot in this bucket"""
+        ...
+
+    async def acquire(self, priority: int = 0) -> None:
+        """Reserve a spot in the bucket, waiting if it has run out.
+
+        Parameters
+        ----------
+        priority: :class:`int`
+            Pending requests with a higher priority should be released first. Requests with the same priority should be released in order.
+        """
+        ...
 
-    def __init__(self, route: RouteProtocol) -> None:
+    async def release(self) -> None:
+        """Called when the request using a spot from :meth:`acquire` has finished"""
         ...
 
     async def __aenter__(self: T) -> T:
@@ -111,6 +151,138 @@ class BucketProtocol(Protocol):
     async def __aexit__(self, *_: Any) -> None:
         ...
 
+    def migrate(self) -> None:
+        """Called when this temporary bucket gets merged into the shared bucket for its bucket hash.
+        All pending requests should be released so they can queue up on the shared bucket instead.
+        """
+        ...
+
+    def lock_global(self, retry_after: float) -> None:
+        """Called when a request in this bucket hit the global ratelimit.
+        The HTTPClient pauses its own requests, buckets shared with other processes should pause those too.
+
+        Parameters
+        ----------
+        retry_after: :class:`float`
+            How many seconds discord wants us to wait
+        """
+        ...
+
+
+class ResponseCacheProtocol(Protocol):
+    """A cache for GET responses used by the HTTPClient.
+
+    Fresh responses are returned without sending a request, so they do not use a ratelimit bucket.
+    Stale responses with a ETag are revalidated with discord.
+    """
+
+    def get(self, route: RouteProtocol, key: str) -> Optional[CacheEntry]:
+        """Get a cached response. This may be stale.
+
+        Parameters
+        ----------
+        route: :class:`RouteProtocol`
+            The route being requested
+        key: :class:`str`
+            The path and query of the request
+        """
+        ...
+
+    def set(self, route: RouteProtocol, key: str, response: ClientResponse) -> None:
+        """Store a response. The body has already been read. It is up to the cache if and how long it is kept.
+
+        Parameters
+        ----------
+        route: :class:`RouteProtocol`
+            The route that was requested
+        key: :class:`str`
+            The path and query of the request
+        response: :class:`ClientResponse`
+            The response discord sent
+        """
+        ...
+
+    def invalidate(self, path: str) -> None:
+        """Remove every cached response for a path
+
+        Parameters
+        ----------
+        path: :class:`str`
+            The formatted path
+        """
+        ...
+
+
+class HTTPMetricsProtocol(Protocol):
+    """Receives measurements from the HTTPClient, for example :class:`nextcord.core.http_metrics.HTTPMetrics`.
+
+    These are called on every request, so they should be fast and must not block.
+    """
+
+    def observe_request(self, route: RouteProtocol, status: int, latency: float) -> None:
+        """A response was received
+
+        Parameters
+        ----------
+        route: :class:`RouteProtocol`
+            The route that was requested
+        status: :class:`int`
+            The status code of the response
+        latency: :class:`float`
+            Seconds from sending the request to receiving the response headers
+        """
+        ...
+
+    def observe_bucket_wait(self, route: RouteProtocol, wait: float, queue_depth: int) -> None:
+        """A request got a spot in its ratelimit bucket
+
+        Parameters
+        ----------
+        route: :class:`RouteProtocol`
+            The route being requested
+        wait: :class:`float`
+            Seconds spent waiting for the bucket
+        queue_depth: :class:`int`
+            How many requests were already waiting on the bucket when this one started waiting
+        """
+        ...
+
+    def observe_global_wait(self, route: RouteProtocol, wait: float) -> None:
+        """A request got past the global ratelimit
+
+        Parameters
+        ----------
+        route: :class:`RouteProtocol`
+            The route being requested
+        wait: :class:`float`
+            Seconds spent waiting for the global ratelimit
+        """
+        ...
+
+    def ratelimited(self, route: RouteProtocol, scope: str) -> None:
+        """A 429 response was received
+
+        Parameters
+        ----------
+        route: :class:`RouteProtocol`
+            The route that was ratelimited
+        scope: :class:`str`
+            ``global``, ``user`` or ``shared``
+        """
+        ...
+
+    def retried(self, route: RouteProtocol, reason: str) -> None:
+        """A request is being retried
+
+        Parameters
+        ----------
+        route: :class:`RouteProtocol`
+            The route being retried
+        reason: :class:`str`
+            ``ratelimit``, ``status`` or ``connection``
+        """
+        ...
+
 
 class HTTPClientProtocol(Protocol):
     """A http client to interact with the Discord REST API.
@@ -118,20 +290,69 @@ class HTTPClientProtocol(Protocol):
 
     state: :class:`State`
         A bot state
-    token: :class:`Optional[str]`
-        The bot token if present.
+    options:
+        The ``http_options`` passed to :class:`Client <nextcord.Client>`
     """
 
-    def __init__(self, state: State, token: Optional[str] = None) -> None:
+    def __init__(self, state: State, **options: Any) -> None:
+        ...
+
+    @overload
+    async def request(
+        self,
+        route: RouteProtocol,
+        *,
+        headers: Optional[dict[str, str]] = None,
+        priority: int = 0,
+        files: Optional[list[File]] = None,
+        decode: Literal[False] = False,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> ClientResponse:
         ...
 
-    async def request(self, route: RouteProtocol, **kwargs: Any) -> ClientResponse:
+    @overload
+    async def request(
+        self,
+        route: RouteProtocol,
+        *,
+        headers: Optional[dict[str, str]] = None,
+        priority: int = 0,
+        files: Optional[list[File]] = None,
+        decode: Literal[True],
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> HTTPResponse:
+        ...
+
+    async def request(
+        self,
+        route: RouteProtocol,
+        *,
+        headers: Optional[dict[str, str]] = None,
+        priority: int = 0,
+        files: Optional[list[File]] = None,
+        decode: bool = False,
+        timeout: Optional[float] = None,
+        **kwargs: Any,
+    ) -> Union[ClientResponse, HTTPResponse]:
         """Send a HTTP request to the discord API
 
         This should use TypeSheet.http_bucket to ratelimit.
 
         route: :class:`RouteProtocol`
             The metadata for this API route
+        headers: :class:`Optional[dict[str, str]]`
+            Extra request headers
+        priority: :class:`int`
+            Requests with a higher priority should skip ahead of lower priority requests in the same bucket
+        files: :class:`Optional[list[File]]`
+            Files to upload as multipart form data, with the ``json`` kwarg sent as ``payload_json``
+        decode: :class:`bool`
+            If this should return a :class:`HTTPResponse <nextcord.core.http.HTTPResponse>` with the body decoded and the connection released
+            instead of the aiohttp :class:`ClientResponse`
+        timeout: :class:`Optional[float]`
+            How many seconds the request may take in total, including time spent waiting for ratelimits
         kwargs:
             Keyword only arguments passed to :attr:`ClientSession.request <aiohttp.ClientSession.trace_config>`
         """
@@ -157,7 +378,7 @@ class HTTPClientProtocol(Protocol):
         """
         ...
 
-    async def get_gateway_bot(self) -> ClientResponse:
+    async def get_gateway_bot(self) -> HTTPResponse:
         """Gets gateway url and connection information
 
         .. note::
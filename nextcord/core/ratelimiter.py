@@ -23,11 +23,15 @@ from __future__ import annotations
 import time
 from asyncio import Future
 from asyncio.events import AbstractEventLoop, get_event_loop
+from collections import deque
 from logging import getLogger
 from typing import TYPE_CHECKING
 
+from ..exceptions import InvalidRequestLimitException
+
 if TYPE_CHECKING:
-    from typing import Any
+    from asyncio import TimerHandle
+    from typing import Any, Optional
 
 logger = getLogger(__name__)
 
@@ -38,16 +42,17 @@ class TimesPer:
         self.per: float = per
         self.current: int = self.limit
 
-        self._reserved: list[Future[None]] = []
+        self._reserved: deque[Future[None]] = deque()
         self.loop: AbstractEventLoop = get_event_loop()
         self.pending_reset: bool = False
 
     async def __aenter__(self) -> "TimesPer":
-        if self.current == 0:
+        if self.current <= 0:
             future: Future[None] = Future()
             self._reserved.append(future)
-            await future
-        self.current -= 1
+            await future  # The spot got taken for us when we got released
+        else:
+            self.current -= 1
 
         if not self.pending_reset:
             self.pending_reset = True
@@ -64,15 +69,210 @@ class TimesPer:
         self.reset_at = current_time + self.per
         self.current = self.limit
 
-        # Release pending
-        for _ in range(self.limit):
-            try:
-                self._reserved.pop().set_result(None)
-            except IndexError:
-                break
+        # Release pending, oldest first
+        while self.current > 0 and self._reserved:
+            future = self._reserved.popleft()
+            if future.done():
+                continue  # Cancelled while waiting
+            self.current -= 1
+            future.set_result(None)
 
         if len(self._reserved):
             self.pending_reset = True
             self.loop.call_later(self.per, self.reset)
         else:
             self.pending_reset = False
+
+
+class TokenBucket:
+    """Allows ``limit`` requests every ``per`` seconds, refilling continuously.
+
+    Unlike a window which resets all at once, a burst can never be followed by another full burst right after,
+    so discord never sees more than the limit in one of its windows.
+
+    .. note::
+        This is a async context manager.
+
+    Parameters
+    ----------
+    limit: :class:`int`
+        How many requests are allowed per ``per`` seconds. This is also the biggest burst allowed
+    per: :class:`float`
+        How many seconds it takes to refill completely
+    """
+
+    def __init__(self, limit: int, per: float) -> None:
+        self.limit: int = limit
+        self.per: float = per
+        self.tokens: float = limit
+        """How many requests can be sent right now"""
+
+        self._updated_at: float = time.monotonic()
+        self._waiting: deque[Future[None]] = deque()
+        self._wakeup: Optional[TimerHandle] = None
+        self.loop: AbstractEventLoop = get_event_loop()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        if now > self._updated_at:  # Not refilling while drained
+            self.tokens = min(self.limit, self.tokens + (now - self._updated_at) * self.limit / self.per)
+            self._updated_at = now
+
+    async def __aenter__(self) -> "TokenBucket":
+        self._refill()
+        if self.tokens >= 1 and not self._waiting:
+            self.tokens -= 1
+            return self
+        future: Future[None] = Future()
+        self._waiting.append(future)
+        self._schedule_release()
+        await future  # The token got taken for us when we got released
+        return self
+
+    async def __aexit__(self, *_: Any) -> None:
+        ...
+
+    def drain(self, retry_after: float = 0) -> None:
+        """Use up every token, for when discord says too many requests were sent.
+        Requests then go out at the refill rate instead of in a burst.
+
+        Parameters
+        ----------
+        retry_after: :class:`float`
+            How many seconds to wait before refilling again
+        """
+        self._refill()
+        self.tokens = 0
+        self._updated_at = max(self._updated_at, time.monotonic() + retry_after)
+
+    def _schedule_release(self) -> None:
+        if self._wakeup is None:
+            paused_for = self._updated_at - time.monotonic()
+            delay = max(paused_for, 0) + (1 - self.tokens) * self.per / self.limit
+            self._wakeup = self.loop.call_later(max(delay, 0), self._release)
+
+    def _release(self) -> None:
+        """Hand out the tokens that refilled, oldest waiter first"""
+        self._wakeup = None
+        self._refill()
+        while self._waiting and self.tokens >= 1:
+            future = self._waiting.popleft()
+            if future.done():
+                continue  # Cancelled while waiting
+            self.tokens -= 1
+            future.set_result(None)
+        while self._waiting and self._waiting[0].done():
+            self._waiting.popleft()
+        if self._waiting:
+            self._schedule_release()
+
+
+class InvalidRequestTracker:
+    """Counts 401, 403 and 429 responses in a sliding window so we back off before Cloudflare bans the IP.
+
+    Once ``slowdown_at`` of the limit is used requests get delayed more and more, and once ``short_circuit_at`` is used
+    requests with a priority of 0 or lower are refused. Higher priority requests are only refused once the limit is reached.
+
+    Parameters
+    ----------
+    limit: :class:`int`
+        How many invalid requests are allowed per window
+    window: :class:`float`
+        How many seconds invalid requests are counted for
+    slowdown_at: :class:`float`
+        The fraction of the limit after which requests get delayed
+    short_circuit_at: :class:`float`
+        The fraction of the limit after which low priority requests get refused
+    max_delay: :class:`float`
+        How many seconds requests get delayed for right before they start getting refused
+    """
+
+    def __init__(
+        self,
+        limit: int = 10_000,
+        window: float = 600,
+        *,
+        slowdown_at: float = 0.5,
+        short_circuit_at: float = 0.9,
+        max_delay: float = 5,
+    ) -> None:
+        self.limit: int = limit
+        self.window: float = window
+        self.slowdown_at: float = slowdown_at
+        self.short_circuit_at: float = short_circuit_at
+        self.max_delay: float = max_delay
+        # Counts per second, oldest first
+        self._counts: deque[list[int]] = deque()
+        self._total: int = 0
+
+    def _expire(self, now: float) -> None:
+        cutoff = now - self.window
+        while self._counts and self._counts[0][0] <= cutoff:
+            self._total -= self._counts.popleft()[1]
+
+    def record(self) -> None:
+        """Count a invalid response"""
+        now = time.monotonic()
+        self._expire(now)
+        second = int(now)
+        if self._counts and self._counts[-1][0] == second:
+            self._counts[-1][1] += 1
+        else:
+            self._counts.append([second, 1])
+        self._total += 1
+        if self._total == int(self.limit * self.slowdown_at):
+            logger.warning(
+                "%s invalid requests in the last %s seconds, slowing down requests", self._total, self.window
+            )
+
+    @property
+    def count(self) -> int:
+        """How many invalid requests are in the current window"""
+        self._expire(time.monotonic())
+        return self._total
+
+    @property
+    def remaining(self) -> int:
+        """How many more invalid requests can be made in the current window"""
+        return max(0, self.limit - self.count)
+
+    def retry_after(self, priority: int = 0) -> float:
+        """How many seconds until enough invalid requests expired for a request to be sent again
+
+        Parameters
+        ----------
+        priority: :class:`int`
+            The priority of the request
+        """
+        now = time.monotonic()
+        self._expire(now)
+        allowed = self.limit if priority > 0 else self.limit * self.short_circuit_at
+        total = self._total
+        if total < allowed:
+            return 0
+        # Oldest first, find the second after which enough have expired
+        for second, count in self._counts:
+            total -= count
+            if total < allowed:
+                return max(second + self.window - now, 0)
+        return self.window
+
+    def delay(self, priority: int = 0) -> float:
+        """How many seconds to wait before sending a request
+
+        Parameters
+        ----------
+        priority: :class:`int`
+            The priority of the request. Requests with a priority above 0 are never delayed.
+
+        Raises
+        ------
+        InvalidRequestLimitException
+            The request should not be sent at all
+        """
+        used = self.count / self.limit
+        if used >= 1 or (priority <= 0 and used >= self.short_circuit_at):
+            raise InvalidRequestLimitException(self.remaining, self.retry_after(priority))
+        if priority > 0 or used < self.slowdown_at:
+            return 0
+        return self.max_delay * (used - self.slowdown_at) / (self.short_circuit_at - self.slowdown_at)
@@ -0,0 +1,101 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import annotations
+
+from random import random
+from typing import TYPE_CHECKING
+
+from aiohttp import ClientConnectorError
+
+if TYPE_CHECKING:
+    from typing import Iterable, Optional
+
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+class RetryPolicy:
+    """When and how long to wait before retrying a failed request.
+
+    Ratelimited requests are always retried, server errors and connection errors are only retried if the method is idempotent.
+
+    Parameters
+    ----------
+    max_retries: :class:`int`
+        How many attempts a request gets in total
+    backoff_base: :class:`float`
+        How many seconds to wait before the first retry. This doubles for every attempt.
+    backoff_max: :class:`float`
+        The longest time in seconds to wait between attempts
+    retry_statuses: :class:`Iterable[int]`
+        Which server error status codes to retry
+    retry_non_idempotent: :class:`bool`
+        Also retry server and connection errors for methods like POST and PATCH. This might create duplicates.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_retries: int = 5,
+        backoff_base: float = 0.5,
+        backoff_max: float = 30,
+        retry_statuses: Iterable[int] = (500, 502, 503, 504),
+        retry_non_idempotent: bool = False,
+    ) -> None:
+        self.max_retries: int = max_retries
+        self.backoff_base: float = backoff_base
+        self.backoff_max: float = backoff_max
+        self.retry_statuses: frozenset[int] = frozenset(retry_statuses)
+        self.retry_non_idempotent: bool = retry_non_idempotent
+
+    def should_retry(
+        self, method: str, attempt: int, *, status: Optional[int] = None, error: Optional[Exception] = None
+    ) -> bool:
+        """If a failed request should be retried
+
+        Parameters
+        ----------
+        method: :class:`str`
+            The HTTP method of the request
+        attempt: :class:`int`
+            Which attempt failed, starting at 0
+        status: :class:`Optional[int]`
+            The status code of the response, if we got one
+        error: :class:`Optional[Exception]`
+            The connection error, if we didn't get a response
+        """
+        if attempt + 1 >= self.max_retries:
+            return False
+        if isinstance(error, ClientConnectorError):
+            return True  # We never connected, so the request was not sent
+        if status is not None and status not in self.retry_statuses:
+            return False
+        return self.retry_non_idempotent or method in IDEMPOTENT_METHODS
+
+    def backoff(self, attempt: int) -> float:
+        """How many seconds to wait before retrying. This uses exponential backoff with full jitter.
+
+        Parameters
+        ----------
+        attempt: :class:`int`
+            Which attempt failed, starting at 0
+        """
+        return float(random() * min(self.backoff_max, self.backoff_base * 2**attempt))
@@ -0,0 +1,524 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from asyncio import (
+    CancelledError,
+    Future,
+    Lock,
+    current_task,
+    get_event_loop,
+    open_unix_connection,
+    run,
+    start_unix_server,
+)
+from collections import OrderedDict, deque
+from logging import getLogger
+from time import monotonic, time
+from typing import TYPE_CHECKING
+
+from ..exceptions import NextcordException
+from ..utils import json
+from .protocols.http import BucketProtocol
+from .ratelimiter import TokenBucket
+
+if TYPE_CHECKING:
+    from asyncio import AbstractServer, StreamReader, StreamWriter, Task
+    from typing import Any, Optional, Type
+
+    from .protocols.http import RouteProtocol
+
+logger = getLogger(__name__)
+
+DEFAULT_SOCKET_PATH = "/tmp/nextcord-ratelimit.sock"
+
+
+def _encode(payload: dict[str, Any]) -> bytes:
+    data = json.dumps(payload)
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    return data + b"\n"
+
+
+class RatelimitConnection:
+    """A connection from one process to a :class:`RatelimitServer`.
+
+    Parameters
+    ----------
+    path: :class:`str`
+        The path of the unix socket the server is listening on
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path: str = path
+        self._writer: Optional[StreamWriter] = None
+        self._grants: dict[int, Future[None]] = {}
+        self._next_id: int = 0
+        self._connect_lock: Lock = Lock()
+
+    async def connect(self) -> None:
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            reader, self._writer = await open_unix_connection(self.path)
+            get_event_loop().create_task(self._receive_loop(reader))
+
+    async def _receive_loop(self, reader: StreamReader) -> None:
+        while line := await reader.readline():
+            message = json.loads(line)
+            future = self._grants.pop(message["id"], None)
+            if future is not None and not future.done():
+                future.set_result(None)
+        logger.warning("Lost connection to the ratelimit server at %s", self.path)
+        self._writer = None
+        for future in self._grants.values():
+            if not future.done():
+                future.set_exception(NextcordException("Lost connection to the ratelimit server"))
+        self._grants.clear()
+
+    def send(self, payload: dict[str, Any]) -> None:
+        if self._writer is None:
+            raise NextcordException("Not connected to the ratelimit server")
+        self._writer.write(_encode(payload))
+
+    async def acquire(self, key: str, pool: str, priority: int, waiting: dict[int, Future[None]]) -> int:
+        """Wait until the server grants us a spot in a bucket.
+
+        Parameters
+        ----------
+        key: :class:`str`
+            The bucket key
+        pool: :class:`str`
+            Which global ratelimit this counts against
+        priority: :class:`int`
+            Requests with a higher priority get granted first
+        waiting: :class:`dict[int, Future[None]]`
+            Where to register the pending grant so the bucket can cancel it when migrating
+
+        Returns
+        -------
+        int
+            The grant id to release when the request is done
+        """
+        await self.connect()
+        grant_id = self._next_id
+        self._next_id += 1
+        future: Future[None] = Future()
+        self._grants[grant_id] = future
+        waiting[grant_id] = future
+        self.send({"op": "acquire", "id": grant_id, "key": key, "pool": pool, "priority": priority})
+        try:
+            await future
+        except CancelledError:
+            # Give the spot back, the server releases it if it was already granted
+            self._grants.pop(grant_id, None)
+            if self._writer is not None:
+                self.send({"op": "cancel", "id": grant_id, "key": key})
+            raise
+        finally:
+            waiting.pop(grant_id, None)
+        return grant_id
+
+    async def close(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            await self._writer.wait_closed()
+            self._writer = None
+
+
+class SharedBucket(BucketProtocol):
+    """A :class:`BucketProtocol` keeping its state in a :class:`RatelimitServer` so multiple processes can share a token.
+
+    Requests are granted in the order they reached the server, no matter which process they came from.
+    Use :meth:`SharedBucket.with_socket_path` to point it at a server which is not on the default path.
+
+    .. note::
+        This is a async context manager.
+    """
+
+    socket_path: str = DEFAULT_SOCKET_PATH
+    """The unix socket the ratelimit server is listening on"""
+    _connections: dict[str, RatelimitConnection] = {}
+
+    def __init__(self, route: RouteProtocol, key: str) -> None:
+        self.key: str = key
+        """The key this bucket is stored under in the HTTPClient and in the server"""
+        self.limit: Optional[int] = None
+        """How many requests fit in a bucket"""
+        self.reset_at: Optional[float] = None
+        """When the Bucket fills up again. (UTC time)"""
+        self._remaining: Optional[int] = None
+        self._unlimited: bool = False
+        self._pool: str = "webhook" if route.use_webhook_global else "global"
+        self._waiting: dict[int, Future[None]] = {}
+        self._held: dict[Optional[Task[Any]], int] = {}
+        self._migrated: bool = False
+
+        connection = self._connections.get(self.socket_path)
+        if connection is None:
+            connection = RatelimitConnection(self.socket_path)
+            self._connections[self.socket_path] = connection
+        self._connection: RatelimitConnection = connection
+
+    @classmethod
+    def with_socket_path(cls, path: str) -> Type[SharedBucket]:
+        """Create a :class:`SharedBucket` type connecting to a different server. Use this in :attr:`TypeSheet.http_bucket`
+
+        Parameters
+        ----------
+        path: :class:`str`
+            The unix socket the ratelimit server is listening on
+        """
+        return type(cls.__name__, (cls,), {"socket_path": path})
+
+    @property  # type: ignore
+    def remaining(self) -> Optional[int]:  # type: ignore
+        """How many requests are remaining. This is the latest value this process has seen."""
+        return self._remaining
+
+    @remaining.setter
+    def remaining(self, new_value: int) -> None:
+        # HTTPClient sets this last, so reset_at and limit are already up to date
+        self._remaining = new_value
+        self._send(
+            {"op": "update", "key": self.key, "limit": self.limit, "remaining": new_value, "reset_at": self.reset_at}
+        )
+
+    @property
+    def unlimited(self) -> bool:
+        """If the route turned out to have no ratelimit"""
+        return self._unlimited
+
+    @unlimited.setter
+    def unlimited(self, new_value: bool) -> None:
+        self._unlimited = new_value
+        self._send({"op": "unlimited", "key": self.key, "unlimited": new_value})
+
+    @property
+    def pending(self) -> int:
+        """How many requests in this process are waiting for a spot in this bucket"""
+        return len(self._waiting)
+
+    @property
+    def idle(self) -> bool:
+        """If this process is not using or waiting on this bucket. The state itself is kept by the server."""
+        return not self._held and not self._waiting
+
+    async def acquire(self, priority: int = 0) -> None:
+        """Reserve a spot in the bucket for the request.
+        If all are taken, the server will queue it up. Requests with a higher priority get granted first.
+        """
+        if self._migrated:
+            return
+        try:
+            grant_id = await self._connection.acquire(self.key, self._pool, priority, self._waiting)
+        except CancelledError:
+            if not self._migrated:
+                raise
+            # Moved to another bucket while waiting, HTTPClient will queue up on that instead
+            return
+        self._held[current_task()] = grant_id
+
+    async def release(self) -> None:
+        """
+        Request finished
+        """
+        grant_id = self._held.pop(current_task(), None)
+        if grant_id is not None:
+            # If the connection dropped the server already gave the spot back
+            self._send({"op": "release", "id": grant_id, "key": self.key})
+
+    async def __aenter__(self) -> "SharedBucket":
+        """Reserve a spot in the bucket for the request with the default priority."""
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *_: Any) -> None:
+        """
+        Request finished
+        """
+        await self.release()
+
+    def migrate(self) -> None:
+        """Cancel all pending requests on the server so they can queue up on the shared bucket this got merged into"""
+        self._migrated = True
+        for future in list(self._waiting.values()):
+            future.cancel()
+
+    def lock_global(self, retry_after: float) -> None:
+        """Tell the server to pause this global ratelimit for every process until discord lets us send again"""
+        self._send({"op": "global", "pool": self._pool, "retry_after": retry_after})
+
+    def _send(self, payload: dict[str, Any]) -> None:
+        try:
+            self._connection.send(payload)
+        except NextcordException:
+            # The next acquire reconnects, by then the server will have learnt the state from another request
+            logger.warning(
+                "Could not send %s for bucket %s, not connected to the ratelimit server", payload["op"], self.key
+            )
+
+
+class _ServerBucket:
+    def __init__(self, server: RatelimitServer, key: str) -> None:
+        self.key: str = key
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at: Optional[float] = None
+        self.reserved: int = 0
+        self.unlimited: bool = False
+        self.pending: dict[int, deque[tuple[StreamWriter, int, str]]] = {}
+        self._server: RatelimitServer = server
+        self._pending_reset: bool = False
+
+    @property
+    def idle(self) -> bool:
+        """If no process is using or waiting on this bucket and its ratelimit has reset"""
+        return not self.reserved and not self.pending and not self._pending_reset
+
+    @property
+    def calculated_remaining(self) -> int:
+        if self.remaining is None:
+            if self.unlimited:
+                return 1
+            return 1 - self.reserved  # No data yet, only let one request through to fetch the info.
+        return self.remaining - self.reserved
+
+    def update(self, limit: Optional[int], remaining: int, reset_at: Optional[float]) -> None:
+        self.limit = limit
+        self.reset_at = reset_at
+        self._set_remaining(remaining)
+        self.release()
+
+    def consume(self) -> None:
+        """A request finished. Count it until the process tells us the real remaining count"""
+        self.reserved -= 1
+        if self.remaining is not None:
+            self._set_remaining(max(self.remaining - 1, 0))
+        self.release()
+
+    def _set_remaining(self, remaining: int) -> None:
+        self.remaining = remaining
+        if remaining == 0 and self.reset_at is not None and not self._pending_reset:
+            self._pending_reset = True
+            self._server.loop.call_later(max(self.reset_at - time(), 0), self._reset)
+
+    def _reset(self) -> None:
+        self._pending_reset = False
+        self.remaining = self.limit
+        self.release()
+
+    def add_pending(self, writer: StreamWriter, grant_id: int, pool: str, priority: int) -> None:
+        self.pending.setdefault(priority, deque()).append((writer, grant_id, pool))
+        self.release()
+
+    def remove_pending(self, writer: StreamWriter, grant_id: Optional[int] = None) -> bool:
+        """Remove a pending request, or all of a connection's pending requests if grant_id is None"""
+        removed = False
+        for priority, queue in self.pending.items():
+            kept = deque(pending for pending in queue if pending[0] is not writer or grant_id not in (None, pending[1]))
+            removed = removed or len(kept) != len(queue)
+            self.pending[priority] = kept
+        return removed
+
+    def release(self) -> None:
+        for priority in sorted(self.pending, reverse=True):
+            queue = self.pending[priority]
+            while queue and self.calculated_remaining > 0:
+                writer, grant_id, pool = queue.popleft()
+                self.reserved += 1
+                self._server.grant(self, writer, grant_id, pool)
+            if queue:
+                return
+            del self.pending[priority]
+
+
+class RatelimitServer:
+    """A small daemon holding HTTP ratelimit state for every process connected to it.
+
+    Run it with ``python -m nextcord.core.shared_bucket`` and use :class:`SharedBucket` as your :attr:`TypeSheet.http_bucket`.
+
+    Parameters
+    ----------
+    path: :class:`str`
+        The path of the unix socket to listen on
+    global_ratelimit: :class:`int`
+        How many requests per second all processes combined are allowed to send
+    webhook_global_ratelimit: :class:`int`
+        How many requests per second all processes combined are allowed to send to routes using the webhook global
+    max_buckets: :class:`int`
+        How many ratelimit buckets to keep before removing the least recently used idle ones
+    bucket_ttl: :class:`float`
+        How many seconds an idle bucket is kept after it was last used
+    """
+
+    def __init__(
+        self,
+        path: str = DEFAULT_SOCKET_PATH,
+        *,
+        global_ratelimit: int = 50,
+        webhook_global_ratelimit: int = 50,
+        max_buckets: int = 10_000,
+        bucket_ttl: float = 300,
+    ) -> None:
+        self.path: str = path
+        self.loop = get_event_loop()
+        self.max_buckets: int = max_buckets
+        self.bucket_ttl: float = bucket_ttl
+        # Least recently used first
+        self._buckets: OrderedDict[str, _ServerBucket] = OrderedDict()
+        self._bucket_last_used: dict[str, float] = {}
+        self._global_ratelimiters: dict[str, TokenBucket] = {
+            "global": TokenBucket(global_ratelimit, 1),
+            "webhook": TokenBucket(webhook_global_ratelimit, 1),
+        }
+        # Grants handed out per connection, so we can give them back when the connection drops
+        self._granted: dict[StreamWriter, dict[int, _ServerBucket]] = {}
+        self._server: Optional[AbstractServer] = None
+
+    async def start(self) -> None:
+        """Start listening for connections"""
+        self._server = await start_unix_server(self._handle_connection, self.path)
+
+    async def serve_forever(self) -> None:
+        if self._server is None:
+            await self.start()
+        await self._server.serve_forever()  # type: ignore
+
+    async def close(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def _get_bucket(self, key: str) -> _ServerBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            self._evict_buckets()
+            bucket = _ServerBucket(self, key)
+            self._buckets[key] = bucket
+        else:
+            self._buckets.move_to_end(key)
+        self._bucket_last_used[key] = monotonic()
+        return bucket
+
+    def _evict_buckets(self) -> None:
+        """Remove idle buckets that have not been used for :attr:`bucket_ttl` or that don't fit in :attr:`max_buckets`"""
+        now = monotonic()
+        for _ in range(len(self._buckets)):
+            key, bucket = next(iter(self._buckets.items()))
+            if len(self._buckets) < self.max_buckets and now - self._bucket_last_used[key] < self.bucket_ttl:
+                break  # Every bucket after this one has been used more recently
+            if bucket.idle:
+                del self._buckets[key]
+                del self._bucket_last_used[key]
+            else:
+                # Still in use, check it again later
+                self._buckets.move_to_end(key)
+
+    def lock_global(self, pool: str, retry_after: float) -> None:
+        """Stop handing out spots in a global ratelimit to every process, a process hit it.
+
+        Parameters
+        ----------
+        pool: :class:`str`
+            Which global ratelimit got hit
+        retry_after: :class:`float`
+            How many seconds discord wants us to wait
+        """
+        logger.warning("A process hit the %s ratelimit, pausing every process for %s seconds", pool, retry_after)
+        self._global_ratelimiters[pool].drain(retry_after)
+
+    def grant(self, bucket: _ServerBucket, writer: StreamWriter, grant_id: int, pool: str) -> None:
+        self._granted.setdefault(writer, {})[grant_id] = bucket
+        self.loop.create_task(self._send_grant(writer, grant_id, pool))
+
+    async def _send_grant(self, writer: StreamWriter, grant_id: int, pool: str) -> None:
+        async with self._global_ratelimiters[pool]:
+            if not writer.is_closing():
+                writer.write(_encode({"id": grant_id}))
+
+    def _release(self, writer: StreamWriter, grant_id: int, *, consumed: bool = True) -> None:
+        bucket = self._granted.get(writer, {}).pop(grant_id, None)
+        if bucket is None:
+            return
+        if consumed:
+            bucket.consume()
+        else:
+            # Cancelled before the request was sent
+            bucket.reserved -= 1
+            bucket.release()
+
+    async def _handle_connection(self, reader: StreamReader, writer: StreamWriter) -> None:
+        self._granted[writer] = {}
+        try:
+            while line := await reader.readline():
+                message = json.loads(line)
+                op = message["op"]
+                if op == "acquire":
+                    self._get_bucket(message["key"]).add_pending(
+                        writer, message["id"], message["pool"], message["priority"]
+                    )
+                elif op == "release":
+                    self._release(writer, message["id"])
+                elif op == "cancel":
+                    if not self._get_bucket(message["key"]).remove_pending(writer, message["id"]):
+                        # Already granted
+                        self._release(writer, message["id"], consumed=False)
+                elif op == "update":
+                    self._get_bucket(message["key"]).update(message["limit"], message["remaining"], message["reset_at"])
+                elif op == "unlimited":
+                    bucket = self._get_bucket(message["key"])
+                    bucket.unlimited = message["unlimited"]
+                    bucket.release()
+                elif op == "global":
+                    self.lock_global(message["pool"], message["retry_after"])
+        finally:
+            # Process died, give back everything it was holding
+            for bucket in self._buckets.values():
+                bucket.remove_pending(writer)
+            for bucket in self._granted.pop(writer, {}).values():
+                bucket.reserved -= 1
+                bucket.release()
+            writer.close()
+
+
+def main() -> None:
+    parser = ArgumentParser(description="Share HTTP ratelimits between multiple nextcord processes")
+    parser.add_argument("--path", default=DEFAULT_SOCKET_PATH, help="The unix socket to listen on")
+    parser.add_argument("--global-ratelimit", type=int, default=50, help="Requests per second allowed globally")
+    parser.add_argument("--webhook-global-ratelimit", type=int, default=50, help="Requests per second for webhooks")
+    args = parser.parse_args()
+
+    async def serve() -> None:
+        server = RatelimitServer(
+            args.path,
+            global_ratelimit=args.global_ratelimit,
+            webhook_global_ratelimit=args.webhook_global_ratelimit,
+        )
+        await server.serve_forever()
+
+    run(serve())
+
+
+if __name__ == "__main__":
+    main()
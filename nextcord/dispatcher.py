@@ -50,6 +50,16 @@ class Dispatcher:
         for listener in self.global_listeners:
             self._loop.create_task(listener(event_name, *args))
 
+    def remove_listener(self, listener: Any, event_name: Any = None) -> None:
+        if event_name is None:
+            self.global_listeners.remove(listener)
+        else:
+            self.listeners[event_name].remove(listener)
+
+    def has_listeners(self, event_name: Any) -> bool:
+        """If dispatching this event would call anything. Used to skip work for events nobody listens to"""
+        return bool(self.global_listeners or self.listeners.get(event_name) or self.predicates.get(event_name))
+
     async def _dispatch_predicate(self, predicate_info: Any, event_name: Any, *args: Any) -> None:
         predicate = predicate_info[0]
         listener = predicate_info[1]
@@ -25,3 +25,14 @@ class CloudflareBanException(RatelimitException):
             "You have been banned by Cloudflare. "
             "See https://discord.dev/topics/rate-limits#invalid-request-limit-aka-cloudflare-bans"
         )
+
+
+class InvalidRequestLimitException(RatelimitException):
+    def __init__(self, remaining: int, retry_after: float = 0) -> None:
+        self.remaining = remaining
+        self.retry_after = retry_after
+
+        super().__init__(
+            f"Refusing to send request as only {remaining} invalid requests are left before Cloudflare bans this IP. "
+            "See https://discord.dev/topics/rate-limits#invalid-request-limit-aka-cloudflare-bans"
+        )
@@ -0,0 +1,126 @@
+# The MIT License (MIT)
+#
+# Copyright (c) 2021-present vcokltfre & tag-epic
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the "Software"),
+# to deal in the Software without restriction, including without limitation
+# the rights to use, copy, modify, merge, publish, distribute, sublicense,
+# and/or sell copies of the Software, and to permit persons to whom the
+# Software is furnished to do so, subject to the following conditions:
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER
+# DEALINGS IN THE SOFTWARE.
+
+from __future__ import annotations
+
+from asyncio import get_running_loop
+from os import PathLike, fspath
+from os.path import basename
+from typing import TYPE_CHECKING, cast
+
+from .exceptions import NextcordException
+
+if TYPE_CHECKING:
+    from typing import AsyncIterable, AsyncIterator, BinaryIO, Callable, Optional, Union
+
+    FileSource = Union[str, PathLike[str], BinaryIO, AsyncIterable[bytes], Callable[[], AsyncIterable[bytes]]]
+
+CHUNK_SIZE = 64 * 1024
+
+
+class File:
+    """A file to upload to discord.
+
+    The file is streamed in chunks while uploading instead of being read into memory.
+    If the request has to be retried, paths get reopened and file objects get rewound to where they were when this was created.
+
+    Parameters
+    ----------
+    fp: :class:`Union[str, PathLike, BinaryIO, AsyncIterable[bytes], Callable[[], AsyncIterable[bytes]]]`
+        Where to read the file from. A async iterable can only be sent once, pass a function creating one if it should be retryable.
+    filename: :class:`Optional[str]`
+        The name of the file. Defaults to the name of the path or file object.
+    content_type: :class:`str`
+        The MIME type of the file
+    """
+
+    def __init__(
+        self,
+        fp: FileSource,
+        filename: Optional[str] = None,
+        *,
+        content_type: str = "application/octet-stream",
+    ) -> None:
+        self.fp: FileSource = fp
+        """Where the file is read from"""
+        self.content_type: str = content_type
+        """The MIME type of the file"""
+        self._start_position: Optional[int] = None
+        self._streamed: bool = False
+
+        if isinstance(fp, (str, PathLike)):
+            default_filename: Optional[str] = basename(fspath(fp))
+        elif hasattr(fp, "read"):
+            file = cast("BinaryIO", fp)
+            default_filename = getattr(file, "name", None)
+            if isinstance(default_filename, str):
+                default_filename = basename(default_filename)
+            else:
+                default_filename = None
+            if file.seekable():
+                self._start_position = file.tell()
+        else:
+            default_filename = None
+
+        filename = filename or default_filename
+        if filename is None:
+            raise NextcordException("A filename is required when uploading from a async iterable")
+        self.filename: str = filename
+        """The name of the file"""
+
+    def stream(self) -> AsyncIterable[bytes]:
+        """Get a new stream of the file contents. This is called once per attempt to send it.
+
+        Returns
+        -------
+        AsyncIterable[bytes]
+        """
+        fp = self.fp
+        if isinstance(fp, (str, PathLike)):
+            return self._read_path(fp)
+        if hasattr(fp, "read"):
+            file = cast("BinaryIO", fp)
+            if self._streamed:
+                if self._start_position is None:
+                    raise NextcordException(f"Cannot retry uploading {self.filename} as it is not seekable")
+                file.seek(self._start_position)
+            self._streamed = True
+            return self._read_file(file)
+        if callable(fp):
+            return fp()
+        if self._streamed:
+            raise NextcordException(f"Cannot retry uploading {self.filename} from a async iterable")
+        self._streamed = True
+        return fp
+
+    async def _read_path(self, path: Union[str, PathLike[str]]) -> AsyncIterator[bytes]:
+        loop = get_running_loop()
+        fp = await loop.run_in_executor(None, lambda: open(path, "rb"))
+        try:
+            async for chunk in self._read_file(fp):
+                yield chunk
+        finally:
+            fp.close()
+
+    async def _read_file(self, fp: BinaryIO) -> AsyncIterator[bytes]:
+        loop = get_running_loop()
+        while chunk := await loop.run_in_executor(None, fp.read, CHUNK_SIZE):
+            yield chunk
@@ -0,0 +1,629 @@
+import os
+import signal
+import time
+import zlib
+from asyncio import Event, gather, get_running_loop, run, sleep, wait_for
+from collections import OrderedDict
+from multiprocessing import get_context
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from types import SimpleNamespace
+
+from nextcord import Intents
+from nextcord.core.gateway import etf
+from nextcord.core.gateway.cluster import (
+    ClusterConnection,
+    ClusterCoordinator,
+    ShardCluster,
+)
+from nextcord.core.gateway.enums import OpcodeEnum
+from nextcord.core.gateway.exceptions import BadDataException, PartialDataException
+from nextcord.core.gateway.gateway import Gateway
+from nextcord.core.gateway.identify import (
+    IdentifyConnection,
+    IdentifyScheduler,
+    IdentifyServer,
+)
+from nextcord.core.gateway.session import FileSessionStore, Session, SqliteSessionStore
+from nextcord.core.gateway.shard import Shard
+from nextcord.core.gateway.startup import ShardStartup
+from nextcord.dispatcher import Dispatcher
+from nextcord.exceptions import NextcordException
+from nextcord.utils import json
+
+
+def test_decompress_whole_and_fragmented_frames():
+    async def inner():
+        shard = Shard(SimpleNamespace(loop=get_running_loop()), 0)  # type: ignore
+        compressor = zlib.compressobj()
+        payloads = [{"op": 0, "s": seq, "t": "TEST", "d": "x" * seq * 1000} for seq in range(5)]
+        received = []
+        for seq, payload in enumerate(payloads):
+            data = json.dumps(payload)
+            if isinstance(data, str):
+                data = data.encode("utf-8")
+            compressed = compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            # Odd messages get split over 3 frames
+            parts = 3 if seq % 2 else 1
+            size = len(compressed) // parts + 1
+            for start in range(0, len(compressed), size):
+                try:
+                    received.append(json.loads(shard._decompress(compressed[start : start + size])))
+                except PartialDataException:
+                    pass
+        assert received == payloads
+        assert shard._buffer_size == 0
+
+        try:
+            shard._decompress(b"garbage\x00\x00\xff\xff")
+        except BadDataException:
+            pass
+        else:
+            raise AssertionError("Corrupted data should be rejected")
+
+    run(inner())
+
+
+def test_etf_decodes_to_json_shapes():
+    payload = {
+        "op": 0,
+        "s": 123456,
+        "t": "MESSAGE_CREATE",
+        "d": {
+            "id": 10**17,
+            "content": "h\u00e9llo",
+            "nonce": None,
+            "tts": False,
+            "pinned": True,
+            "embeds": [],
+            "mention_roles": [10**17 + 1, 10**17 + 2],
+            "flags": -5,
+            "position": 2**40,
+            "ratio": 0.5,
+        },
+    }
+    expected = json.loads(
+        '{"op": 0, "s": 123456, "t": "MESSAGE_CREATE", "d": {"id": "100000000000000000", "content": "h\u00e9llo", '
+        '"nonce": null, "tts": false, "pinned": true, "embeds": [], '
+        '"mention_roles": ["100000000000000001", "100000000000000002"], "flags": -5, "position": 1099511627776, '
+        '"ratio": 0.5}}'
+    )
+    assert etf.decode(etf.encode(payload)) == expected
+
+    # Discord sends these for lists of small integers
+    assert etf.decode(bytes((131, 107, 0, 3, 1, 2, 3))) == [1, 2, 3]
+
+    # A map with a empty list as a key
+    unhashable_key = bytes((131, 116, 0, 0, 0, 1, 106, 97, 1))
+    for data in (b"", b"\x83", json.dumps(payload), etf.encode(payload)[:-1], unhashable_key):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        try:
+            etf.decode(data)
+        except BadDataException:
+            pass
+        else:
+            raise AssertionError(f"{data!r} should be rejected")
+
+
+def test_shard_encoding_options():
+    async def inner():
+        state = SimpleNamespace(loop=get_running_loop())
+        shard = Shard(state, 0, encoding="etf", compression=None)  # type: ignore
+        assert shard._gateway_url == "wss://gateway.discord.gg?v=9&encoding=etf"
+        assert shard._loads(etf.encode({"op": 11, "d": None})) == {"op": 11, "d": None}
+
+        shard = Shard(state, 0)  # type: ignore
+        assert shard._gateway_url == "wss://gateway.discord.gg?v=9&encoding=json&compress=zlib-stream"
+
+        try:
+            Shard(state, 0, encoding="xml")  # type: ignore
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Unknown encodings should be rejected")
+
+    run(inner())
+
+
+def test_lazy_dispatch_only_parses_listened_events():
+    async def inner():
+        gateway = SimpleNamespace(
+            event_dispatcher=Dispatcher(),
+            raw_dispatcher=Dispatcher(),
+            raw_event_dispatcher=Dispatcher(),
+            should_dispatch=lambda *_: True,
+        )
+        state = SimpleNamespace(loop=get_running_loop(), gateway=gateway)
+        shard = Shard(state, 0, lazy_dispatch=True)  # type: ignore
+        parsed = []
+        loads = shard._loads
+        shard._loads = lambda data: parsed.append(data) or loads(data)
+
+        received = []
+
+        async def on_message(_, data):
+            received.append(("MESSAGE_CREATE", data))
+
+        async def on_raw_typing(_, data):
+            received.append(("TYPING_START", data))
+
+        gateway.event_dispatcher.add_listener(on_message, "MESSAGE_CREATE")
+        gateway.raw_event_dispatcher.add_listener(on_raw_typing, "TYPING_START")
+
+        shard._handle_payload(b'{"t":"MESSAGE_CREATE","s":1,"op":0,"d":{"id":"1","content":"hi"}}')
+        shard._handle_payload(b'{"t":"PRESENCE_UPDATE","s":2,"op":0,"d":{"user":{"id":"2"}}}')
+        shard._handle_payload(b'{"t":"TYPING_START","s":3,"op":0,"d":{"channel_id":"3"}}')
+        for _ in range(3):
+            await sleep(0)
+
+        assert len(received) == 2
+        assert ("MESSAGE_CREATE", {"id": "1", "content": "hi"}) in received
+        assert ("TYPING_START", b'{"channel_id":"3"}') in received
+        assert len(parsed) == 1
+        assert shard._seq == 3
+
+        # Anything else is parsed like normal
+        shard._handle_payload(b'{"op": 0, "d": {"id": "4"}, "s": 4, "t": "MESSAGE_CREATE"}')
+        for _ in range(3):
+            await sleep(0)
+        assert received[-1] == ("MESSAGE_CREATE", {"id": "4"})
+
+    run(inner())
+
+
+def test_identify_scheduler_spaces_buckets():
+    async def inner():
+        scheduler = IdentifyScheduler(2, interval=0.2)
+        started = perf_counter()
+        identified_at = {}
+
+        async def identify(shard_id):
+            async with scheduler.slot(shard_id):
+                identified_at[shard_id] = perf_counter() - started
+                await sleep(0.05)
+
+        await gather(*(identify(shard_id) for shard_id in range(4)))
+        # Different buckets do not wait on each other
+        assert identified_at[0] < 0.05 and identified_at[1] < 0.05
+        # The same bucket waits for the interval after the last identify finished
+        assert identified_at[2] >= 0.25 and identified_at[3] >= 0.25
+
+    run(inner())
+
+
+def test_identify_server_shares_buckets_between_hosts():
+    async def inner():
+        server = IdentifyServer("tcp://127.0.0.1:0", interval=0.2)
+        await server.start()
+        host_a = IdentifyConnection(server.address)
+        host_b = IdentifyConnection(server.address)
+        # The first gateway tells the server about max_concurrency
+        await host_a.connect(max_concurrency=1, shard_ids=[0, 2])
+        await host_b.connect(max_concurrency=1, shard_ids=[1, 3])
+        await sleep(0.01)
+        assert server.scheduler.max_concurrency == 1
+
+        started = perf_counter()
+        async with host_a.slot(0):
+            await sleep(0.1)
+        async with host_b.slot(1):
+            assert perf_counter() - started >= 0.3
+
+        # Slots held by a host that goes away are given back
+        slot = host_a.slot(2)
+        await slot.__aenter__()
+        await host_a.close()
+        await wait_for(host_b.slot(3).__aenter__(), 1)
+
+        await host_b.close()
+        await server.close()
+
+    run(inner())
+
+
+def test_identify_connection_reconnects_after_server_restart():
+    async def inner():
+        server = IdentifyServer("tcp://127.0.0.1:0", interval=0)
+        await server.start()
+        connection = IdentifyConnection(server.address, reconnect_delay=0.05)
+        await connection.connect(max_concurrency=2, shard_ids=[0, 1])
+        async with connection.slot(0):
+            pass
+
+        await server.close()
+        await sleep(0.01)
+        # Identifying while the server is down waits for it to come back
+        slot = get_running_loop().create_task(connection.slot(1).__aenter__())
+        await sleep(0.1)
+        assert not slot.done()
+        restarted = IdentifyServer(server.address, interval=0)
+        await restarted.start()
+        await wait_for(slot, 1)
+        assert restarted.scheduler.max_concurrency == 2, "The hello should be sent again"
+
+        await connection.close()
+        await restarted.close()
+
+    run(inner())
+
+
+def test_cluster_forwards_events():
+    async def inner():
+        with TemporaryDirectory() as directory:
+            path = f"{directory}/cluster.sock"
+            coordinator = ClusterCoordinator(path, max_concurrency=2)
+            await coordinator.start()
+            connection = ClusterConnection(path)
+            await connection.connect(shard_ids=[0, 1])
+
+            received = []
+
+            async def on_message(shard_id, data):
+                received.append((shard_id, data))
+
+            async def on_raw_message(shard_id, data):
+                received.append((shard_id, data))
+
+            coordinator.event_dispatcher.add_listener(on_message, "MESSAGE_CREATE")
+            coordinator.raw_event_dispatcher.add_listener(on_raw_message, "MESSAGE_CREATE")
+
+            # Identifies go through the coordinator
+            await wait_for(connection.slot(1).__aenter__(), 1)
+
+            connection.forward("MESSAGE_CREATE", 1, b'{"id":"1"}')
+            connection.forward("TYPING_START", 1, b'{"id":"2"}')
+            for _ in range(10):
+                await sleep(0.01)
+            assert sorted(received, key=repr) == [(1, b'{"id":"1"}'), (1, {"id": "1"})]
+
+            await connection.close()
+            await coordinator.close()
+
+    run(inner())
+
+
+def test_cluster_shard_ranges():
+    async def inner():
+        cluster = ShardCluster("token", Intents(), processes=3)
+        assert cluster.shard_ranges(list(range(8))) == [[0, 1], [2, 3, 4], [5, 6, 7]]
+        assert cluster.shard_ranges([4, 5]) == [[4], [5]]
+
+    run(inner())
+
+
+def test_cluster_closes_workers_gracefully():
+    def worker(directory):
+        # Forked from inside asyncio.run, which replaced the handler. Spawned workers start with the default one
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        open(f"{directory}/started", "w").close()
+        try:
+            time.sleep(10)
+        except KeyboardInterrupt:
+            open(f"{directory}/closed", "w").close()
+
+    async def inner():
+        with TemporaryDirectory() as directory:
+            cluster = ShardCluster("token", Intents(), processes=1)
+            process = get_context("fork").Process(target=worker, args=(directory,))
+            process.start()
+            cluster.processes.append(process)
+            while not os.path.exists(f"{directory}/started"):
+                await sleep(0.01)
+
+            await wait_for(cluster.close(timeout=5), 5)
+            assert os.path.exists(f"{directory}/closed"), "The worker should get to clean up"
+            assert not cluster.processes
+
+    run(inner())
+
+
+def test_startup_orders_identifies_and_tracks_readiness():
+    async def inner():
+        scheduler = IdentifyScheduler(2, interval=0.05)
+        dispatcher = Dispatcher()
+        identified = []
+
+        class FakeShard:
+            def __init__(self, shard_id):
+                self.shard_id = shard_id
+                self.ready = Event()
+                self.session = None
+
+            async def connect(self):
+                async with scheduler.slot(self.shard_id):
+                    identified.append(self.shard_id)
+                self.ready.set()
+
+        shards = [FakeShard(shard_id) for shard_id in (3, 0, 5, 1, 4, 2)]
+        startup = ShardStartup(guild_timeout=0.2)
+        await startup.run(shards, 2, dispatcher)  # type: ignore
+        assert startup.identified == 6
+        # Each bucket goes in order, one shard per bucket at a time
+        assert identified[:2] in ([0, 1], [1, 0])
+        assert [shard_id for shard_id in identified if shard_id % 2 == 0] == [0, 2, 4]
+        assert [shard_id for shard_id in identified if shard_id % 2 == 1] == [1, 3, 5]
+
+        for shard in shards:
+            dispatcher.dispatch("READY", shard, {"guilds": [{"id": f"{shard.shard_id}-{i}"} for i in range(2)]})
+        for shard in shards:
+            dispatcher.dispatch("GUILD_CREATE", shard, {"id": f"{shard.shard_id}-0"})
+        await sleep(0.01)
+        assert (startup.ready, startup.guilds_expected, startup.guilds_received) == (6, 12, 6)
+        assert not startup.done
+
+        for shard in shards[:-1]:
+            dispatcher.dispatch("GUILD_CREATE", shard, {"id": f"{shard.shard_id}-1"})
+        # The last shard has a guild which stays unavailable
+        await wait_for(startup.wait(), 1)
+        assert startup.guilds_received == 11
+        assert not dispatcher.has_listeners("GUILD_CREATE")
+
+    run(inner())
+
+
+def test_startup_finishes_when_a_shard_fails():
+    async def inner():
+        dispatcher = Dispatcher()
+
+        class FakeShard:
+            def __init__(self, shard_id, session=None):
+                self.shard_id = shard_id
+                self.ready = Event()
+                self.session = session
+
+            async def connect(self):
+                if self.shard_id == 0:
+                    self.ready.set()
+                    dispatcher.dispatch("READY", self, {"guilds": []})
+
+        # Shard 1 never identifies and shard 2 never resumes
+        shards = [FakeShard(0), FakeShard(1), FakeShard(2, Session("a", 1, None, 3))]
+        startup = ShardStartup(identify_timeout=0.05)
+        await wait_for(startup.run(shards, 1, dispatcher), 1)  # type: ignore
+        await wait_for(startup.wait(), 1)
+        assert (startup.ready, startup.failed) == (1, {1, 2})
+
+    run(inner())
+
+
+def test_session_stores_keep_sessions_per_shard():
+    async def inner():
+        with TemporaryDirectory() as directory:
+            for store in (
+                FileSessionStore(f"{directory}/sessions.json"),
+                SqliteSessionStore(f"{directory}/sessions.db"),
+            ):
+                assert await store.load() == {}
+                await store.save({0: Session("a", 10, "wss://resume", 2), 1: Session("b", None, None, 2)})
+                # Saving some shards leaves the others alone
+                await store.save({1: Session("c", 5, "wss://resume", 2)})
+                sessions = await store.load()
+                assert sorted(sessions) == [0, 1]
+                assert sessions[0].to_dict() == Session("a", 10, "wss://resume", 2).to_dict()
+                assert sessions[1].to_dict() == Session("c", 5, "wss://resume", 2).to_dict()
+
+    run(inner())
+
+
+def test_shard_resumes_saved_session():
+    async def inner():
+        gateway = SimpleNamespace(
+            shard_count=2, event_dispatcher=Dispatcher(), raw_dispatcher=Dispatcher(), should_dispatch=lambda *_: True
+        )
+        state = SimpleNamespace(loop=get_running_loop(), gateway=gateway)
+        shard = Shard(state, 1)  # type: ignore
+        assert shard.session is None
+        await shard._handle_ready({"session_id": "a", "resume_gateway_url": "wss://resume.discord.gg"})
+        shard._set_sequence(42)
+        assert shard.session.to_dict() == Session("a", 42, "wss://resume.discord.gg", 2).to_dict()  # type: ignore
+
+        # A new shard after a restart resumes where the old one left off
+        restarted = Shard(state, 1)  # type: ignore
+        restarted.session = shard.session
+        sent = []
+        opened = []
+
+        async def send(data):
+            sent.append(data)
+
+        async def ws_connect(url):
+            opened.append(url)
+            return SimpleNamespace()
+
+        restarted._send = send  # type: ignore
+        restarted._receive_loop = lambda: sleep(0)  # type: ignore
+        state.http = SimpleNamespace(ws_connect=ws_connect)
+        state.token = "token"
+        await restarted.connect()
+        assert opened == ["wss://resume.discord.gg?v=9&encoding=json&compress=zlib-stream"]
+        assert sent[-1]["op"] == OpcodeEnum.RESUME and sent[-1]["d"]["seq"] == 42
+        restarted._dispatch({"op": 0, "s": 43, "t": "RESUMED", "d": {}})
+        await sleep(0)
+        assert restarted.ready.is_set()
+
+    run(inner())
+
+
+def test_startup_counts_resumed_shards():
+    async def inner():
+        dispatcher = Dispatcher()
+        connected = []
+
+        class FakeShard:
+            def __init__(self, shard_id):
+                self.shard_id = shard_id
+                self.ready = Event()
+                self.session = Session("a", 1, None, 2)
+
+            async def connect(self):
+                connected.append(self.shard_id)
+
+        shards = [FakeShard(0), FakeShard(1)]
+        startup = ShardStartup()
+        # Resuming shards do not wait for each other
+        await wait_for(startup.run(shards, 1, dispatcher), 1)  # type: ignore
+        await sleep(0)
+        assert sorted(connected) == [0, 1]
+        for shard in shards:
+            dispatcher.dispatch("RESUMED", shard, {})
+        await wait_for(startup.wait(), 1)
+        assert (startup.resumed, startup.ready) == (2, 2)
+
+    run(inner())
+
+
+def test_rescale_switches_shard_sets_without_duplicates():
+    async def inner():
+        closed = []
+        sent = []
+
+        class FakeShard:
+            def __init__(self, state, shard_id, *, shard_count, **_):
+                self.shard_id = shard_id
+                self.shard_count = shard_count
+                self.ready = Event()
+                self.session = None
+
+            async def connect(self):
+                self.ready.set()
+
+            async def send(self, data):
+                sent.append((self.shard_id, self.shard_count, data))
+
+            async def close(self, code=1000):
+                closed.append(self)
+
+        state = SimpleNamespace(loop=get_running_loop(), type_sheet=SimpleNamespace(shard=FakeShard))
+        gateway = Gateway(state, rescale_overlap=0.2)  # type: ignore
+        gateway.shard_count = 1
+        gateway._max_concurrency = 1
+        old = FakeShard(state, 0, shard_count=1)
+        gateway.shards = [old]  # type: ignore
+
+        task = get_running_loop().create_task(gateway.rescale(2))
+        await sleep(0.01)
+        new = gateway._pending_shard_set
+        assert len(new) == 2 and gateway.shards == [old]
+
+        # The old set keeps serving until the new one is ready
+        assert gateway.should_dispatch(old, "MESSAGE_CREATE", {"id": "1"})
+        assert gateway.should_dispatch(old, "MESSAGE_CREATE", {"id": "1"}), "Only the new set is deduplicated"
+        assert not gateway.should_dispatch(new[0], "MESSAGE_CREATE", {"id": "1"})
+        for shard in new:
+            assert not gateway.should_dispatch(shard, "READY", {"guilds": []})
+        await sleep(0.01)
+        assert gateway.shards == new and gateway.shard_count == 2
+
+        # Both sets run for a bit, events only go out once
+        assert gateway.should_dispatch(old, "MESSAGE_CREATE", b'{"id":"2","content":"a"}')
+        assert not gateway.should_dispatch(new[1], "MESSAGE_CREATE", memoryview(b'{"content":"a","id":"2"}'))
+        assert gateway.should_dispatch(new[0], "MESSAGE_CREATE", {"id": "3"})
+        assert not gateway.should_dispatch(old, "MESSAGE_CREATE", {"id": "3"})
+        # The same payload twice on one set is two events
+        for _ in range(2):
+            assert gateway.should_dispatch(old, "PRESENCE_UPDATE", {"user": {"id": "4"}, "status": "online"})
+        for _ in range(2):
+            assert not gateway.should_dispatch(new[0], "PRESENCE_UPDATE", {"user": {"id": "4"}, "status": "online"})
+        assert gateway.should_dispatch(new[0], "PRESENCE_UPDATE", {"user": {"id": "4"}, "status": "online"})
+
+        await wait_for(task, 1)
+        assert gateway._recent_events is None, "Deduplication should stop with the overlap"
+        assert closed == [old]
+        assert not gateway.should_reconnect(old)  # type: ignore
+        assert gateway.should_reconnect(new[0])
+        await gateway.send({"op": 1, "d": None}, shard_id=1)
+        assert sent == [(1, 2, {"op": 1, "d": None})], "Messages should be sent on the new set"
+
+    run(inner())
+
+
+def test_rescale_keeps_old_shards_when_new_ones_fail():
+    async def inner():
+        closed = []
+
+        class FakeShard:
+            def __init__(self, state, shard_id, *, shard_count, **_):
+                self.shard_id = shard_id
+                self.shard_count = shard_count
+                self.ready = Event()
+                self.session = None
+
+            async def connect(self):
+                pass  # Never becomes ready
+
+            async def close(self, code=1000):
+                closed.append(self)
+
+        state = SimpleNamespace(loop=get_running_loop(), type_sheet=SimpleNamespace(shard=FakeShard))
+        gateway = Gateway(state, rescale_timeout=0.05)  # type: ignore
+        gateway.shard_count = 1
+        gateway._max_concurrency = 1
+        old = FakeShard(state, 0, shard_count=1)
+        gateway.shards = [old]  # type: ignore
+
+        try:
+            await wait_for(gateway.rescale(2), 1)
+        except NextcordException:
+            pass
+        else:
+            raise AssertionError("Rescaling should fail")
+        assert gateway.shards == [old] and gateway.shard_count == 1
+        assert len(closed) == 2 and old not in closed
+        assert gateway.should_reconnect(old)  # type: ignore
+
+        # Updates of the same object are not duplicates of each other
+        gateway._recent_events = OrderedDict()
+        new = FakeShard(state, 0, shard_count=2)
+        events = [
+            ("MESSAGE_REACTION_ADD", {"message_id": "1", "user_id": "2", "emoji": {"name": "a"}}),
+            ("MESSAGE_REACTION_ADD", {"message_id": "1", "user_id": "2", "emoji": {"name": "b"}}),
+            ("GUILD_ROLE_UPDATE", {"guild_id": "1", "role": {"id": "2", "name": "a"}}),
+            ("GUILD_ROLE_UPDATE", {"guild_id": "1", "role": {"id": "3", "name": "a"}}),
+            ("PRESENCE_UPDATE", {"user": {"id": "1"}, "status": "online"}),
+            ("PRESENCE_UPDATE", {"user": {"id": "1"}, "status": "idle"}),
+        ]
+        for event_name, data in events:
+            assert gateway.should_dispatch(old, event_name, data)
+        for event_name, data in events:
+            payload = json.dumps(data)
+            if isinstance(payload, str):
+                payload = payload.encode("utf-8")
+            assert not gateway.should_dispatch(new, event_name, payload)
+
+    run(inner())
+
+
+def test_heartbeat_latency_and_zombie_detection():
+    async def inner():
+        state = SimpleNamespace(loop=get_running_loop())
+        shard = Shard(state, 0, heartbeat_timeout=0.05)  # type: ignore
+        closed = []
+        heartbeats = []
+
+        class FakeWebSocket:
+            closed = False
+
+            async def close(self, code):
+                closed.append(code)
+                self.closed = True
+
+        async def send(data):
+            heartbeats.append(data)
+            if len(heartbeats) == 1:
+                await sleep(0.01)
+                await shard._handle_heartbeat_ack({"op": OpcodeEnum.HEARTBEAT_ACK})
+
+        shard._send = send  # type: ignore
+        shard._ws = FakeWebSocket()  # type: ignore
+        # The first heartbeat gets an ACK, the second does not and the connection is closed well before the interval
+        await wait_for(shard._heartbeat_loop(0.1), 0.5)
+        assert len(heartbeats) == 2
+        assert closed == [1008]
+        assert shard.latency is not None and 0.01 <= shard.latency < 0.05
+
+        health = shard.health()
+        assert (health.shard_id, health.connected, health.reconnects, health.last_event_age) == (0, False, 0, None)
+        assert health.latency == shard.latency
+
+    run(inner())
@@ -0,0 +1,778 @@
+from asyncio import (
+    TimeoutError,
+    create_task,
+    gather,
+    get_running_loop,
+    run,
+    sleep,
+    wait_for,
+)
+from io import BytesIO
+from time import perf_counter, time
+from types import SimpleNamespace
+
+from aiohttp import ClientSession, web
+from aiohttp.test_utils import TestServer
+
+from benchmarks.http_throughput import Scenario, run_scenario
+from benchmarks.mock_discord import MockDiscord
+from nextcord import File
+from nextcord.core.http import Bucket, HTTPClient, Route, RouteTemplate
+from nextcord.core.http_cache import ResponseCache
+from nextcord.core.http_metrics import HTTPMetrics
+from nextcord.core.http_proxy import ProxiedRoute, RatelimitProxy
+from nextcord.core.ratelimiter import InvalidRequestTracker, TokenBucket
+from nextcord.core.retry import RetryPolicy
+from nextcord.exceptions import HTTPException, InvalidRequestLimitException
+from nextcord.type_sheet import TypeSheet
+
+
+def make_client() -> HTTPClient:
+    state = SimpleNamespace(type_sheet=TypeSheet.default(), token=None, loop=get_running_loop())
+    return HTTPClient(state)  # type: ignore
+
+
+async def start_server(handler) -> TestServer:
+    app = web.Application()
+    app.router.add_route("*", "/{tail:.*}", handler)
+    server = TestServer(app)
+    await server.start_server()
+    return server
+
+
+def test_routes_with_same_hash_share_bucket():
+    async def handler(request: web.Request) -> web.Response:
+        headers = {
+            "X-RateLimit-Bucket": "abc",
+            "X-RateLimit-Limit": "5",
+            "X-RateLimit-Remaining": "4",
+            "X-RateLimit-Reset": "9999999999",
+        }
+        return web.json_response({}, headers=headers)
+
+    async def inner():
+        server = await start_server(handler)
+        http = make_client()
+        http.api_base = str(server.make_url(""))
+        try:
+            await http.request(Route("GET", "/channels/{channel_id}/a", channel_id=1))
+            await http.request(Route("GET", "/channels/{channel_id}/b", channel_id=1))
+            assert list(http._buckets.keys()) == ["abc:None:1:None:None"], "Routes with the same hash should share"
+            assert (
+                http._get_bucket(Route("GET", "/channels/{channel_id}/b", channel_id=1))
+                is http._buckets["abc:None:1:None:None"]
+            )
+            assert (
+                http._get_bucket(Route("GET", "/channels/{channel_id}/a", channel_id=2))
+                is not http._buckets["abc:None:1:None:None"]
+            )
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_pending_requests_migrate_to_shared_bucket():
+    async def inner():
+        http = make_client()
+        shared_route = Route("GET", "/channels/{channel_id}/a", channel_id=1)
+        temporary_route = Route("GET", "/channels/{channel_id}/b", channel_id=1)
+        http._learn_bucket_hash(shared_route, "abc")
+        shared = http._get_bucket(shared_route)
+        temporary = http._get_bucket(temporary_route)
+
+        temporary.reset_at = 9999999999
+        temporary.limit = 1
+        temporary.remaining = 0
+        entered = []
+
+        async def waiter():
+            async with temporary:
+                entered.append(http._get_bucket(temporary_route))
+
+        waiter_task = create_task(waiter())
+        await sleep(0)
+        assert not entered, "Bucket should be exhausted"
+
+        http._learn_bucket_hash(temporary_route, "abc")
+        await waiter_task
+        assert entered == [shared], "Pending request should be released and resolve to the shared bucket"
+        await http.close()
+
+    run(inner())
+
+
+def test_global_ratelimit_pauses_requests():
+    calls = 0
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal calls
+        calls += 1
+        if calls == 1:
+            headers = {"X-RateLimit-Global": "true", "Retry-After": "0.2", "Via": "1.1 google"}
+            return web.json_response({"global": True, "retry_after": 0.2}, status=429, headers=headers)
+        return web.json_response({})
+
+    async def inner():
+        server = await start_server(handler)
+        http = make_client()
+        http.api_base = str(server.make_url(""))
+        try:
+            started_at = perf_counter()
+            await http.request(Route("GET", "/gateway/bot"))
+            assert perf_counter() - started_at >= 0.2, "Retry should wait for the global ratelimit to clear"
+            assert http._global_unlocked.is_set()
+            assert calls == 2
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_shared_bucket_waits_across_connections(tmp_path):
+    from nextcord.core.shared_bucket import RatelimitServer, SharedBucket
+
+    async def inner():
+        path = str(tmp_path / "ratelimit.sock")
+        server = RatelimitServer(path)
+        await server.start()
+        bucket_type = SharedBucket.with_socket_path(path)
+        route = Route("GET", "/channels/{channel_id}", channel_id=1)
+        first = bucket_type(route, "abc:None:1:None:None")
+        second = bucket_type(route, "abc:None:1:None:None")
+        try:
+            async with first:
+                pass
+            first.reset_at = time() + 0.2
+            first.limit = 1
+            first.remaining = 0
+
+            started_at = perf_counter()
+            async with second:
+                pass
+            assert perf_counter() - started_at >= 0.15, "Second bucket should wait for the shared reset"
+        finally:
+            await first._connection.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_shared_global_ratelimit_pauses_every_process(tmp_path):
+    from nextcord.core.shared_bucket import RatelimitServer, SharedBucket
+
+    async def inner():
+        path = str(tmp_path / "ratelimit.sock")
+        server = RatelimitServer(path, bucket_ttl=0)
+        await server.start()
+        bucket_type = SharedBucket.with_socket_path(path)
+        first = bucket_type(Route("GET", "/channels/{channel_id}", channel_id=1), "abc:None:1:None:None")
+        second = bucket_type(Route("GET", "/channels/{channel_id}", channel_id=2), "abc:None:2:None:None")
+        try:
+            async with first:
+                pass
+            first.lock_global(0.2)
+
+            started_at = perf_counter()
+            async with second:
+                pass
+            assert perf_counter() - started_at >= 0.15, "Other buckets should wait out the global ratelimit"
+            # Idle buckets past their ttl get removed when a new one is created
+            assert list(server._buckets) == ["abc:None:2:None:None"]
+        finally:
+            await first._connection.close()
+            await server.close()
+
+        # Losing the server should not break the request that was being handled
+        first.reset_at = time() + 0.2
+        first.limit = 1
+        first.remaining = 0
+
+    run(inner())
+
+
+def test_token_bucket_never_bursts_over_the_limit():
+    async def inner():
+        limit, per = 10, 0.5
+        ratelimiter = TokenBucket(limit, per)
+        sent_at = []
+
+        async def request():
+            async with ratelimiter:
+                sent_at.append(perf_counter())
+
+        await request()
+        # A fixed window would reset at 0.5s and let a second full burst through right after this one
+        await sleep(per * 0.94)
+        await gather(*(request() for _ in range(limit * 2)))
+        burst_start = sent_at[1]
+        in_burst = [at for at in sent_at[1:] if at - burst_start < per * 0.08]
+        assert len(in_burst) <= limit, f"{len(in_burst)} requests went through at once"
+        # The rest trickle out as the bucket refills
+        assert sent_at[-1] - burst_start >= (limit - 1) / limit * per
+
+    run(inner())
+
+
+def test_bucket_releases_higher_priority_first():
+    async def inner():
+        route = Route("GET", "/channels/{channel_id}", channel_id=1)
+        bucket = Bucket(route, route.bucket)
+        bucket.reset_at = time() + 0.05
+        bucket.limit = 1
+        bucket.remaining = 0
+        order = []
+
+        async def request(name, priority):
+            await bucket.acquire(priority)
+            order.append(name)
+            await bucket.release()
+
+        tasks = [create_task(request("bulk", 0)), create_task(request("interaction", 10))]
+        await sleep(0)
+        await gather(*tasks)
+        assert order == ["interaction", "bulk"], "Higher priority should skip the queue"
+
+    run(inner())
+
+
+def test_new_bucket_lets_one_request_through():
+    async def inner():
+        route = Route("GET", "/channels/{channel_id}", channel_id=1)
+        bucket = Bucket(route, route.bucket)
+        sent = []
+
+        async def request(name):
+            await bucket.acquire()
+            sent.append(name)
+
+        tasks = [create_task(request(name)) for name in range(4)]
+        await sleep(0)
+        assert sent == [0], "Only one request should go out before the limits are known"
+
+        # The first response says 2 more fit
+        await bucket.release()
+        bucket.reset_at = time() + 10
+        bucket.limit = 3
+        bucket.remaining = 2
+        await sleep(0)
+        assert sorted(sent) == [0, 1, 2]
+        for task in tasks:
+            task.cancel()
+
+    run(inner())
+
+
+def test_limit_one_bucket_waits_for_the_new_window():
+    window_end = 0.0
+    remaining = 0
+    statuses = []
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal window_end, remaining
+        now = time()
+        if now >= window_end:
+            window_end = now + 0.2
+            remaining = 1
+        status = 200 if remaining else 429
+        remaining = max(remaining - 1, 0)
+        statuses.append(status)
+        headers = {
+            "X-RateLimit-Bucket": "abc",
+            "X-RateLimit-Limit": "1",
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": str(window_end),
+            "Retry-After": f"{window_end - now:.3f}",
+            "via": "1.1 google",
+        }
+        return web.json_response({}, status=status, headers=headers)
+
+    async def inner():
+        server = await start_server(handler)
+        http = make_client()
+        http.api_base = str(server.make_url(""))
+        route = Route("GET", "/channels/{channel_id}", channel_id=1)
+        try:
+            for _ in range(4):
+                r = await http.request(route)
+                r.release()
+            # The reset scheduled from the stale reset time of the last window has to be replaced
+            assert statuses == [200] * 4
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_routes_without_ratelimits_stop_waiting():
+    in_flight = 0
+    most_in_flight = 0
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal in_flight, most_in_flight
+        in_flight += 1
+        most_in_flight = max(most_in_flight, in_flight)
+        await sleep(0.05)
+        in_flight -= 1
+        return web.json_response({})
+
+    async def inner():
+        server = await start_server(handler)
+        http = make_client()
+        http.api_base = str(server.make_url(""))
+        route = Route("GET", "/gateway")
+        try:
+            await gather(*(http.request(route) for _ in range(5)))
+            # The first response has no ratelimit headers, the rest go out together
+            assert most_in_flight == 4
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_idle_buckets_get_evicted():
+    async def inner():
+        http = make_client()
+        http.max_buckets = 2
+        busy_route = Route("GET", "/channels/{channel_id}", channel_id=0)
+        busy = http._get_bucket(busy_route)
+        await busy.acquire()
+        for channel_id in range(1, 5):
+            http._get_bucket(Route("GET", "/channels/{channel_id}", channel_id=channel_id))
+
+        assert http.bucket_count == 2
+        assert http.bucket_evictions == 3
+        assert http._buckets[busy_route.bucket] is busy, "Buckets in use should never be evicted"
+        await busy.release()
+        await http.close()
+
+    run(inner())
+
+
+def test_identical_gets_are_coalesced():
+    calls = 0
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal calls
+        calls += 1
+        await sleep(0.05)
+        return web.json_response({"id": request.query.get("id")})
+
+    async def inner():
+        server = await start_server(handler)
+        http = make_client()
+        http.api_base = str(server.make_url(""))
+        http.coalesce_requests = True
+        try:
+            route = Route("GET", "/guilds/{guild_id}", guild_id=1)
+            responses = await gather(*[http.request(route, params={"id": "1"}) for _ in range(5)])
+            assert calls == 1, "Identical requests should share one request"
+            assert [await r.json() for r in responses] == [{"id": "1"}] * 5
+
+            await gather(http.request(route, params={"id": "1"}), http.request(route, params={"id": "2"}))
+            assert calls == 3, "Requests with different queries should not be coalesced"
+            assert not http._inflight_requests
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_cached_responses_skip_requests():
+    calls = 0
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal calls
+        calls += 1
+        if request.headers.get("If-None-Match") == '"v1"':
+            return web.Response(status=304)
+        return web.json_response({"calls": calls}, headers={"ETag": '"v1"'})
+
+    async def inner():
+        server = await start_server(handler)
+        cache = ResponseCache({"/guilds/{guild_id}/roles": 60})
+        http = make_client()
+        http.api_base = str(server.make_url(""))
+        http.cache = cache
+        try:
+            route = Route("GET", "/guilds/{guild_id}/roles", guild_id=1)
+            assert await (await http.request(route)).json() == {"calls": 1}
+            assert await (await http.request(route)).json() == {"calls": 1}
+            assert calls == 1, "Fresh cached responses should not be requested"
+
+            cache.get(route, "/guilds/1/roles").expires_at = 0
+            assert await (await http.request(route)).json() == {"calls": 1}
+            assert calls == 2, "Stale responses should be revalidated"
+
+            cache.invalidate("/guilds/1")
+            assert cache.get(route, "/guilds/1/roles") is not None, "Only the exact path should be invalidated"
+            cache.invalidate("/guilds/1/roles")
+            assert cache.get(route, "/guilds/1/roles") is None
+
+            await http.request(Route("GET", "/users/@me"))
+            assert cache.get(route, "/users/@me") is None, "Routes without a TTL should not be cached"
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_uploads_are_streamed_again_on_retry(tmp_path):
+    received = []
+
+    async def handler(request: web.Request) -> web.Response:
+        form = await request.post()
+        received.append((form["payload_json"], form["files[0]"].file.read(), form["files[1]"].file.read()))
+        if len(received) == 1:
+            return web.json_response({"retry_after": 0}, status=429, headers={"Via": "1.1 google"})
+        return web.json_response({})
+
+    async def inner():
+        path = tmp_path / "upload.txt"
+        path.write_bytes(b"from a path")
+        server = await start_server(handler)
+        http = make_client()
+        http.api_base = str(server.make_url(""))
+        try:
+            route = Route("POST", "/channels/{channel_id}/messages", channel_id=1)
+            files = [File(path), File(BytesIO(b"from a file object"), "object.txt")]
+            await http.request(route, json={"content": "hi"}, files=files)
+            assert len(received) == 2
+            assert received[0] == received[1], "Retries should send the full files again"
+            assert received[1][1:] == (b"from a path", b"from a file object")
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_decoded_responses():
+    async def handler(request: web.Request) -> web.Response:
+        headers = {
+            "X-RateLimit-Bucket": "abc",
+            "X-RateLimit-Limit": "5",
+            "X-RateLimit-Remaining": "4",
+            "X-RateLimit-Reset": "9999999999",
+            "X-RateLimit-Reset-After": "1.5",
+        }
+        return web.json_response({"url": "wss://gateway.discord.gg"}, headers=headers)
+
+    async def inner():
+        server = await start_server(handler)
+        http = make_client()
+        http.api_base = str(server.make_url(""))
+        try:
+            r = await http.get_gateway_bot()
+            assert r.status == 200
+            assert r.data == {"url": "wss://gateway.discord.gg"}
+            assert (r.ratelimit.bucket, r.ratelimit.limit, r.ratelimit.remaining) == ("abc", 5, 4)
+            assert r.ratelimit.reset_after == 1.5
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_clients_can_share_a_session():
+    async def inner():
+        session = HTTPClient.create_session(connection_limit=10)
+        state = SimpleNamespace(type_sheet=TypeSheet.default(), token=None, loop=get_running_loop())
+        first = HTTPClient(state, session=session)  # type: ignore
+        second = HTTPClient(state, session=session)  # type: ignore
+        assert first.session is second.session is session
+        await first.close()
+        assert not session.closed, "Shared sessions should be closed by their owner"
+        await session.close()
+
+    run(inner())
+
+
+def test_server_errors_are_retried_if_idempotent():
+    received = []
+
+    async def handler(request: web.Request) -> web.Response:
+        received.append(request.method)
+        if len(received) % 3:
+            return web.Response(status=503, text="upstream connect error")
+        return web.json_response({})
+
+    async def inner():
+        server = await start_server(handler)
+        state = SimpleNamespace(type_sheet=TypeSheet.default(), token=None, loop=get_running_loop())
+        http = HTTPClient(state, retry_policy=RetryPolicy(backoff_base=0.01))  # type: ignore
+        http.api_base = str(server.make_url(""))
+        try:
+            r = await http.request(Route("GET", "/channels/{channel_id}", channel_id=1))
+            assert r.status == 200
+            assert received == ["GET"] * 3
+            try:
+                await http.request(Route("POST", "/channels/{channel_id}/messages", channel_id=1))
+            except HTTPException as error:
+                assert error.status_code == 503
+                assert error.message == "upstream connect error"
+            else:
+                raise AssertionError("Non-idempotent requests should not be retried")
+            assert received == ["GET"] * 3 + ["POST"]
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_timeout_while_waiting_frees_slot():
+    async def inner():
+        bucket = Bucket(Route("GET", "/"), "test")
+        bucket.limit = 1
+        bucket.reset_at = time() + 0.2
+        bucket.remaining = 1
+        await bucket.acquire()
+        try:
+            await wait_for(bucket.acquire(), 0.05)
+        except TimeoutError:
+            pass
+        else:
+            raise AssertionError("The bucket should be exhausted")
+        await bucket.release()
+        assert bucket._reserved == 0
+        assert bucket._pending_count == 0
+        # The reset should let a new request through straight away
+        await wait_for(bucket.acquire(), 1)
+        await bucket.release()
+
+    run(inner())
+
+
+def test_timeout_covers_decoding_and_releases_response():
+    async def handler(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "application/json"})
+        await response.prepare(request)
+        await response.write(b'{"a": ')
+        await sleep(1)
+        await response.write(b"1}")
+        return response
+
+    async def inner():
+        server = await start_server(handler)
+        http = make_client()
+        http.api_base = str(server.make_url(""))
+        try:
+            started_at = perf_counter()
+            try:
+                await http.request(Route("GET", "/gateway"), decode=True, timeout=0.2)
+            except TimeoutError:
+                pass
+            else:
+                raise AssertionError("Reading the body should time out")
+            assert perf_counter() - started_at < 0.5
+            assert not http.session.connector._acquired, "The response should be released"  # type: ignore
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_invalid_requests_slow_down_then_short_circuit():
+    tracker = InvalidRequestTracker(10, slowdown_at=0.5, short_circuit_at=0.8, max_delay=3)
+    for _ in range(6):
+        tracker.record()
+    assert tracker.remaining == 4
+    assert abs(tracker.delay() - 1) < 1e-9
+    assert tracker.delay(priority=1) == 0, "Essential requests should not be slowed down"
+    for _ in range(2):
+        tracker.record()
+    try:
+        tracker.delay()
+    except InvalidRequestLimitException as error:
+        assert error.remaining == 2
+    else:
+        raise AssertionError("Low priority requests should be refused")
+    assert tracker.delay(priority=1) == 0
+    for _ in range(2):
+        tracker.record()
+    try:
+        tracker.delay(priority=1)
+    except InvalidRequestLimitException:
+        pass
+    else:
+        raise AssertionError("Nothing should be sent once the limit is reached")
+
+
+def test_invalid_responses_use_up_budget():
+    received = []
+
+    async def handler(request: web.Request) -> web.Response:
+        received.append(request.path)
+        if request.path == "/shared":
+            headers = {"Retry-After": "0", "X-RateLimit-Scope": "shared", "via": "1.1 google"}
+            return web.json_response({"code": 0, "message": "Ratelimited"}, status=429, headers=headers)
+        return web.json_response({"code": 50001, "message": "Missing Access"}, status=403)
+
+    async def inner():
+        server = await start_server(handler)
+        state = SimpleNamespace(type_sheet=TypeSheet.default(), token=None, loop=get_running_loop())
+        tracker = InvalidRequestTracker(4, short_circuit_at=0.5)
+        http = HTTPClient(state, invalid_requests=tracker, max_retries=2)  # type: ignore
+        http.api_base = str(server.make_url(""))
+        try:
+            try:
+                await http.request(Route("GET", "/shared"))
+            except Exception:
+                pass
+            assert tracker.count == 0, "Shared ratelimits should not count"
+            for _ in range(2):
+                try:
+                    await http.request(Route("GET", "/forbidden"))
+                except HTTPException:
+                    pass
+            assert tracker.remaining == 2
+            try:
+                await http.request(Route("GET", "/forbidden"))
+            except InvalidRequestLimitException:
+                pass
+            else:
+                raise AssertionError("The request should have been refused")
+            assert received.count("/forbidden") == 2
+        finally:
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_route_templates_match_routes():
+    template = RouteTemplate("POST", "/channels/{channel_id}/messages")
+    route = template(channel_id=1)
+    expected = Route("POST", "/channels/{channel_id}/messages", channel_id=1)
+    assert route.path == expected.path == "/channels/1/messages"
+    assert route.ratelimit_key == expected.ratelimit_key
+    assert route.bucket == expected.bucket == "POST:/channels/{channel_id}/messages:None:1:None:None"
+    assert route.bucket is route.bucket, "The bucket key should only be built once"
+    assert not hasattr(route, "__dict__")
+    assert RouteTemplate("GET", "/gateway/bot")().path == "/gateway/bot"
+
+
+def test_metrics_are_recorded_and_exported():
+    responses = 0
+
+    async def handler(request: web.Request) -> web.Response:
+        nonlocal responses
+        responses += 1
+        if responses == 1:
+            headers = {"Retry-After": "0", "X-RateLimit-Scope": "shared", "via": "1.1 google"}
+            return web.json_response({"code": 0, "message": "Ratelimited"}, status=429, headers=headers)
+        return web.json_response({})
+
+    async def inner():
+        server = await start_server(handler)
+        metrics = HTTPMetrics()
+        state = SimpleNamespace(type_sheet=TypeSheet.default(), token=None, loop=get_running_loop())
+        http = HTTPClient(state, metrics=metrics)  # type: ignore
+        http.api_base = str(server.make_url(""))
+        try:
+            await http.request(Route("GET", "/channels/{channel_id}", channel_id=1))
+            key = ("GET", "/channels/{channel_id}")
+            assert metrics.latency[key].count == 2
+            assert metrics.bucket_wait[key].count == 2
+            assert metrics.responses[(*key, 429)] == 1
+            assert metrics.responses[(*key, 200)] == 1
+            assert metrics.ratelimits[(*key, "shared")] == 1
+            assert metrics.retries[(*key, "ratelimit")] == 1
+
+            await metrics.serve(port=0)
+            port = metrics._runner.addresses[0][1]
+            async with http.session.get(f"http://127.0.0.1:{port}/metrics") as r:
+                text = await r.text()
+            labels = 'method="GET",route="/channels/{channel_id}"'
+            assert f"nextcord_http_request_duration_seconds_count{{{labels}}} 2" in text
+            assert f'nextcord_http_ratelimits_total{{{labels},scope="shared"}} 1' in text
+            assert f"nextcord_http_bucket_queue_depth{{{labels}}} 0" in text
+        finally:
+            await metrics.close()
+            await http.close()
+            await server.close()
+
+    run(inner())
+
+
+def test_no_ratelimits_hit_against_mock_discord():
+    scenario = Scenario("test", requests=60, concurrency=10, channels=1, limit=10, reset_after=0.2, global_limit=None)
+    result = run(run_scenario(scenario))
+    assert result["failures"] == 0
+    assert result["ratelimit_429_rate"] == 0, "The client should never run into bucket ratelimits"
+    assert result["sent"] == 60
+
+
+def test_proxied_routes_match_routes():
+    route = ProxiedRoute("PATCH", "/channels/1234/messages/5678")
+    expected = Route("PATCH", "/channels/{id}/messages/{id}", id=1)
+    assert route.ratelimit_key == expected.ratelimit_key
+    assert route.major_parameters == "None:1234:None:None"
+    assert ProxiedRoute("POST", "/webhooks/1/token").use_webhook_global
+    assert ProxiedRoute("POST", "/webhooks/1/abc").ratelimit_key == ProxiedRoute("POST", "/webhooks/1/def").ratelimit_key
+    assert ProxiedRoute("POST", "/webhooks/1/abc").major_parameters == "None:None:1:abc"
+
+
+def test_proxy_reports_why_requests_were_not_forwarded():
+    async def inner():
+        invalid_requests = InvalidRequestTracker(10, window=30)
+        # Nothing listens on port 1
+        proxy = RatelimitProxy(
+            api_base="http://127.0.0.1:1",
+            retry_policy=RetryPolicy(max_retries=1),
+            invalid_requests=invalid_requests,
+        )
+        proxy_server = TestServer(proxy.app)
+        await proxy_server.start_server()
+        session = ClientSession()
+        try:
+            async with session.get(proxy_server.make_url("/users/@me")) as r:
+                assert r.status == 502, "Connection errors should be a bad gateway"
+            for _ in range(10):
+                invalid_requests.record()
+            async with session.get(proxy_server.make_url("/users/@me")) as r:
+                assert r.status == 503, "Refused requests should not look like a ratelimit"
+                assert 29 < float(r.headers["Retry-After"]) <= 30
+        finally:
+            await session.close()
+            await proxy_server.close()
+
+    run(inner())
+
+
+def test_clients_share_ratelimits_through_proxy():
+    async def inner():
+        mock = MockDiscord(limit=5, reset_after=0.2, global_limit=None)
+        api_base = await mock.start()
+        proxy = RatelimitProxy(api_base=api_base)
+        proxy_server = TestServer(proxy.app)
+        await proxy_server.start_server()
+        state = SimpleNamespace(type_sheet=TypeSheet.default(), token="token", loop=get_running_loop())
+        workers = [
+            HTTPClient(state, api_base=str(proxy_server.make_url("")), proxied=True) for _ in range(2)  # type: ignore
+        ]
+        try:
+            route = RouteTemplate("POST", "/channels/{channel_id}/messages")
+            # Let the proxy learn the limits first
+            await workers[0].request(route(channel_id=1))
+            responses = await gather(*(worker.request(route(channel_id=1)) for worker in workers for _ in range(10)))
+            assert [r.status for r in responses] == [200] * 20
+            assert mock.stats["requests"] == 21, "The proxy should never run into ratelimits"
+            assert not any(worker._buckets for worker in workers), "Proxied clients should not track buckets"
+        finally:
+            for worker in workers:
+                await worker.close()
+            await proxy_server.close()
+            await mock.close()
+
+    run(inner())